@@ -1,14 +1,16 @@
 from datetime import datetime, timezone
 import logging
 
-import httpx
 from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from starlette.requests import Request
 
-from governedrunner.db.database import get_db
+from governedrunner.db.database import get_async_db
 from governedrunner.db.models import User
 from . import demo
+from .identity import resolve_username
 from .settings import Settings
 
 logger = logging.getLogger(__name__)
@@ -21,16 +23,13 @@ async def _get_username_from_token(token: str):
     if not settings.user_profile_propname:
         logger.error('User profile property name is not set')
         raise HTTPException(status_code=500)
-    async with httpx.AsyncClient() as client:
-        user_info = await client.get(settings.user_profile_url, headers={
-            'Authorization': f'Bearer {token}',
-        })
-        logger.debug(f'Userinfo Response: {user_info}')
-        if not user_info.is_success:
-            logger.error('Failed to retrieve user information')
-            raise HTTPException(status_code=401)
-        logger.debug(f'Userinfo Content: {user_info.json()}')
-        return user_info.json()[settings.user_profile_propname]
+    username = await resolve_username(
+        token, settings.user_profile_url, settings.user_profile_propname,
+    )
+    if username is None:
+        logger.error('Failed to retrieve user information')
+        raise HTTPException(status_code=401)
+    return username
 
 
 async def get_username(request: Request):
@@ -48,18 +47,20 @@ async def get_username(request: Request):
         return await _get_username_from_token(token)
     raise HTTPException(status_code=401)
 
-def get_current_user(db: Session = Depends(get_db), username: str = Depends(get_username)):
+async def get_current_user(db: AsyncSession = Depends(get_async_db), username: str = Depends(get_username)):
     if settings.demo_user:
-        return demo.get_current_user(db)
-    u = db.query(User).filter(User.name == username).first()
+        return await demo.get_current_user(db)
+    u = await db.scalar(
+        select(User).options(selectinload(User.rdm_token)).where(User.name == username)
+    )
     if u is not None:
         return u
     u = User(
         name=username,
         created_at=datetime.now(timezone.utc),
         updated_at=datetime.now(timezone.utc),
+        rdm_token=None,
     )
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
     return u
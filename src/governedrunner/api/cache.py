@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import hashlib
+import time
+from typing import Any, Hashable, Iterator, Optional
+
+
+def token_hash(token: str) -> str:
+    '''
+    Return a digest of the token so that raw tokens are never used as keys.
+    '''
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+    value: Any
+    etag: Optional[str]
+    expires_at: float
+
+    def __init__(self, value: Any, expires_at: float, etag: Optional[str] = None):
+        self.value = value
+        self.expires_at = expires_at
+        self.etag = etag
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+
+class LRUCache:
+    '''
+    Size-bounded LRU cache whose entries expire after a TTL.
+
+    Expired entries are kept until evicted so that callers can revalidate them.
+    '''
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: Hashable, value: Any, etag: Optional[str] = None, ttl: Optional[float] = None) -> CacheEntry:
+        entry = CacheEntry(
+            value,
+            time.monotonic() + (self.ttl if ttl is None else ttl),
+            etag=etag,
+        )
+        if not self.enabled:
+            return entry
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def touch(self, key: Hashable):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return
+        entry.expires_at = time.monotonic() + self.ttl
+
+    def pop(self, key: Hashable) -> Optional[CacheEntry]:
+        return self._entries.pop(key, None)
+
+    def items(self) -> Iterator[tuple[Hashable, CacheEntry]]:
+        return iter(list(self._entries.items()))
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,13 +1,17 @@
 from datetime import datetime, timezone
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from governedrunner.db.models import User
 
 USERNAME = 'DEMO'
 CURRENT_USER_ID = 1
 
-def get_current_user(db: Session):
-    u = db.query(User).filter(User.id == CURRENT_USER_ID).first()
+async def get_current_user(db: AsyncSession):
+    u = await db.scalar(
+        select(User).options(selectinload(User.rdm_token)).where(User.id == CURRENT_USER_ID)
+    )
     if u is not None:
         return u
     u = User(
@@ -15,8 +19,8 @@ def get_current_user(db: Session):
         name=USERNAME,
         created_at=datetime.now(timezone.utc),
         updated_at=datetime.now(timezone.utc),
+        rdm_token=None,
     )
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
     return u
@@ -0,0 +1,37 @@
+import logging
+from typing import Optional
+
+from .cache import LRUCache, token_hash
+from .rdm import get_client
+from .settings import Settings
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+
+_identities = LRUCache(settings.identity_cache_max_entries, settings.identity_cache_ttl)
+
+
+async def resolve_username(token: str, user_profile_url: str, user_profile_propname: str) -> Optional[str]:
+    '''
+    Resolve the username of a bearer token with the user profile URL.
+
+    Results are cached by a hash of the token. Rejected tokens are cached for a
+    shorter time. Returns None if the token is rejected.
+    '''
+    key = (token_hash(token), user_profile_url, user_profile_propname)
+    entry = _identities.get(key)
+    if entry is not None and entry.fresh:
+        return entry.value
+    user_info = await get_client().get(user_profile_url, headers={
+        'Authorization': f'Bearer {token}',
+    })
+    logger.debug(f'Userinfo Response: {user_info}')
+    if user_info.status_code in (401, 403):
+        _identities.set(key, None, ttl=settings.identity_cache_negative_ttl)
+        return None
+    if not user_info.is_success:
+        return None
+    logger.debug(f'Userinfo Content: {user_info.json()}')
+    username = user_info.json()[user_profile_propname]
+    _identities.set(key, username)
+    return username
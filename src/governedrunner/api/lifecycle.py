@@ -0,0 +1,36 @@
+from ..db.database import async_engine
+from ..job.crates import index_writer
+from ..job.dockerapi import close_docker
+from ..job.pool import container_pool
+from ..job.spawners.rdmfs import rdmfs_sidecars
+from ..job.trackers.docker import container_events
+from .logstore import log_store
+from .rdm import close_client
+from .tasks import event_bus, job_queue, prepull_images
+
+
+async def startup():
+    '''
+    Start the job event bus and the job queue of the process.
+    '''
+    log_store.check_host()
+    await event_bus.start()
+    await job_queue.start()
+    await prepull_images()
+
+
+async def shutdown():
+    '''
+    Stop the job queue and release the resources shared by the jobs of the process.
+
+    Running jobs are not waited for; drain the job queue first to let them finish.
+    '''
+    await job_queue.stop()
+    await event_bus.stop()
+    await index_writer.flush_all()
+    await container_pool.close()
+    await rdmfs_sidecars.close()
+    await container_events.close()
+    await close_docker()
+    await close_client()
+    await async_engine.dispose()
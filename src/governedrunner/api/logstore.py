@@ -0,0 +1,177 @@
+from bisect import bisect_right
+import mmap
+import os
+import re
+import socket
+from typing import Optional
+
+from .settings import Settings
+
+
+settings = Settings()
+SEGMENT_PATTERN = re.compile(r'^(\d{20})\.log$')
+# Records the host that owns the log directory
+HOST_FILE = '.host'
+
+
+def _segment_name(start: int) -> str:
+    return f'{start:020d}.log'
+
+def _is_continuation(byte: int) -> bool:
+    return byte & 0xC0 == 0x80
+
+def char_boundaries(data: bytes) -> tuple[int, int]:
+    '''
+    Return the range of the data without split UTF-8 characters at its edges.
+    '''
+    start = 0
+    while start < len(data) and start < 3 and _is_continuation(data[start]):
+        start += 1
+    end = len(data)
+    # Find the lead byte of the last character and check that it is complete
+    lead = end - 1
+    while lead > start and end - lead < 4 and _is_continuation(data[lead]):
+        lead -= 1
+    if lead >= start:
+        byte = data[lead]
+        length = 1 if byte < 0x80 else 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+        if lead + length > end:
+            end = lead
+    return start, end
+
+
+class LogChunk:
+    offset: int
+    next_offset: int
+    size: int
+    text: str
+
+    def __init__(self, offset: int, next_offset: int, size: int, text: str):
+        self.offset = offset
+        self.next_offset = next_offset
+        self.size = size
+        self.text = text
+
+
+class JobLogStore:
+    '''
+    Append-only job logs stored as segment files named by their starting byte offset.
+
+    Ranges are read through memory maps, so only the requested pages are loaded.
+    '''
+
+    def __init__(self, base_dir: str, segment_size: int):
+        self.base_dir = base_dir
+        self.segment_size = segment_size
+
+    def check_host(self):
+        '''
+        Claim the log directory for this host, or fail if another host has claimed it.
+
+        The logs are read from the local file system, so the API and the workers
+        must run on the same host.
+        '''
+        os.makedirs(self.base_dir, exist_ok=True)
+        path = os.path.join(self.base_dir, HOST_FILE)
+        hostname = socket.gethostname()
+        try:
+            with open(path, 'x') as f:
+                f.write(hostname)
+            return
+        except FileExistsError:
+            pass
+        with open(path) as f:
+            owner = f.read().strip()
+        if owner != hostname:
+            raise RuntimeError(
+                f'The log directory {self.base_dir} is used by another host: {owner}; '
+                f'the API and the workers must run on the same host '
+                f'(remove {path} if the host has been renamed)'
+            )
+
+    def _job_dir(self, job_id: str) -> str:
+        if os.path.sep in job_id or job_id in ('', '.', '..'):
+            raise ValueError(f'Invalid job ID: {job_id}')
+        return os.path.join(self.base_dir, job_id)
+
+    def _segments(self, job_id: str) -> list[tuple[int, str]]:
+        job_dir = self._job_dir(job_id)
+        if not os.path.isdir(job_dir):
+            return []
+        segments = []
+        for name in os.listdir(job_dir):
+            m = SEGMENT_PATTERN.match(name)
+            if m:
+                segments.append((int(m.group(1)), os.path.join(job_dir, name)))
+        return sorted(segments)
+
+    def exists(self, job_id: str) -> bool:
+        return len(self._segments(job_id)) > 0
+
+    def size(self, job_id: str) -> int:
+        segments = self._segments(job_id)
+        if len(segments) == 0:
+            return 0
+        start, path = segments[-1]
+        return start + os.path.getsize(path)
+
+    def append(self, job_id: str, log: str):
+        data = log.encode('utf-8')
+        if len(data) == 0:
+            return
+        segments = self._segments(job_id)
+        if len(segments) == 0:
+            os.makedirs(self._job_dir(job_id), exist_ok=True)
+            start, path = 0, os.path.join(self._job_dir(job_id), _segment_name(0))
+        else:
+            start, path = segments[-1]
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size > 0 and size + len(data) > self.segment_size:
+            start = start + size
+            path = os.path.join(self._job_dir(job_id), _segment_name(start))
+        with open(path, 'ab') as f:
+            f.write(data)
+
+    def read_bytes(self, job_id: str, offset: int, limit: int) -> bytes:
+        segments = self._segments(job_id)
+        if len(segments) == 0 or limit <= 0:
+            return b''
+        starts = [start for start, _ in segments]
+        index = max(bisect_right(starts, offset) - 1, 0)
+        end = offset + limit
+        parts = []
+        for start, path in segments[index:]:
+            if start >= end:
+                break
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0 or start + size <= offset:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    parts.append(m[max(offset - start, 0):min(end - start, size)])
+        return b''.join(parts)
+
+    def read(self, job_id: str, offset: Optional[int], limit: int) -> LogChunk:
+        '''
+        Read up to `limit` bytes from `offset`, or the last `limit` bytes if `offset` is None.
+
+        The range is narrowed so that it does not split UTF-8 characters.
+        '''
+        size = self.size(job_id)
+        if offset is None:
+            offset = max(size - limit, 0)
+        offset = min(offset, size)
+        data = self.read_bytes(job_id, offset, limit)
+        start, end = char_boundaries(data)
+        return LogChunk(
+            offset + start,
+            offset + end,
+            size,
+            data[start:end].decode('utf-8', errors='replace'),
+        )
+
+    def tail(self, job_id: str, limit: int) -> str:
+        return self.read(job_id, None, limit).text
+
+
+log_store = JobLogStore(settings.job_log_dir, settings.job_log_segment_size)
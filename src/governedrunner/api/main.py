@@ -2,10 +2,12 @@ from fastapi import FastAPI
 from fastapi_pagination import add_pagination
 from fastapi.middleware.cors import CORSMiddleware
 
-from ..db.database import Base, engine
+from ..db.database import Base, engine, add_missing_columns
+from .lifecycle import startup, shutdown
 from .routers import server, user, job, rdm
 
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
 
 app = FastAPI()
 
@@ -16,6 +18,9 @@ app.include_router(rdm.router)
 
 add_pagination(app)
 
+app.add_event_handler('startup', startup)
+app.add_event_handler('shutdown', shutdown)
+
 origins = [
     "http://localhost",
     "http://localhost:8000",
@@ -1,4 +1,4 @@
-from .server import ServerOut
+from .server import ServerOut, StatsOut
 from .user import UserOut
-from .job import JobOut
-from .rdm import NodeOut, ProviderOut, FileOut
\ No newline at end of file
+from .job import JobOut, JobLogOut, JobPageOut
+from .rdm import NodeOut, ProviderOut, FileOut, CrateIndexOut
@@ -1,16 +1,19 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
-from pydantic import BaseModel, Field, root_validator
-from pydantic.utils import GetterDict
+from typing import Any, Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 from governedrunner.config import config
+from ..logstore import log_store
+from ..settings import Settings
 
 
 PREFIX = config('GOVERNEDRUNNER_BASE_PATH', cast=str, default='')
+settings = Settings()
 
 
 class State(str, Enum):
+    queued = 'queued'
     building = 'building'
     running = 'running'
     completed = 'completed'
@@ -29,19 +32,48 @@ class ProgressOut(BaseModel):
     url: Optional[str]
 
 
+def _get_log_tail(job) -> dict:
+    if 'log' not in job.__dict__:
+        # The deferred log column is not loaded: the log is not requested
+        return {}
+    if log_store.exists(job.id):
+        chunk = log_store.read(job.id, None, settings.job_log_tail_bytes)
+        return {'log': chunk.text, 'log_size': chunk.size}
+    # Jobs created before the log store
+    log = job.__dict__.get('log', None)
+    if log is None:
+        return {'log': None, 'log_size': None}
+    size = len(log.encode('utf-8'))
+    return {'log': log[-settings.job_log_tail_bytes:], 'log_size': size}
+
+
+class JobLogOut(BaseModel):
+    offset: int = Field(description='The byte offset of the first character')
+    next_offset: int = Field(description='The byte offset to read the following part from')
+    size: int = Field(description='The size of the whole log in bytes')
+    log: str
+
+
 class JobOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: str = Field(example='JOB_ID')
     created_at: datetime
     updated_at: datetime
-    status: Optional[State]
-    source: Optional[SourceOut]
-    result: Optional[ResultOut]
-    progress: Optional[ProgressOut]
-    notebook: Optional[str]
-    log: Optional[str]
-
-    @root_validator(pre=True)
-    def get_result_value(cls, values: GetterDict) -> GetterDict:
+    status: Optional[State] = None
+    source: Optional[SourceOut] = None
+    result: Optional[ResultOut] = None
+    progress: Optional[ProgressOut] = None
+    notebook: Optional[str] = None
+    log: Optional[str] = Field(None, description='The last part of the log')
+    log_size: Optional[int] = Field(None, description='The size of the whole log in bytes')
+
+    @model_validator(mode='before')
+    @classmethod
+    def get_result_value(cls, values: Any) -> Any:
+        if isinstance(values, dict):
+            # Already converted, e.g. when the response is validated again
+            return values
         source = None
         if values.source_url is not None:
             source = {
@@ -54,14 +86,25 @@ class JobOut(BaseModel):
                 'progress': {
                     'url': PREFIX + f'/ws/jobs/{values.id}/progress',
                 },
-            } | values.__dict__
+            } | values.__dict__ | _get_log_tail(values)
         return {
             'source': source,
             'result': {
                 'url': values.result_url,
             },
             'progress': None,
-        } | values.__dict__
+        } | values.__dict__ | _get_log_tail(values)
+
+
+JOB_FIELDS = [
+    'id', 'created_at', 'updated_at', 'status', 'source', 'result', 'progress',
+    'notebook', 'log', 'log_size',
+]
+LOG_FIELDS = ['log', 'log_size']
+DEFAULT_JOB_FIELDS = [name for name in JOB_FIELDS if name not in LOG_FIELDS]
+
 
-    class Config:
-        orm_mode = True
+class JobPageOut(BaseModel):
+    items: list[JobOut]
+    size: int
+    next_cursor: Optional[str] = Field(None, description='The cursor to retrieve the next page, or null on the last page')
@@ -32,3 +32,14 @@ class FileOut(BaseRDMModel):
     created_at: Optional[str] = Field(example='2021-01-01T00:00:00.000000+00:00')
     updated_at: Optional[str] = Field(example='2021-01-01T00:00:00.000000+00:00')
     content: Optional[Any]
+
+class CrateIndexOut(BaseModel):
+    notebook: str = Field(example='path/to/notebook.ipynb')
+    id: str = Field(example='JOB_ID')
+    created_at: Optional[str] = Field(example='2021-01-01T00:00:00.000000+00:00')
+    updated_at: Optional[str] = Field(example='2021-01-01T00:00:00.000000+00:00')
+    name: Optional[str] = Field(example='JOB_ID.json')
+    status: Optional[str] = Field(example='completed')
+    links: list[dict[str, str]] = Field(
+        example=[{'rel': 'web', 'href': 'https://rdm.nii.ac.jp/xxxxx/files/osfstorage/.crates/JOB_ID.json'}],
+    )
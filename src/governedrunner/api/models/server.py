@@ -4,3 +4,13 @@ from governedrunner import __version__
 
 class ServerOut(BaseModel):
     version: str = Field(example=__version__)
+
+class StatsOut(BaseModel):
+    rdm_singleflight: dict[str, int] = Field(
+        description='GET requests to GakuNin RDM, and how many of them joined an identical in-flight request',
+        example={'calls': 100, 'deduplicated': 20},
+    )
+    docker: dict[str, dict[str, float]] = Field(
+        description='Docker API calls by operation: calls, errors, wait_seconds, seconds and max_seconds',
+        example={'containers.get': {'calls': 10, 'errors': 0, 'wait_seconds': 0.0, 'seconds': 0.5, 'max_seconds': 0.1}},
+    )
@@ -1,10 +1,9 @@
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 class UserOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int = Field(example='1')
     created_at: datetime
     name: str
-
-    class Config:
-        orm_mode = True
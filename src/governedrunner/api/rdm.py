@@ -1,21 +1,148 @@
+import asyncio
+from collections import OrderedDict
+import copy
 import httpx
 import json
 import logging
+from typing import Any, Optional
+from urllib.parse import urlparse, parse_qs
 
 from fastapi import (
     HTTPException,
 )
 from governedrunner.db.models import User, RDMToken
+from .cache import LRUCache, token_hash
 from .settings import Settings
 
 logger = logging.getLogger(__name__)
 settings = Settings()
 
+_client: Optional[httpx.AsyncClient] = None
+_host_semaphores: dict[str, asyncio.Semaphore] = {}
+metadata_cache = LRUCache(settings.rdm_cache_max_entries, settings.rdm_cache_ttl)
+_inflight_gets: dict[tuple[str, str], asyncio.Future] = {}
+# Incremented by every invalidation. Paths are mapped to the generation of their
+# last invalidation, so that a GET can tell whether its response became stale
+# while in flight.
+_generation = 0
+_invalidated_paths: OrderedDict[str, int] = OrderedDict()
+# The latest generation dropped from _invalidated_paths
+_forgotten_generation = 0
+# Counters of GET requests coalesced by RDMService.get
+singleflight_stats = {
+    'calls': 0,
+    'deduplicated': 0,
+}
+
+
+def get_client() -> httpx.AsyncClient:
+    '''
+    Return the process-wide HTTP client shared by all RDMService instances.
+    '''
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=settings.rdm_http2,
+            limits=httpx.Limits(
+                max_connections=settings.rdm_max_connections,
+                max_keepalive_connections=settings.rdm_max_keepalive_connections,
+                keepalive_expiry=settings.rdm_keepalive_expiry,
+            ),
+            timeout=settings.rdm_timeout,
+        )
+    return _client
+
+async def close_client():
+    global _client
+    logger.info(f'RDM GET requests: {singleflight_stats}')
+    if _client is None:
+        return
+    client = _client
+    _client = None
+    _host_semaphores.clear()
+    await client.aclose()
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = urlparse(url).netloc
+    semaphore = _host_semaphores.get(host, None)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(settings.rdm_max_connections_per_host)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+def strip_query(url: str) -> str:
+    return url.split('?', 1)[0]
+
+def _parent_path(path: str) -> str:
+    return path.rstrip('/').rsplit('/', 1)[0] + '/'
+
+def _modified_since(path: str, generation: int) -> bool:
+    '''
+    Whether the path, or an entry listed in it, was invalidated after the generation.
+    '''
+    if _forgotten_generation > generation:
+        return True
+    return _invalidated_paths.get(path, 0) > generation
+
+def _is_metadata_url(url: str) -> bool:
+    '''
+    Folder listings end with a slash and file metadata is requested with `?meta=`.
+    File contents are never cached.
+    '''
+    parsed = urlparse(url)
+    if parsed.path.endswith('/'):
+        return True
+    return 'meta' in parse_qs(parsed.query, keep_blank_values=True)
+
+def _linked_paths(content: Any) -> set[str]:
+    if not isinstance(content, dict):
+        return set()
+    data = content.get('data', None)
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        return set()
+    paths = set()
+    for entry in data:
+        links = entry.get('links', None) if isinstance(entry, dict) else None
+        if not isinstance(links, dict):
+            continue
+        paths.update(strip_query(link) for link in links.values() if isinstance(link, str))
+    return paths
+
+def invalidate_metadata(url: str):
+    '''
+    Drop cached listings and metadata of the URL, and listings which contain it.
+    '''
+    global _generation, _forgotten_generation
+    path = strip_query(url)
+    # The folder listing of the parent contains the path, even if it is a new file
+    modified_paths = (path, _parent_path(path))
+    _generation += 1
+    for modified in modified_paths:
+        _invalidated_paths[modified] = _generation
+        _invalidated_paths.move_to_end(modified)
+    while len(_invalidated_paths) > max(settings.rdm_cache_max_entries, 1):
+        _, forgotten = _invalidated_paths.popitem(last=False)
+        _forgotten_generation = max(_forgotten_generation, forgotten)
+    for key, entry in metadata_cache.items():
+        cached_url, _ = key
+        if strip_query(cached_url) in modified_paths or path in _linked_paths(entry.value):
+            metadata_cache.pop(key)
+    # Requests started before the modification must not be joined anymore
+    for key in list(_inflight_gets.keys()):
+        inflight_url, _ = key
+        if strip_query(inflight_url) in modified_paths:
+            del _inflight_gets[key]
+
+
 class RDMService:
     current_user: User
 
     def __init__(self, current_user: User):
         self.current_user = current_user
+        # Folder URL (without query) -> governedrunner.job.wb.FolderIndex
+        self.folder_indices = {}
 
     @property
     def _rdm_token(self) -> RDMToken:
@@ -61,18 +188,111 @@ class RDMService:
         }
         return headers
 
+    async def _request(self, method, url, headers=None, **kwargs) -> httpx.Response:
+        async with _host_semaphore(url):
+            resp = await get_client().request(
+                method, url, headers=self._headers | (headers or {}), **kwargs,
+            )
+        if resp.is_error:
+            logger.error(f'Failed to request to GakuNin RDM: {resp}')
+            raise HTTPException(status_code=resp.status_code)
+        return resp
+
     async def get(self, url):
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, headers=self._headers)
-            if resp.is_error:
-                logger.error(f'Failed to request to GakuNin RDM: {resp}')
-                raise HTTPException(status_code=resp.status_code)
-            return resp.json()
+        '''
+        GET the URL as JSON. Concurrent identical requests with the same token share one request.
+        '''
+        singleflight_stats['calls'] += 1
+        key = (url, token_hash(self.access_token))
+        inflight = _inflight_gets.get(key, None)
+        if inflight is not None:
+            singleflight_stats['deduplicated'] += 1
+            logger.debug(f'Joined in-flight request: {url}')
+            try:
+                content = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The request was cancelled by its originator
+                return await self.get(url)
+            return copy.deepcopy(content)
+        inflight = asyncio.get_running_loop().create_future()
+        _inflight_gets[key] = inflight
+        try:
+            content = await self._get(url)
+        except asyncio.CancelledError:
+            inflight.cancel()
+            raise
+        except BaseException as e:
+            inflight.set_exception(e)
+            # Mark as retrieved even if nobody joined
+            inflight.exception()
+            raise
+        else:
+            inflight.set_result(content)
+        finally:
+            if _inflight_gets.get(key, None) is inflight:
+                del _inflight_gets[key]
+        return copy.deepcopy(content)
 
-    async def put(self, url, json=None):
-        async with httpx.AsyncClient() as client:
-            resp = await client.put(url, json=json, headers=self._headers)
-            if resp.is_error:
-                logger.error(f'Failed to request to GakuNin RDM: {resp}')
-                raise HTTPException(status_code=resp.status_code)
+    async def _get(self, url):
+        if not metadata_cache.enabled or not _is_metadata_url(url):
+            resp = await self._request('GET', url)
             return resp.json()
+        key = (url, token_hash(self.access_token))
+        entry = metadata_cache.get(key)
+        if entry is not None and entry.fresh:
+            return entry.value
+        headers = {}
+        if entry is not None and entry.etag is not None:
+            headers['If-None-Match'] = entry.etag
+        generation = _generation
+        resp = await self._request('GET', url, headers=headers)
+        stale = _modified_since(strip_query(url), generation)
+        if resp.status_code == 304 and entry is not None:
+            logger.debug(f'Revalidated: {url}')
+            if not stale:
+                metadata_cache.touch(key)
+            return entry.value
+        content = resp.json()
+        if stale:
+            # Modified while the request was in flight; the response may predate it
+            logger.debug(f'Not caching the response to {url}: modified while in flight')
+        else:
+            metadata_cache.set(key, content, etag=resp.headers.get('ETag', None))
+        return content
+
+    async def get_text(self, url) -> str:
+        resp = await self._request('GET', url)
+        return resp.text
+
+    async def put(self, url, json=None, content=None):
+        resp = await self._request('PUT', url, json=json, content=content)
+        invalidate_metadata(url)
+        return resp.json()
+
+    async def delete(self, url):
+        await self._request('DELETE', url)
+        invalidate_metadata(url)
+
+    async def open_stream(self, url, headers=None) -> httpx.Response:
+        '''
+        Send a GET request without reading the body.
+
+        The caller is responsible for closing the returned response.
+        '''
+        client = get_client()
+        request = client.build_request('GET', url, headers=self._headers | (headers or {}))
+        resp = await client.send(request, stream=True)
+        if resp.is_error:
+            await resp.aclose()
+            logger.error(f'Failed to request to GakuNin RDM: {resp}')
+            raise HTTPException(status_code=resp.status_code)
+        return resp
+
+    def invalidate(self, url):
+        '''
+        Forget cached metadata of the URL, e.g. after it was modified out of band.
+        '''
+        invalidate_metadata(url)
+        self.folder_indices.pop(strip_query(url), None)
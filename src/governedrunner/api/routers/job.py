@@ -1,27 +1,32 @@
+import base64
 from datetime import datetime, timezone
 from enum import Enum
+import json
 import logging
 import uuid
 from typing import Optional, Annotated
 
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
     HTTPException,
     Form,
+    Query,
 )
-from fastapi_pagination import Page
-from fastapi_pagination.ext.sqlalchemy import paginate
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from starlette.concurrency import run_in_threadpool
 
 from governedrunner.api.auth import get_current_user
-from governedrunner.api.models import JobOut
-from governedrunner.api.models.job import State
-from governedrunner.api.tasks import create_new_job
-from governedrunner.api.tasks.job import create_new_job_queue
-from governedrunner.db.database import get_db
+from governedrunner.api.logstore import log_store
+from governedrunner.api.models import JobOut, JobLogOut, JobPageOut
+from governedrunner.api.models.job import State, JOB_FIELDS, LOG_FIELDS, DEFAULT_JOB_FIELDS
+from governedrunner.api.settings import Settings
+from governedrunner.api.tasks import job_queue
+from governedrunner.db.database import get_async_db
 from governedrunner.db.models import Job, User
 
 
@@ -32,68 +37,158 @@ class FileType(str, Enum):
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
+settings = Settings()
+MAX_LOG_READ_BYTES = 16 * 1024 * 1024
 
 
-@router.get('/jobs/', response_model=Page[JobOut])
-def retrieve_jobs(
+@router.get('/jobs/', response_model=JobPageOut)
+async def retrieve_jobs(
     current_user: Annotated[User, Depends(get_current_user)],
     state: Optional[State] = None,
     notebook: Optional[str] = None,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = Query(None, description=f'Comma-separated fields to include: {", ".join(JOB_FIELDS)}'),
+    cursor: Optional[str] = Query(None, description='The cursor returned as next_cursor'),
+    size: int = Query(50, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
 ):
     '''
-    現在のユーザーが実行した全てのジョブを取得します。
+    現在のユーザーが実行した全てのジョブを更新日時の新しい順に取得します。ログはfieldsで指定した場合のみ返します。実行中のジョブは更新されるとページの間を移動するため、カーソルで重複や欠落なく辿れるのは終了したジョブのみです。
     '''
+    selected = _parse_fields(fields)
     query = select(Job).where(Job.owner == current_user)
     if state is not None:
         query = query.filter(Job.status == state)
     if notebook is not None:
         query = query.filter(Job.notebook == notebook)
-    return paginate(db, query.order_by(Job.updated_at))
+    if cursor is not None:
+        updated_at, job_id = _decode_cursor(cursor)
+        query = query.filter(or_(
+            Job.updated_at < updated_at,
+            and_(Job.updated_at == updated_at, Job.id < job_id),
+        ))
+    if any(name in LOG_FIELDS for name in selected):
+        query = query.options(undefer(Job.log))
+    jobs = (await db.scalars(query.order_by(Job.updated_at.desc(), Job.id.desc()).limit(size + 1))).all()
+    next_cursor = None
+    if len(jobs) > size:
+        jobs = jobs[:size]
+        next_cursor = _encode_cursor(jobs[-1])
+    # The log tails are read from the log store
+    items = await run_in_threadpool(lambda: [JobOut.model_validate(job) for job in jobs])
+    page = JobPageOut(
+        items=items,
+        size=size,
+        next_cursor=next_cursor,
+    )
+    return JSONResponse(jsonable_encoder(page, include={
+        'items': {'__all__': set(selected)},
+        'size': True,
+        'next_cursor': True,
+    }))
 
 
 @router.post('/jobs/', response_model=JobOut)
-def create_job(
+async def create_job(
     current_user: Annotated[User, Depends(get_current_user)],
-    bakcground_tasks: BackgroundTasks,
     file_url: str = Form(),
     type: FileType = Form(FileType.run_crate),
     use_snapshot: bool = Form(False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     '''
-    ジョブを実行します。
+    ジョブを実行待ちにします。
     '''
     job_id = str(uuid.uuid4())
     if type == FileType.run_crate:
         file_url = f'crate+{file_url}'
-    create_new_job_queue(job_id)
     job = Job(
         id=job_id,
         created_at=datetime.now(timezone.utc),
         updated_at=datetime.now(timezone.utc),
         owner=current_user,
+        status=State.queued.value,
         source_url=file_url,
         use_snapshot=use_snapshot,
     )
     db.add(job)
-    db.commit()
-    db.refresh(job)
-    
-    bakcground_tasks.add_task(create_new_job, job_id)
-    return job
+    await db.commit()
+    await db.refresh(job)
+
+    job_queue.notify()
+    return JobOut.model_validate(job)
 
 
 @router.get('/jobs/{job_id}', response_model=JobOut)
-def retrieve_job(
+async def retrieve_job(
     current_user: Annotated[User, Depends(get_current_user)],
     job_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     '''
     指定されたジョブ情報を取得します。
     '''
-    job = db.query(Job).filter(Job.id == job_id and Job.owner == current_user).first()
+    job = await _get_job(db, current_user, job_id)
+    return await run_in_threadpool(JobOut.model_validate, job)
+
+
+@router.get('/jobs/{job_id}/log', response_model=JobLogOut)
+async def retrieve_job_log(
+    current_user: Annotated[User, Depends(get_current_user)],
+    job_id: str,
+    offset: Optional[int] = Query(None, ge=0),
+    limit: int = Query(settings.job_log_tail_bytes, ge=1, le=MAX_LOG_READ_BYTES),
+    db: AsyncSession = Depends(get_async_db),
+):
+    '''
+    指定されたジョブのログの一部を取得します。offsetを省略すると末尾を返します。
+    '''
+    job = await _get_job(db, current_user, job_id)
+    if await run_in_threadpool(log_store.exists, job.id) or job.log is None:
+        chunk = await run_in_threadpool(log_store.read, job.id, offset, limit)
+        return JobLogOut(offset=chunk.offset, next_offset=chunk.next_offset, size=chunk.size, log=chunk.text)
+    # Jobs created before the log store
+    data = job.log.encode('utf-8')
+    if offset is None:
+        offset = max(len(data) - limit, 0)
+    offset = min(offset, len(data))
+    text = data[offset:offset + limit].decode('utf-8', errors='ignore')
+    return JobLogOut(
+        offset=offset,
+        next_offset=offset + len(text.encode('utf-8')),
+        size=len(data),
+        log=text,
+    )
+
+
+def _parse_fields(fields: Optional[str]) -> list[str]:
+    if fields is None:
+        return DEFAULT_JOB_FIELDS
+    selected = [name.strip() for name in fields.split(',') if len(name.strip()) > 0]
+    unknown = [name for name in selected if name not in JOB_FIELDS]
+    if len(unknown) > 0:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def _encode_cursor(job: Job) -> str:
+    value = json.dumps([job.updated_at.isoformat(), job.id])
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        updated_at, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(updated_at), str(job_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _get_job(db: AsyncSession, current_user: User, job_id: str) -> Job:
+    job = await db.scalar(
+        select(Job)
+        .options(undefer(Job.log))
+        .where(Job.id == job_id, Job.owner == current_user)
+    )
     if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
@@ -15,16 +15,22 @@ from fastapi_pagination.api import apply_items_transformer, create_page
 from fastapi_pagination.bases import AbstractParams
 from fastapi_pagination.types import AdditionalData, ItemsTransformer
 from fastapi_pagination.utils import verify_params
+from starlette.background import BackgroundTask
 from starlette.requests import Request
+from starlette.responses import StreamingResponse
 
 from governedrunner.api.rdm import RDMService
 from governedrunner.api.auth import get_current_user
-from governedrunner.api.models import NodeOut, ProviderOut, FileOut
+from governedrunner.api.models import NodeOut, ProviderOut, FileOut, CrateIndexOut
+from governedrunner.api.settings import Settings, CRATE_FOLDER_NAME
+from governedrunner.job.crates import read_index
+from governedrunner.job.wb import find_file_by_name
 from governedrunner.db.models import User
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
+settings = Settings()
 
 Page = Page.with_custom_options(
     size=Query(10, ge=1, le=50),
@@ -33,6 +39,24 @@ Page = Page.with_custom_options(
 class FileAction(str, Enum):
     download = 'download'
     meta = 'meta'
+    raw = 'raw'
+
+STREAM_REQUEST_HEADERS = [
+    'Range',
+    'If-Range',
+    'If-None-Match',
+    'If-Modified-Since',
+]
+STREAM_RESPONSE_HEADERS = [
+    'Content-Type',
+    'Content-Length',
+    'Content-Encoding',
+    'Content-Range',
+    'Content-Disposition',
+    'Accept-Ranges',
+    'ETag',
+    'Last-Modified',
+]
 
 def get_rdm_service(current_user: Annotated[User, Depends(get_current_user)]):
     return RDMService(current_user)
@@ -63,6 +87,10 @@ def _create_links(request: Request, rdm: RDMService, requested_path: str, file:
             'rel': 'meta',
             'href': f'{request.url.scheme}://{request.url.netloc}{requested_path}{file["id"]}?action={FileAction.meta}',
         })
+        links.append({
+            'rel': 'raw',
+            'href': f'{request.url.scheme}://{request.url.netloc}{requested_path}{file["id"]}?action={FileAction.raw}',
+        })
         links.append({
             'rel': 'web',
             'href': f'{rdm.web_url}/{file["attributes"]["resource"]}/files/{file["attributes"]["provider"]}{file["attributes"]["path"]}',
@@ -89,6 +117,24 @@ def _create_file_out(request: Request, rdm: RDMService, requested_path: str, f:
         content=content,
     )
 
+async def _stream_file(request: Request, rdm: RDMService, url: str):
+    headers = {
+        name: request.headers[name]
+        for name in STREAM_REQUEST_HEADERS
+        if name in request.headers
+    }
+    resp = await rdm.open_stream(url, headers=headers)
+    return StreamingResponse(
+        resp.aiter_raw(settings.rdm_stream_chunk_size),
+        status_code=resp.status_code,
+        headers={
+            name: resp.headers[name]
+            for name in STREAM_RESPONSE_HEADERS
+            if name in resp.headers
+        },
+        background=BackgroundTask(resp.aclose),
+    )
+
 async def _paginate_rdm_api(
     rdm: RDMService,
     base_url: str,
@@ -212,6 +258,26 @@ async def retrieve_node_children(
         ) for node in nodes],
     )
 
+@router.get(
+    '/nodes/{node_id}/crates/{provider_id}/',
+    response_model=list[CrateIndexOut],
+)
+async def retrieve_node_crates(
+    node_id: str,
+    provider_id: str,
+    notebook: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    rdm: RDMService = Depends(get_rdm_service),
+):
+    '''
+    指定されたストレージプロバイダの実行結果の索引を新しい順に取得します。
+    '''
+    parent_folder_url = f'{rdm.files_url}/resources/{node_id}/providers/{provider_id}/'
+    crate_folder = await find_file_by_name(rdm, parent_folder_url, CRATE_FOLDER_NAME)
+    if crate_folder is None:
+        return []
+    return await read_index(rdm, crate_folder['links']['upload'], limit=limit, notebook=notebook)
+
 @router.get(
     '/nodes/{node_id}/providers/{provider_id}/',
     response_model=Page[FileOut],
@@ -241,7 +307,11 @@ async def retrieve_node_files(
 ):
     '''
     指定されたストレージプロバイダのパスにあるファイルを取得します。
+    action=downloadまたはaction=rawの場合はファイルの内容をそのまま返します。
     '''
+    # The contents are streamed without being loaded in memory
+    if action in (FileAction.download, FileAction.raw):
+        return await _stream_file(request, rdm, f'{rdm.files_url}/resources/{node_id}/providers/{provider_id}/{filepath}')
     file_info = await rdm.get(f'{rdm.files_url}/resources/{node_id}/providers/{provider_id}/{filepath}?meta=')
     files = file_info['data']
     requested_base_path = f'/nodes/{node_id}/providers/{provider_id}'
@@ -251,10 +321,6 @@ async def retrieve_node_files(
         raise ValueError(f'Unexpected path: {requested_path}')
     requested_path = requested_path[:requested_path.index(requested_base_path) +
                                     len(requested_base_path_without_provider)]
-    content = None
     if not isinstance(files, list):
-        content = None
-        if action == FileAction.download:
-            content = await rdm.get(f'{rdm.files_url}/resources/{node_id}/providers/{provider_id}/{filepath}')
-        return paginate([_create_file_out(request, rdm, requested_path, files, content)])
+        return paginate([_create_file_out(request, rdm, requested_path, files)])
     return paginate([_create_file_out(request, rdm, requested_path, f) for f in files])
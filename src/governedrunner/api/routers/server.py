@@ -1,7 +1,13 @@
-from fastapi import APIRouter
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
 
 from governedrunner import __version__
-from governedrunner.api.models import ServerOut
+from governedrunner.api.auth import get_current_user
+from governedrunner.api.models import ServerOut, StatsOut
+from governedrunner.api.rdm import singleflight_stats
+from governedrunner.db.models import User
+from governedrunner.job.dockerapi import docker_stats
 
 
 router = APIRouter()
@@ -15,3 +21,14 @@ def retrieve_server():
     return {
         'version': __version__,
     }
+
+
+@router.get('/stats', response_model=StatsOut)
+def retrieve_stats(current_user: Annotated[User, Depends(get_current_user)]):
+    '''
+    このプロセスの外部API呼び出しの統計です。
+    '''
+    return {
+        'rdm_singleflight': singleflight_stats,
+        'docker': docker_stats,
+    }
@@ -15,6 +15,40 @@ class Settings(BaseSettings):
     jupyterhub_config: Optional[str] = None
     user_profile_url: Optional[str] = None
     user_profile_propname: Optional[str] = None
+    rdm_http2: bool = True
+    rdm_max_connections: int = 100
+    rdm_max_keepalive_connections: int = 20
+    rdm_max_connections_per_host: int = 20
+    rdm_keepalive_expiry: float = 30.0
+    rdm_timeout: float = 60.0
+    rdm_cache_ttl: float = 30.0
+    rdm_cache_max_entries: int = 1024
+    rdm_stream_chunk_size: int = 65536
+    crate_index_segment_size: int = 1024 * 1024
+    crate_index_flush_delay: float = 2.0
+    crate_index_compact_segments: int = 16
+    job_workers: int = 2
+    job_queue_poll_interval: float = 5.0
+    job_lease_duration: float = 60.0
+    identity_cache_ttl: float = 60.0
+    identity_cache_negative_ttl: float = 10.0
+    identity_cache_max_entries: int = 1024
+    job_log_flush_interval: float = 1.0
+    job_log_flush_bytes: int = 64 * 1024
+    job_log_max_bytes: int = 64 * 1024 * 1024
+    job_log_dir: str = './logs'
+    job_log_segment_size: int = 8 * 1024 * 1024
+    job_log_tail_bytes: int = 64 * 1024
+    job_progress_buffer_bytes: int = 1024 * 1024
+    job_progress_frame_bytes: int = 64 * 1024
+    job_progress_coalesce_interval: float = 0.1
+    job_progress_retention: float = 60.0
+    job_progress_check_interval: float = 10.0
+    job_event_bus: str = 'unix'
+    job_event_socket: str = './gr-events.sock'
+    docker_max_concurrency: int = 16
+    docker_image_cache_ttl: float = 30.0
+    docker_image_cache_max_entries: int = 256
 
     _config: Config = None
 
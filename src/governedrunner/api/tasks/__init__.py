@@ -1 +1,3 @@
-from .job import create_new_job
+from .job import create_new_job, prepull_images
+from .queue import job_queue
+from .events import event_bus
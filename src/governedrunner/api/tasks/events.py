@@ -0,0 +1,250 @@
+import asyncio
+from collections.abc import Callable
+import fcntl
+import json
+import logging
+import os
+from typing import Any, Optional
+
+from ..settings import Settings
+
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+Listener = Callable[[dict[str, Any]], None]
+
+
+class JobEventBus:
+    '''
+    Delivers job events (status and log) to the listeners of the job.
+
+    `publish` and `subscribe` can be called from synchronous callbacks on the event loop.
+    '''
+
+    def __init__(self):
+        self.listeners: dict[str, list[Listener]] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, job_id: str, event: dict[str, Any]):
+        raise NotImplementedError()
+
+    def subscribe(self, job_id: str, listener: Listener):
+        self.listeners.setdefault(job_id, []).append(listener)
+
+    def unsubscribe(self, job_id: str, listener: Listener):
+        listeners = self.listeners.get(job_id, [])
+        if listener in listeners:
+            listeners.remove(listener)
+        if len(listeners) == 0:
+            self.listeners.pop(job_id, None)
+
+    def _dispatch(self, job_id: str, event: dict[str, Any]):
+        for listener in list(self.listeners.get(job_id, [])):
+            try:
+                listener(event)
+            except Exception:
+                logger.exception(f'Failed to handle the event of {job_id}')
+
+
+class LocalEventBus(JobEventBus):
+    '''
+    Delivers events within this process.
+    '''
+
+    def publish(self, job_id: str, event: dict[str, Any]):
+        self._dispatch(job_id, event)
+
+
+async def _write_message(writer: asyncio.StreamWriter, message: dict[str, Any]):
+    writer.write(json.dumps(message).encode('utf-8') + b'\n')
+    await writer.drain()
+
+
+class _Broker:
+    '''
+    Forwards published events to the connections subscribed to the job.
+    '''
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.subscriptions: dict[str, set[asyncio.Queue]] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        outbox = asyncio.Queue(maxsize=self.max_pending)
+        jobs = set()
+        async def send():
+            while True:
+                line = await outbox.get()
+                writer.write(line)
+                await writer.drain()
+        sender = asyncio.ensure_future(send())
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0 or sender.done():
+                    break
+                message = json.loads(line)
+                job_id = message['job']
+                if message['op'] == 'sub':
+                    jobs.add(job_id)
+                    self.subscriptions.setdefault(job_id, set()).add(outbox)
+                elif message['op'] == 'unsub':
+                    jobs.discard(job_id)
+                    self.subscriptions.get(job_id, set()).discard(outbox)
+                elif message['op'] == 'pub':
+                    for queue in list(self.subscriptions.get(job_id, [])):
+                        try:
+                            queue.put_nowait(line)
+                        except asyncio.QueueFull:
+                            # The subscriber reads the missed part from the log store
+                            logger.warning(f'Dropping an event of {job_id} for a slow subscriber')
+        except (ConnectionError, ValueError, KeyError):
+            logger.exception('Invalid connection to the event broker')
+        finally:
+            for job_id in jobs:
+                subscribers = self.subscriptions.get(job_id, set())
+                subscribers.discard(outbox)
+                if len(subscribers) == 0:
+                    self.subscriptions.pop(job_id, None)
+            sender.cancel()
+            writer.close()
+
+
+class UnixSocketEventBus(JobEventBus):
+    '''
+    Delivers events between the processes sharing a Unix socket.
+
+    The process holding the lock file next to the socket runs the broker, and
+    every process, including that one, connects to it. If the broker goes away,
+    the lock is released and another process takes over. Events published while disconnected are not delivered; the
+    subscribers catch up from the log store.
+    '''
+
+    def __init__(self, path: str, max_pending: int = 1000, retry_interval: float = 1.0):
+        super().__init__()
+        self.path = path
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._lock_fd: Optional[int] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _serve_if_absent(self):
+        if self._server is not None:
+            return
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+            writer.close()
+            return
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+        if not self._lock():
+            logger.debug('Another process is starting the event broker')
+            return
+        if os.path.exists(self.path):
+            # Left by a process which has gone away; only the lock holder removes it
+            os.unlink(self.path)
+        try:
+            self._server = await asyncio.start_unix_server(_Broker(self.max_pending).handle, path=self.path)
+            logger.info(f'Event broker started: {self.path}')
+        except OSError:
+            self._unlock()
+            raise
+
+    def _lock(self) -> bool:
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _unlock(self):
+        if self._lock_fd is None:
+            return
+        # Closing the file releases the lock
+        os.close(self._lock_fd)
+        self._lock_fd = None
+
+    def _send(self, message: dict[str, Any]):
+        if self._writer is None:
+            return False
+        self._writer.write(json.dumps(message).encode('utf-8') + b'\n')
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self._serve_if_absent()
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                logger.warning(f'Cannot connect to the event broker: {e}')
+                await asyncio.sleep(self.retry_interval)
+                continue
+            self._writer = writer
+            try:
+                for job_id in list(self.listeners.keys()):
+                    await _write_message(writer, {'op': 'sub', 'job': job_id})
+                while True:
+                    line = await reader.readline()
+                    if len(line) == 0:
+                        break
+                    message = json.loads(line)
+                    self._dispatch(message['job'], message['event'])
+            except (ConnectionError, ValueError, KeyError):
+                logger.exception('Disconnected from the event broker')
+            finally:
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(self.retry_interval)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._unlock()
+
+    def publish(self, job_id: str, event: dict[str, Any]):
+        if not self._send({'op': 'pub', 'job': job_id, 'event': event}):
+            logger.debug(f'Event of {job_id} is not delivered: not connected')
+
+    def subscribe(self, job_id: str, listener: Listener):
+        first = job_id not in self.listeners
+        super().subscribe(job_id, listener)
+        if first:
+            self._send({'op': 'sub', 'job': job_id})
+
+    def unsubscribe(self, job_id: str, listener: Listener):
+        super().unsubscribe(job_id, listener)
+        if job_id not in self.listeners:
+            self._send({'op': 'unsub', 'job': job_id})
+
+
+def _create_event_bus() -> JobEventBus:
+    if settings.job_event_bus == 'local':
+        return LocalEventBus()
+    if settings.job_event_bus == 'unix':
+        return UnixSocketEventBus(settings.job_event_socket)
+    raise ValueError(f'Unknown job_event_bus: {settings.job_event_bus}')
+
+
+event_bus = _create_event_bus()
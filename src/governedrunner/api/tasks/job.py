@@ -1,84 +1,143 @@
-from asyncio import Queue, QueueFull, QueueEmpty
+import asyncio
 from datetime import datetime, timezone
 import logging
 import traceback
+from typing import Optional
 
-from governedrunner.db.database import SessionLocal
-from governedrunner.db.models import Job
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+
+from governedrunner.db.database import AsyncSessionLocal
+from governedrunner.db.models import Job, User
 from governedrunner.api.rdm import RDMService
 
 from ..settings import Settings
+from .logs import JobLogWriter
+from .progress import publish_progress
 from governedrunner.job import GovernedRunner
+from governedrunner.job.spawners.rdmfs import RDMFS_IMAGE, rdmfs_sidecars
 
 
 logger = logging.getLogger(__name__)
 settings = Settings()
-log_streams = {}
 
 
-def _append_log(job, log):
-    job.log = (job.log if job.log is not None else '') + log
+async def prepull_images():
+    '''
+    Pull the RDMFS image in the background.
+    '''
+    config = settings.jupyterhub_traitlets_config
+    rdmfs_sidecars.prepull(config.Repo2DockerSpawner.get('rdmfs_image', RDMFS_IMAGE))
+
+class LeaseLostError(RuntimeError):
+    pass
+
+
+class JobUpdater:
+    '''
+    Writes the changes of a job to the database in the background, in the order they are made.
 
-def create_new_job_queue(job_id: str):
-    log_streams[job_id] = Queue(maxsize=100)
+    Changes are written only while this process holds the lease of the job.
+    Failures of the changes nobody awaits are logged.
+    '''
 
-def get_job_queue(job_id: str) -> Queue:
-    return log_streams.get(job_id, None)
+    def __init__(self, job_id: str, lease_owner: Optional[str]):
+        self.job_id = job_id
+        self.lease_owner = lease_owner
+        self._last: Optional[asyncio.Task] = None
+
+    def update(self, **values) -> asyncio.Task:
+        self._last = asyncio.ensure_future(self._update(self._last, values))
+        self._last.add_done_callback(self._log_failure)
+        return self._last
+
+    def _log_failure(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error(f'Failed to update the job: {self.job_id}: {task.exception()!r}')
+
+    async def _update(self, previous: Optional[asyncio.Task], values: dict):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        async with AsyncSessionLocal() as db:
+            updated = await db.execute(
+                update(Job)
+                .where(Job.id == self.job_id, Job.lease_owner == self.lease_owner)
+                .values(**values)
+            )
+            await db.commit()
+        if updated.rowcount != 1:
+            raise LeaseLostError(f'The lease of {self.job_id} is no longer held by {self.lease_owner}')
 
-def remove_job_queue(job_id: str):
-    return log_streams.pop(job_id, None)
 
 async def create_new_job(job_id: str):
-    with SessionLocal() as db:
-        logger.info(f'Executing... {job_id}')
-        job = db.query(Job).filter(Job.id == job_id).first()
-        def status_callback_impl(_, status, notebook):
-            job.status = status
-            job.updated_at = datetime.now(timezone.utc)
-            if notebook is not None:
-                job.notebook = notebook
-            db.commit()
-        def log_stream_callback_impl(status, log):
-            log_ = log.rstrip("\n")
-            logger.info(f'LOG({status}, {job.id}): {log_}')
-            job.status = status
-            job.updated_at = datetime.now(timezone.utc)
-            q = get_job_queue(job.id)
-            if q is not None:
-                if q.full():
-                    try:
-                        q.get_nowait()
-                    except QueueEmpty:
-                        pass
-                try:
-                    q.put_nowait((status, log))
-                except QueueFull:
-                    logger.warning(f'Queue is full: LOG({status}, {job.id}): {log_}')
-            _append_log(job, log)
-            db.commit()
-        current_user = job.owner
-        rdm = RDMService(current_user)
+    logger.info(f'Executing... {job_id}')
+    async with AsyncSessionLocal() as db:
+        # The runner uses the owner and the RDM token after the session is closed
+        job = await db.scalar(
+            select(Job)
+            .options(selectinload(Job.owner).selectinload(User.rdm_token))
+            .where(Job.id == job_id)
+        )
+    log_writer = JobLogWriter(
+        job.id,
+        settings.job_log_flush_interval,
+        settings.job_log_flush_bytes,
+        settings.job_log_max_bytes,
+    )
+    updater = JobUpdater(job.id, job.lease_owner)
+    def set_status(status, notebook=None):
+        job.status = status
+        job.updated_at = datetime.now(timezone.utc)
+        if notebook is not None:
+            job.notebook = notebook
+        updater.update(status=job.status, notebook=job.notebook, updated_at=job.updated_at)
+    def status_callback_impl(_, status, notebook):
+        set_status(status, notebook)
+    def publish(status, log):
+        offset = log_writer.written_bytes
+        publish_progress(job.id, status, log_writer.write(log), offset)
+    def log_stream_callback_impl(status, log):
+        log_ = log.rstrip("\n")
+        logger.info(f'LOG({status}, {job.id}): {log_}')
+        publish(status, log)
+        if job.status != status:
+            set_status(status)
+    current_user = job.owner
+    rdm = RDMService(current_user)
+    log_writer.start()
+    try:
+        runner = GovernedRunner.instance(GovernedRunner, config=settings.jupyterhub_traitlets_config)
+        runner.use_snapshot = job.use_snapshot
+        runner.status_callback = status_callback_impl
+        runner.log_stream_callback = log_stream_callback_impl
+        result = await runner.execute(job, rdm, job.source_url)
+
+        await log_writer.close()
+        job.status = result.status
+        job.notebook = result.notebook
+        job.result_url = result.result_url
+        job.updated_at = datetime.now(timezone.utc)
+        await updater.update(
+            status=job.status,
+            notebook=job.notebook,
+            result_url=job.result_url,
+            updated_at=job.updated_at,
+        )
+        logger.info('Executed')
+        publish(result.status, '')
+    except LeaseLostError:
+        # Another process has taken the job over and owns its state now
+        await log_writer.close()
+        logger.exception('Lease lost')
+    except:
+        # Also when the result could not be recorded
+        publish('failed', traceback.format_exc())
+        await log_writer.close()
+        job.status = 'failed'
+        job.updated_at = datetime.now(timezone.utc)
         try:
-            runner = GovernedRunner.instance(GovernedRunner, config=settings.jupyterhub_traitlets_config)
-            runner.use_snapshot = job.use_snapshot
-            runner.status_callback = status_callback_impl
-            runner.log_stream_callback = log_stream_callback_impl
-            result = await runner.execute(job, rdm, job.source_url)
-
-            job.status = result.status
-            job.notebook = result.notebook
-            job.result_url = result.result_url
-            job.updated_at = datetime.now(timezone.utc)
-            db.commit()
-            logger.info('Executed')
-        except:
-            job.status = 'failed'
-            job.updated_at = datetime.now(timezone.utc)
-            _append_log(job, traceback.format_exc())
-            db.commit()
-            q = get_job_queue(job.id)
-            if q is not None:
-                q.put_nowait(('failed', traceback.format_exc()))
-            logger.exception('Failed')
-        finally:
-            remove_job_queue(job.id)
+            await updater.update(status=job.status, updated_at=job.updated_at)
+        except LeaseLostError:
+            logger.warning(f'Lease lost, the failure is not recorded: {job.id}')
+        logger.exception('Failed')
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timezone
+import logging
+from typing import Optional
+
+from sqlalchemy import update
+
+from governedrunner.db.database import AsyncSessionLocal
+from governedrunner.db.models import Job
+
+from ..logstore import log_store
+
+
+logger = logging.getLogger(__name__)
+TRUNCATION_MARKER = '\n[... log truncated at {max_bytes} bytes ...]\n'
+
+
+async def append_log(db, job_id: str, log: str):
+    '''
+    Append the text to the log store and touch the job.
+    '''
+    await asyncio.to_thread(log_store.append, job_id, log)
+    await db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(updated_at=datetime.now(timezone.utc))
+    )
+
+
+class JobLogWriter:
+    '''
+    Buffers the log of a job and appends it to the log store in chunks.
+
+    The buffer is written in the background every `flush_interval` seconds, or
+    as soon as it holds `flush_bytes` bytes. The log is truncated at `max_bytes` bytes.
+    '''
+
+    def __init__(self, job_id: str, flush_interval: float, flush_bytes: int, max_bytes: int):
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_bytes = max_bytes
+        self.written_bytes = 0
+        self.truncated = False
+        self._chunks: list[str] = []
+        self._pending_bytes = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _accept(self, log: str) -> str:
+        if self.truncated:
+            return ''
+        encoded = log.encode('utf-8')
+        if self.max_bytes <= 0 or self.written_bytes + len(encoded) <= self.max_bytes:
+            self.written_bytes += len(encoded)
+            return log
+        remaining = max(self.max_bytes - self.written_bytes, 0)
+        self.truncated = True
+        logger.warning(f'Log truncated: {self.job_id}')
+        log = encoded[:remaining].decode('utf-8', errors='ignore') + \
+            TRUNCATION_MARKER.format(max_bytes=self.max_bytes)
+        # Count the marker as well so that written_bytes is the offset in the stored log
+        self.written_bytes += len(log.encode('utf-8'))
+        return log
+
+    def write(self, log: str) -> str:
+        '''
+        Buffer the log.
+
+        Returns:
+            The part of the log within the size limit
+        '''
+        log = self._accept(log)
+        if len(log) == 0:
+            return log
+        self._chunks.append(log)
+        self._pending_bytes += len(log.encode('utf-8'))
+        if self._pending_bytes >= self.flush_bytes and \
+                (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.ensure_future(self._flush_logged())
+        return log
+
+    async def flush(self):
+        # Chunks are taken under the lock so that they are appended in order
+        async with self._lock:
+            if len(self._chunks) == 0:
+                return
+            log = ''.join(self._chunks)
+            self._chunks = []
+            self._pending_bytes = 0
+            async with AsyncSessionLocal() as db:
+                await append_log(db, self.job_id, log)
+                await db.commit()
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f'Failed to write the log: {self.job_id}')
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+            self._flushing = None
+        await self.flush()
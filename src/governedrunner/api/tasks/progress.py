@@ -0,0 +1,211 @@
+import asyncio
+from collections import deque
+import logging
+from typing import Optional
+
+from ..logstore import char_boundaries, log_store
+from ..settings import Settings
+from .events import event_bus
+
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+FINISHED_STATES = ['completed', 'failed']
+
+
+class ProgressEvent:
+    offset: int
+    status: str
+    data: bytes
+
+    def __init__(self, offset: int, status: str, data: bytes):
+        self.offset = offset
+        self.status = status
+        self.data = data
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(self.data)
+
+
+class ProgressFrame:
+    offset: int
+    next_offset: int
+    status: Optional[str]
+    log: str
+    finished: bool
+
+    def __init__(self, offset: int, next_offset: int, status: Optional[str], log: str, finished: bool):
+        self.offset = offset
+        self.next_offset = next_offset
+        self.status = status
+        self.log = log
+        self.finished = finished
+
+    def to_json(self):
+        return {
+            'status': self.status,
+            'log': self.log,
+            'offset': self.offset,
+            'next_offset': self.next_offset,
+        }
+
+
+class ProgressBroadcaster:
+    '''
+    Recent progress of a job, read by any number of subscribers.
+
+    Events are kept in a ring buffer of `capacity` bytes and addressed by their
+    byte offset in the job log. Each subscriber reads from its own offset, so a
+    slow subscriber never blocks the job nor the other subscribers.
+    '''
+
+    def __init__(self, job_id: str, capacity: int, offset: int = 0):
+        self.job_id = job_id
+        self.capacity = capacity
+        self.events: deque[ProgressEvent] = deque()
+        # The log before the offset is read from the log store
+        self.start_offset = offset
+        self.end_offset = offset
+        self.buffered_bytes = 0
+        self.status: Optional[str] = None
+        self.finished = False
+        self.listener = None
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        updated = self._updated
+        self._updated = asyncio.Event()
+        updated.set()
+
+    def publish(self, status: str, log: str, offset: Optional[int] = None):
+        '''
+        Add the log at the offset in the job log, or at the end if the offset is None.
+        '''
+        data = log.encode('utf-8')
+        if offset is not None and offset > self.end_offset:
+            # Some events were missed; subscribers read them from the log store
+            self.events.clear()
+            self.buffered_bytes = 0
+            self.start_offset = self.end_offset = offset
+        elif offset is not None and offset < self.end_offset:
+            data = data[self.end_offset - offset:]
+        self.status = status
+        if len(data) > 0:
+            self.events.append(ProgressEvent(self.end_offset, status, data))
+            self.end_offset += len(data)
+            self.buffered_bytes += len(data)
+            while self.buffered_bytes > self.capacity and len(self.events) > 1:
+                evicted = self.events.popleft()
+                self.buffered_bytes -= len(evicted.data)
+                self.start_offset = self.events[0].offset
+        if status in FINISHED_STATES:
+            self.finished = True
+        self._notify()
+
+    def finish(self, status: str, offset: Optional[int] = None):
+        self.publish(status, '', offset)
+
+    def on_event(self, event: dict):
+        self.publish(event['status'], event['log'], event['offset'])
+
+    async def wait(self, offset: int, status: Optional[str]):
+        '''
+        Wait until there is something after the offset, or the status is different.
+        '''
+        while self.end_offset <= offset and self.status == status and not self.finished:
+            await self._updated.wait()
+
+    def read(self, offset: int, max_bytes: int) -> ProgressFrame:
+        '''
+        Read the buffered events from the offset, coalesced into one frame.
+
+        The offset must not be before `start_offset`.
+        '''
+        parts = []
+        size = 0
+        status = None
+        for event in self.events:
+            if event.end <= offset:
+                continue
+            if size >= max_bytes:
+                break
+            data = event.data[max(offset - event.offset, 0):]
+            data = data[:max_bytes - size]
+            parts.append(data)
+            size += len(data)
+            status = event.status
+        data = b''.join(parts)
+        start, end = char_boundaries(data)
+        next_offset = offset + end
+        caught_up = next_offset >= self.end_offset
+        return ProgressFrame(
+            offset + start,
+            next_offset,
+            self.status if caught_up else status,
+            data[start:end].decode('utf-8', errors='replace'),
+            caught_up and self.finished,
+        )
+
+
+class ProgressHub:
+    '''
+    Broadcasters of the jobs watched in this process, fed by the job event bus.
+
+    A broadcaster is kept for a while after its job has finished.
+    '''
+
+    def __init__(self, capacity: int, retention: float):
+        self.capacity = capacity
+        self.retention = retention
+        self.broadcasters: dict[str, ProgressBroadcaster] = {}
+
+    async def open(self, job_id: str) -> ProgressBroadcaster:
+        broadcaster = self.broadcasters.get(job_id, None)
+        if broadcaster is not None:
+            return broadcaster
+        # Start at the end of the stored log so that a quiet job's log is read from the store
+        offset = await asyncio.to_thread(log_store.size, job_id)
+        broadcaster = self.broadcasters.get(job_id, None)
+        if broadcaster is not None:
+            # Opened by another subscriber meanwhile
+            return broadcaster
+        broadcaster = ProgressBroadcaster(job_id, self.capacity, offset)
+        self.broadcasters[job_id] = broadcaster
+        def listener(event):
+            was_finished = broadcaster.finished
+            broadcaster.on_event(event)
+            if broadcaster.finished and not was_finished:
+                self._close_later(job_id, broadcaster, listener)
+        broadcaster.listener = listener
+        event_bus.subscribe(job_id, listener)
+        return broadcaster
+
+    def get(self, job_id: str) -> Optional[ProgressBroadcaster]:
+        return self.broadcasters.get(job_id, None)
+
+    def finish(self, job_id: str, status: str, offset: int):
+        '''
+        Finish the progress of a job whose final events were not received.
+        '''
+        broadcaster = self.broadcasters.get(job_id, None)
+        if broadcaster is None or broadcaster.finished:
+            return
+        broadcaster.listener({'status': status, 'log': '', 'offset': offset})
+
+    def _close_later(self, job_id: str, broadcaster: ProgressBroadcaster, listener):
+        def remove():
+            event_bus.unsubscribe(job_id, listener)
+            if self.broadcasters.get(job_id, None) is broadcaster:
+                del self.broadcasters[job_id]
+        asyncio.get_running_loop().call_later(self.retention, remove)
+
+
+def publish_progress(job_id: str, status: str, log: str, offset: int):
+    '''
+    Publish the progress of a job to the processes watching it.
+    '''
+    event_bus.publish(job_id, {'status': status, 'log': log, 'offset': offset})
+
+
+progress_hub = ProgressHub(settings.job_progress_buffer_bytes, settings.job_progress_retention)
@@ -0,0 +1,190 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+import socket
+from typing import Optional
+import uuid
+
+from sqlalchemy import func, or_, select, update
+
+from governedrunner.db.database import AsyncSessionLocal
+from governedrunner.db.models import Job
+
+from ..models.job import State
+from ..settings import Settings
+from .job import create_new_job
+from ..logstore import log_store
+from .logs import append_log
+from .progress import publish_progress
+
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+ACTIVE_STATES = [State.building.value, State.running.value]
+
+
+def _new_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class JobQueue:
+    '''
+    Runs queued jobs from the database with a bounded number of workers.
+
+    The next job is taken from the user with the fewest active jobs, oldest first.
+    Claimed jobs hold a lease which is renewed while they run, so several
+    processes can take jobs from the same database. Jobs whose lease has
+    expired are marked as failed.
+    '''
+
+    def __init__(self, max_workers: int, poll_interval: float, lease_duration: float):
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.lease_duration = lease_duration
+        self.worker_id = _new_worker_id()
+        self._workers: dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._draining = False
+
+    def _lease_expires_at(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.lease_duration)
+
+    async def _claim_next(self, db) -> Optional[str]:
+        active = dict((await db.execute(
+            select(Job.owner_id, func.count(Job.id))
+            .where(Job.status.in_(ACTIVE_STATES))
+            .group_by(Job.owner_id)
+        )).all())
+        queued = (await db.execute(
+            select(Job.id, Job.owner_id)
+            .where(Job.status == State.queued.value)
+            .order_by(Job.created_at)
+        )).all()
+        candidates = sorted(
+            enumerate(queued),
+            key=lambda c: (active.get(c[1].owner_id, 0), c[0]),
+        )
+        skip_locked = db.bind.dialect.name == 'postgresql'
+        for _, (job_id, _) in candidates:
+            if skip_locked:
+                locked = (await db.execute(
+                    select(Job.id)
+                    .where(Job.id == job_id, Job.status == State.queued.value)
+                    .with_for_update(skip_locked=True)
+                )).first()
+                if locked is None:
+                    await db.rollback()
+                    continue
+            # On SQLite the conditional update is the lock
+            claimed = await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == State.queued.value)
+                .values(
+                    status=State.building.value,
+                    updated_at=datetime.now(timezone.utc),
+                    lease_owner=self.worker_id,
+                    lease_expires_at=self._lease_expires_at(),
+                )
+            )
+            await db.commit()
+            if claimed.rowcount == 1:
+                return job_id
+        return None
+
+    async def _renew_leases(self, db):
+        if len(self._workers) == 0:
+            return
+        await db.execute(
+            update(Job)
+            .where(Job.id.in_(list(self._workers.keys())), Job.lease_owner == self.worker_id)
+            .values(lease_expires_at=self._lease_expires_at())
+        )
+        await db.commit()
+
+    async def _expire_leases(self, db):
+        expired = (await db.scalars(
+            select(Job)
+            .where(Job.status.in_(ACTIVE_STATES))
+            .where(or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < datetime.now(timezone.utc)))
+        )).all()
+        for job in expired:
+            job.status = State.failed.value
+            job.updated_at = datetime.now(timezone.utc)
+            offset = await asyncio.to_thread(log_store.size, job.id)
+            message = f'Lease expired: {job.lease_owner}\n'
+            await append_log(db, job.id, message)
+            publish_progress(job.id, State.failed.value, message, offset)
+        await db.commit()
+        if len(expired) > 0:
+            logger.warning(f'Expired jobs: {[job.id for job in expired]}')
+
+    async def _dispatch(self):
+        async with AsyncSessionLocal() as db:
+            await self._renew_leases(db)
+            await self._expire_leases(db)
+            while not self._draining and len(self._workers) < self.max_workers:
+                job_id = await self._claim_next(db)
+                if job_id is None:
+                    return
+                logger.info(f'Dispatching... {job_id} to {self.worker_id}')
+                task = asyncio.ensure_future(create_new_job(job_id))
+                task.add_done_callback(lambda _, job_id=job_id: self._finished(job_id))
+                self._workers[job_id] = task
+
+    def _finished(self, job_id: str):
+        self._workers.pop(job_id, None)
+        self.notify()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._dispatch()
+            except Exception:
+                logger.exception('Failed to dispatch jobs')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def notify(self):
+        '''
+        Wake up the dispatcher, e.g. after a job was queued. Can be called from any thread.
+        '''
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self):
+        if self._dispatcher is not None or self.max_workers <= 0:
+            return
+        if self.poll_interval >= self.lease_duration:
+            raise ValueError('job_queue_poll_interval must be shorter than job_lease_duration')
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._dispatcher = asyncio.ensure_future(self._run())
+        logger.info(f'Job queue started: worker_id={self.worker_id}, max_workers={self.max_workers}')
+
+    async def stop(self):
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, return_exceptions=True)
+        self._dispatcher = None
+
+    async def drain(self):
+        '''
+        Stop claiming jobs and wait for the running jobs to finish.
+        '''
+        self._draining = True
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        await self.stop()
+
+
+job_queue = JobQueue(
+    settings.job_workers,
+    settings.job_queue_poll_interval,
+    settings.job_lease_duration,
+)
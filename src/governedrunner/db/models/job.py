@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, Boolean, ForeignKey, String, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, Boolean, ForeignKey, String, DateTime, Index
+from sqlalchemy.orm import deferred, relationship
 
 from ..database import Base
 
@@ -16,6 +16,13 @@ class Job(Base):
     result_url = Column(String, nullable=True, index=True)
     use_snapshot = Column(Boolean, nullable=True, index=True)
     notebook = Column(String, nullable=True, index=True)
-    log = Column(String, nullable=True, index=False)
+    # Loaded only when requested; logs are kept in the log store since then
+    log = deferred(Column(String, nullable=True, index=False))
+    lease_owner = Column(String, nullable=True, index=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
 
     owner = relationship('User')
+
+    __table_args__ = (
+        Index('ix_jobs_owner_id_status_updated_at', 'owner_id', 'status', 'updated_at'),
+    )
@@ -12,6 +12,13 @@ export interface paths {
      */
     get: operations["retrieve_server__get"];
   };
+  "/stats": {
+    /**
+     * Retrieve Stats
+     * @description このプロセスの外部API呼び出しの統計です。
+     */
+    get: operations["retrieve_stats_stats_get"];
+  };
   "/users/me": {
     /**
      * Retrieve Current User
@@ -22,7 +29,7 @@ export interface paths {
   "/jobs/": {
     /**
      * Retrieve Jobs
-     * @description 現在のユーザーが実行した全てのジョブを取得します。
+     * @description 現在のユーザーが実行した全てのジョブを更新日時の新しい順に取得します。ログはfieldsで指定した場合のみ返します。実行中のジョブは更新されるとページの間を移動するため、カーソルで重複や欠落なく辿れるのは終了したジョブのみです。
      */
     get: operations["retrieve_jobs_jobs__get"];
     /**
@@ -38,6 +45,13 @@ export interface paths {
      */
     get: operations["retrieve_job_jobs__job_id__get"];
   };
+  "/jobs/{job_id}/log": {
+    /**
+     * Retrieve Job Log
+     * @description 指定されたジョブのログの一部を取得します。offsetを省略すると末尾を返します。
+     */
+    get: operations["retrieve_job_log_jobs__job_id__log_get"];
+  };
   "/nodes/": {
     /**
      * Retrieve Nodes
@@ -59,6 +73,13 @@ export interface paths {
      */
     get: operations["retrieve_node_children_nodes__node_id__children__get"];
   };
+  "/nodes/{node_id}/crates/{provider_id}/": {
+    /**
+     * Retrieve Node Crates
+     * @description 指定されたストレージプロバイダの実行結果の索引を新しい順に取得します。
+     */
+    get: operations["retrieve_node_crates_nodes__node_id__crates__provider_id___get"];
+  };
   "/nodes/{node_id}/providers/{provider_id}/": {
     /**
      * Retrieve Node Root Files
@@ -70,6 +91,7 @@ export interface paths {
     /**
      * Retrieve Node Files
      * @description 指定されたストレージプロバイダのパスにあるファイルを取得します。
+     * action=downloadまたはaction=rawの場合はファイルの内容をそのまま返します。
      */
     get: operations["retrieve_node_files_nodes__node_id__providers__provider_id___filepath__get"];
   };
@@ -91,6 +113,51 @@ export interface components {
        */
       use_snapshot?: boolean;
     };
+    /** CrateIndexOut */
+    CrateIndexOut: {
+      /**
+       * Notebook
+       * @example path/to/notebook.ipynb
+       */
+      notebook: string;
+      /**
+       * Id
+       * @example JOB_ID
+       */
+      id: string;
+      /**
+       * Created At
+       * @example 2021-01-01T00:00:00.000000+00:00
+       */
+      created_at: string | null;
+      /**
+       * Updated At
+       * @example 2021-01-01T00:00:00.000000+00:00
+       */
+      updated_at: string | null;
+      /**
+       * Name
+       * @example JOB_ID.json
+       */
+      name: string | null;
+      /**
+       * Status
+       * @example completed
+       */
+      status: string | null;
+      /**
+       * Links
+       * @example [
+       *   {
+       *     "rel": "web",
+       *     "href": "https://rdm.nii.ac.jp/xxxxx/files/osfstorage/.crates/JOB_ID.json"
+       *   }
+       * ]
+       */
+      links: {
+          [key: string]: string;
+        }[];
+    };
     /** CustomizedPage[FileOut] */
     CustomizedPage_FileOut_: {
       /** Items */
@@ -134,7 +201,7 @@ export interface components {
      * FileAction
      * @enum {string}
      */
-    FileAction: "download" | "meta";
+    FileAction: "download" | "meta" | "raw";
     /** FileOut */
     FileOut: {
       /**
@@ -228,6 +295,48 @@ export interface components {
       progress: components["schemas"]["ProgressOut"] | null;
       /** Notebook */
       notebook: string | null;
+      /**
+       * Log
+       * @description The last part of the log
+       */
+      log: string | null;
+      /**
+       * Log Size
+       * @description The size of the whole log in bytes
+       */
+      log_size: number | null;
+    };
+    /** JobLogOut */
+    JobLogOut: {
+      /**
+       * Offset
+       * @description The byte offset of the first character
+       */
+      offset: number;
+      /**
+       * Next Offset
+       * @description The byte offset to read the following part from
+       */
+      next_offset: number;
+      /**
+       * Size
+       * @description The size of the whole log in bytes
+       */
+      size: number;
+      /** Log */
+      log: string;
+    };
+    /** JobPageOut */
+    JobPageOut: {
+      /** Items */
+      items: components["schemas"]["JobOut"][];
+      /** Size */
+      size: number;
+      /**
+       * Next Cursor
+       * @description The cursor to retrieve the next page, or null on the last page
+       */
+      next_cursor: string | null;
     };
     /**
      * Kind
@@ -266,19 +375,6 @@ export interface components {
        */
       title: string;
     };
-    /** Page[JobOut] */
-    Page_JobOut_: {
-      /** Items */
-      items: components["schemas"]["JobOut"][];
-      /** Total */
-      total: number | null;
-      /** Page */
-      page: number | null;
-      /** Size */
-      size: number | null;
-      /** Pages */
-      pages?: number | null;
-    };
     /** ProgressOut */
     ProgressOut: {
       /** Url */
@@ -334,6 +430,38 @@ export interface components {
        */
       version: string;
     };
+    /** StatsOut */
+    StatsOut: {
+      /**
+       * Rdm Singleflight
+       * @description GET requests to GakuNin RDM, and how many of them joined an identical in-flight request
+       * @example {
+       *   "calls": 100,
+       *   "deduplicated": 20
+       * }
+       */
+      rdm_singleflight: {
+        [key: string]: number;
+      };
+      /**
+       * Docker
+       * @description Docker API calls by operation: calls, errors, wait_seconds, seconds and max_seconds
+       * @example {
+       *   "containers.get": {
+       *     "calls": 10,
+       *     "errors": 0,
+       *     "wait_seconds": 0,
+       *     "seconds": 0.5,
+       *     "max_seconds": 0.1
+       *   }
+       * }
+       */
+      docker: {
+        [key: string]: {
+          [key: string]: number;
+        };
+      };
+    };
     /** SourceOut */
     SourceOut: {
       /** Url */
@@ -343,7 +471,7 @@ export interface components {
      * State
      * @enum {string}
      */
-    State: "building" | "running" | "completed" | "failed";
+    State: "queued" | "building" | "running" | "completed" | "failed";
     /** UserOut */
     UserOut: {
       /**
@@ -396,6 +524,20 @@ export interface operations {
       };
     };
   };
+  /**
+   * Retrieve Stats
+   * @description このプロセスの外部API呼び出しの統計です。
+   */
+  retrieve_stats_stats_get: {
+    responses: {
+      /** @description Successful Response */
+      200: {
+        content: {
+          "application/json": components["schemas"]["StatsOut"];
+        };
+      };
+    };
+  };
   /**
    * Retrieve Current User
    * @description 指定された認証情報に対応するユーザーを取得します。
@@ -412,16 +554,18 @@ export interface operations {
   };
   /**
    * Retrieve Jobs
-   * @description 現在のユーザーが実行した全てのジョブを取得します。
+   * @description 現在のユーザーが実行した全てのジョブを更新日時の新しい順に取得します。ログはfieldsで指定した場合のみ返します。実行中のジョブは更新されるとページの間を移動するため、カーソルで重複や欠落なく辿れるのは終了したジョブのみです。
    */
   retrieve_jobs_jobs__get: {
     parameters: {
       query?: {
         state?: components["schemas"]["State"] | null;
         notebook?: string | null;
-        /** @description Page number */
-        page?: number;
-        /** @description Page size */
+        /** @description Comma-separated fields to include: id, created_at, updated_at, status, source, result, progress, notebook, log, log_size */
+        fields?: string | null;
+        /** @description The cursor returned as next_cursor */
+        cursor?: string | null;
+        /** @default 50 */
         size?: number;
       };
     };
@@ -429,7 +573,7 @@ export interface operations {
       /** @description Successful Response */
       200: {
         content: {
-          "application/json": components["schemas"]["Page_JobOut_"];
+          "application/json": components["schemas"]["JobPageOut"];
         };
       };
       /** @description Validation Error */
@@ -490,6 +634,35 @@ export interface operations {
       };
     };
   };
+  /**
+   * Retrieve Job Log
+   * @description 指定されたジョブのログの一部を取得します。offsetを省略すると末尾を返します。
+   */
+  retrieve_job_log_jobs__job_id__log_get: {
+    parameters: {
+      query?: {
+        offset?: number | null;
+        limit?: number;
+      };
+      path: {
+        job_id: string;
+      };
+    };
+    responses: {
+      /** @description Successful Response */
+      200: {
+        content: {
+          "application/json": components["schemas"]["JobLogOut"];
+        };
+      };
+      /** @description Validation Error */
+      422: {
+        content: {
+          "application/json": components["schemas"]["HTTPValidationError"];
+        };
+      };
+    };
+  };
   /**
    * Retrieve Nodes
    * @description 現在のユーザーが参照可能なGakuNin RDMノードを取得します。
@@ -577,6 +750,36 @@ export interface operations {
       };
     };
   };
+  /**
+   * Retrieve Node Crates
+   * @description 指定されたストレージプロバイダの実行結果の索引を新しい順に取得します。
+   */
+  retrieve_node_crates_nodes__node_id__crates__provider_id___get: {
+    parameters: {
+      query?: {
+        notebook?: string | null;
+        limit?: number;
+      };
+      path: {
+        node_id: string;
+        provider_id: string;
+      };
+    };
+    responses: {
+      /** @description Successful Response */
+      200: {
+        content: {
+          "application/json": components["schemas"]["CrateIndexOut"][];
+        };
+      };
+      /** @description Validation Error */
+      422: {
+        content: {
+          "application/json": components["schemas"]["HTTPValidationError"];
+        };
+      };
+    };
+  };
   /**
    * Retrieve Node Root Files
    * @description 指定されたストレージプロバイダのルートディレクトリにあるファイルを取得します。
@@ -611,6 +814,7 @@ export interface operations {
   /**
    * Retrieve Node Files
    * @description 指定されたストレージプロバイダのパスにあるファイルを取得します。
+   * action=downloadまたはaction=rawの場合はファイルの内容をそのまま返します。
    */
   retrieve_node_files_nodes__node_id__providers__provider_id___filepath__get: {
     parameters: {
@@ -7,7 +7,6 @@ import { OpenInNew, PlayArrow } from "@mui/icons-material";
 import { DataGrid } from "@mui/x-data-grid";
 import { getCrates, getJobs } from "../api/crates";
 import { createNotebookJob, createRunCrateJob } from "../api/jobs";
-import { paths } from "../api/schema";
 import { Pagination, File } from "../api/types";
 import { Job, JobStatus, toAPIURL, getRDMURL } from "./job";
 
@@ -69,6 +68,26 @@ async function getAllJobs(
     .reverse();
 }
 
+async function getRunnerLog(entity: any): Promise<string | undefined> {
+  if (entity["text"] !== undefined) {
+    // Crates created before the log was stored as a separate file
+    return entity["text"];
+  }
+  if (!entity["rdmURL"]) {
+    return undefined;
+  }
+  const logLink = `${toAPIURL(entity["rdmURL"])}?action=raw`;
+  const resp = await fetch(logLink);
+  if (!resp.ok || !resp.body) {
+    throw new Error(`Load failed: ${logLink}`);
+  }
+  const body =
+    entity["encodingFormat"] === "application/gzip"
+      ? resp.body.pipeThrough(new DecompressionStream("gzip"))
+      : resp.body;
+  return await new Response(body).text();
+}
+
 async function getCrate(crate: Job): Promise<any> {
   const wbLink = crate.links?.find((link) => link.rel === "download");
   if (!wbLink) {
@@ -76,12 +95,10 @@ async function getCrate(crate: Job): Promise<any> {
   }
   const crateLink = `${toAPIURL(wbLink.href)}?action=download`;
   const resp = await fetch(crateLink);
-  const data: paths["/nodes/{node_id}/providers/{provider_id}/"]["get"]["responses"][200]["content"]["application/json"] =
-    await resp.json();
-  if (data.items.length === 0) {
+  if (!resp.ok) {
     throw new Error(`Load failed: ${crateLink}`);
   }
-  const content: any = data.items[0].content;
+  const content: any = await resp.json();
   const outputEntities = content["@graph"].filter(
     (e: any) => e["@type"] === "File" && e["@id"].match(/^output-.+\.ipynb$/)
   );
@@ -89,7 +106,22 @@ async function getCrate(crate: Job): Promise<any> {
     return { content };
   }
   const outputWeb = await getRDMURL(outputEntities[0]["rdmURL"]);
-  return { content: data.items[0].content, outputWeb };
+  return { content, outputWeb };
+}
+
+async function getCrateWithLog(crate: Job): Promise<any> {
+  const { content, outputWeb } = await getCrate(crate);
+  if (!content) {
+    return { content, outputWeb };
+  }
+  const logEntities = content["@graph"].filter(
+    (e: any) =>
+      e["@type"] === "File" && e["@id"].match(/^runner-.+\.log(\.gz)?$/)
+  );
+  if (logEntities.length === 0) {
+    return { content, outputWeb };
+  }
+  return { content, outputWeb, log: await getRunnerLog(logEntities[0]) };
 }
 
 export function CrateList({ defaultPageSize, selectedFile, onError }: Param) {
@@ -130,23 +162,19 @@ export function CrateList({ defaultPageSize, selectedFile, onError }: Param) {
     }
     setRequestedCrate(crate);
     setTimeout(() => {
-      getCrate(crate)
-        .then(({ content, outputWeb }) => {
+      getCrateWithLog(crate)
+        .then(({ content, outputWeb, log }) => {
           if (!content) {
             setRequestedCrate(undefined);
             return;
           }
-          const logEntities = content["@graph"].filter(
-            (e: any) =>
-              e["@type"] === "File" && e["@id"].match(/^runner-.+\.log$/)
-          );
           const outputEntities = content["@graph"].filter(
             (e: any) =>
               e["@type"] === "File" && e["@id"].match(/^output-.+\.ipynb$/)
           );
           const extra: any = {};
-          if (logEntities.length > 0) {
-            extra.log = logEntities[0]["text"];
+          if (log !== undefined) {
+            extra.log = log;
           }
           if (outputEntities.length > 0) {
             extra.output = outputEntities[0]["rdmURL"];
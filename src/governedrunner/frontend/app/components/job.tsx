@@ -1,4 +1,4 @@
-import React, { useCallback, useState, useEffect } from "react";
+import React, { useCallback, useState, useEffect, useRef } from "react";
 
 import { paths } from "../api/schema";
 import { endpoint, Link } from "../api/types";
@@ -8,12 +8,13 @@ export interface Job {
   created_at: string | null;
   updated_at: string | null;
   name?: string;
-  status?: "running" | "building" | "completed" | "failed" | null;
+  status?: "queued" | "running" | "building" | "completed" | "failed" | null;
   links?: Link[];
   progress?: {
     url: string | null;
   } | null;
   log?: string | null;
+  log_size?: number | null;
   output?: string | null;
   outputWeb?: string | null;
 }
@@ -45,31 +46,27 @@ export async function getRDMURL(wbURL: string): Promise<string> {
 export function JobStatus({ job, onError }: Params) {
   const [status, setStatus] = useState(job.status);
   const [notebookURL, setNotebookURL] = useState<string | undefined>(undefined);
-  const [logs, setLogs] = useState<string[] | undefined>(undefined);
-
-  const onMessage = useCallback(
-    (event: MessageEvent<string>) => {
-      const data = JSON.parse(event.data);
-      if (data.status) {
-        setStatus(data.status);
-      }
-      if (data.log === undefined) {
-        setLogs(undefined);
-        return;
-      }
-      if (!logs) {
-        setLogs([data.log]);
-        return;
-      }
-      setLogs([...logs, data.log]);
-    },
-    [logs]
+  const [logs, setLogs] = useState<string[] | undefined>(
+    job.log !== undefined && job.log !== null ? [job.log] : undefined
   );
+  // Byte offset in the job log to resume the progress from
+  const offset = useRef<number>(job.log_size || 0);
 
-  useEffect(() => {
-    if (logs === undefined && job.log !== undefined && job.log !== null) {
-      setLogs([job.log]);
+  const onMessage = useCallback((event: MessageEvent<string>) => {
+    const data = JSON.parse(event.data);
+    if (data.status) {
+      setStatus(data.status);
     }
+    if (data.next_offset !== undefined) {
+      offset.current = data.next_offset;
+    }
+    if (!data.log) {
+      return;
+    }
+    setLogs((logs) => (logs ? [...logs, data.log] : [data.log]));
+  }, []);
+
+  useEffect(() => {
     if (!job.progress || !job.progress.url) {
       return;
     }
@@ -79,6 +76,7 @@ export function JobStatus({ job, onError }: Params) {
     }
     const url = new URL(job.progress.url, baseURL);
     url.protocol = url.protocol.replace("http", "ws");
+    url.searchParams.set("offset", offset.current.toString());
     const websocketURL = url.toString();
     const websocket = new WebSocket(websocketURL);
     websocket.addEventListener("message", onMessage);
@@ -86,7 +84,7 @@ export function JobStatus({ job, onError }: Params) {
       websocket.close();
       websocket.removeEventListener("message", onMessage);
     };
-  }, [status, job, logs, onMessage]);
+  }, [job, onMessage]);
 
   useEffect(() => {
     if (!job.output) {
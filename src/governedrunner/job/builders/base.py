@@ -1,4 +1,4 @@
-from traitlets import Dict
+from traitlets import Dict, Unicode
 from traitlets.config import LoggingConfigurable
 
 
@@ -11,6 +11,23 @@ class ImageBuilder(LoggingConfigurable):
         """,
     ).tag(config=True)
 
+    source_fingerprint = Unicode(
+        None,
+        allow_none=True,
+        help="""Digest of the source contents.
+
+        If set, the builder may reuse an image built from the same contents.
+        """,
+    ).tag(config=True)
+
+    cache_scope = Unicode(
+        '',
+        help="""Scope within which built images are reused, e.g. the owner of the job.
+
+        Images built from the same contents are shared by all jobs if empty.
+        """,
+    ).tag(config=True)
+
     async def build(self, source_url: str) -> str:
         """
         Build a Docker image from the source URL.
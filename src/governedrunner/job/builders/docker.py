@@ -1,3 +1,6 @@
+import asyncio
+import hashlib
+import json
 import logging
 import re
 from urllib.parse import urlparse
@@ -5,10 +8,56 @@ from urllib.parse import urlparse
 from aiodocker import Docker
 from traitlets import Unicode, Dict, List, Callable
 
+from governedrunner.api.cache import token_hash
 from governedrunner.api.rdm import RDMService
+from ..dockerapi import docker_call
 from .base import ImageBuilder
 
 
+logger = logging.getLogger(__name__)
+FINGERPRINT_LABEL = 'governedrunner.fingerprint'
+
+
+class SharedBuild:
+    """A build shared by the jobs requesting the same image."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.logs: list[tuple[str, str]] = []
+        self.listeners: list = []
+        self.task: asyncio.Task = None
+
+    def emit(self, status: str, log: str):
+        self.logs.append((status, log))
+        for listener in list(self.listeners):
+            self._notify(listener, status, log)
+
+    def _notify(self, listener, status: str, log: str) -> bool:
+        # A failing subscriber must not fail the build for the other jobs
+        try:
+            listener(status, log)
+            return True
+        except Exception:
+            logger.exception(f'Dropping a failing listener of the build: {self.key}')
+            self.unsubscribe(listener)
+            return False
+
+    def subscribe(self, listener):
+        # Replay the log emitted before joining
+        for status, log in self.logs:
+            if not self._notify(listener, status, log):
+                return
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+
+# In-flight builds by key
+builds: dict[str, SharedBuild] = {}
+
+
 class DockerImageBuilder(ImageBuilder):
     """Builds a docker image from specified repository.
     """
@@ -25,6 +74,15 @@ class DockerImageBuilder(ImageBuilder):
         """,
     ).tag(config=True)
 
+    secret_envs = List(
+        ['RDM_HOSTS_JSON'],
+        help="""Names of optional environment variables holding credentials.
+
+        Their values are left out of the image fingerprint, so that rotating a
+        token does not miss the cache and no secret ends up in image labels.
+        """,
+    ).tag(config=True)
+
     extra_buildargs = List(
         [],
         help="""Extra build arguments to pass to the builder.
@@ -37,10 +95,97 @@ class DockerImageBuilder(ImageBuilder):
         """,
     ).tag(config=True)
 
+    def _key_envs(self, secret_digests: bool):
+        envs = {}
+        for name, value in self.optional_envs.items():
+            if name not in self.secret_envs:
+                envs[name] = value
+            elif secret_digests:
+                envs[name] = token_hash(value)
+            else:
+                envs[name] = None
+        return envs
+
+    def _build_fingerprint(self, ref: str):
+        if not self.source_fingerprint:
+            return None
+        # Everything that affects the built image. Credentials only grant access
+        # to the contents, which the source fingerprint already identifies.
+        key = json.dumps({
+            'source': self.source_fingerprint,
+            'scope': self.cache_scope,
+            'ref': ref,
+            'image': self.repo2docker_image,
+            'labels': self.optional_labels,
+            'envs': self._key_envs(secret_digests=False),
+            'buildargs': self.extra_buildargs,
+        }, sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    async def _find_image(self, docker: Docker, fingerprint: str):
+        images = await docker.images.list(filters=json.dumps({
+            'label': [f'{FINGERPRINT_LABEL}={fingerprint}'],
+            'dangling': ['false'],
+        }))
+        images = sorted(images, key=lambda image: image.get('Created', 0), reverse=True)
+        for image in images:
+            for tag in image.get('RepoTags', None) or []:
+                if tag != '<none>:<none>':
+                    return tag
+        return None
+
+    def _build_key(self, source_url: str, ref: str):
+        return json.dumps({
+            'source_url': source_url,
+            'source': self.source_fingerprint,
+            'scope': self.cache_scope,
+            'ref': ref,
+            'image': self.repo2docker_image,
+            'labels': self.optional_labels,
+            # Without a fingerprint, only jobs with the same credentials may join
+            'envs': self._key_envs(secret_digests=not self.source_fingerprint),
+            'buildargs': self.extra_buildargs,
+        }, sort_keys=True)
+
     async def build(self, source_url: str) -> str:
         ref = 'HEAD'
+        key = self._build_key(source_url, ref)
+        shared = builds.get(key, None)
+        if shared is None:
+            shared = SharedBuild(key)
+            shared.task = asyncio.ensure_future(self._build(source_url, ref, shared.emit))
+            def done(task, shared=shared):
+                if builds.get(shared.key, None) is shared:
+                    del builds[shared.key]
+                if not task.cancelled():
+                    # Retrieve the error even if no one is waiting anymore
+                    task.exception()
+            shared.task.add_done_callback(done)
+            builds[key] = shared
+        else:
+            self.log.info(f'Joining the build in progress: {source_url}')
+        if self.log_stream_callback is not None:
+            shared.subscribe(self.log_stream_callback)
+        try:
+            # Cancelling a waiter does not cancel the shared build
+            return await asyncio.shield(shared.task)
+        finally:
+            if self.log_stream_callback is not None:
+                shared.unsubscribe(self.log_stream_callback)
+
+    async def _build(self, source_url: str, ref: str, emit) -> str:
+        fingerprint = self._build_fingerprint(ref)
+        if fingerprint is not None:
+            async with docker_call('images.list') as docker:
+                image = await self._find_image(docker, fingerprint)
+            if image is not None:
+                self.log.info(f'Reusing image by fingerprint {fingerprint}: {image}')
+                emit('building', f'Reusing existing image ({image}), fingerprint {fingerprint}\n')
+                return image
 
         labels = []
+        if fingerprint is not None:
+            labels.append(f"{FINGERPRINT_LABEL}={fingerprint}")
 
         builder_labels = {
             "repo2docker.repo": source_url,
@@ -100,11 +245,11 @@ class DockerImageBuilder(ImageBuilder):
         reuse_pattern = re.compile(r'Reusing existing image \(([^\)]+)\),.+')
         finished_pattern = re.compile(r'Successfully tagged\s+([^\s]+).*')
         image = None
-        async with Docker() as docker:
+        async with docker_call('containers.run') as docker:
             container = await docker.containers.run(config=config)
+        async with docker_call('containers.log', limited=False):
             async for log in container.log(stdout=True, stderr=True, follow=True):
-                if self.log_stream_callback is not None:
-                    self.log_stream_callback('building', log)
+                emit('building', log)
                 log = log.rstrip("\n")
                 m = reuse_pattern.match(log)
                 if m:
@@ -115,7 +260,8 @@ class DockerImageBuilder(ImageBuilder):
                     image = m.group(1)               
                     self.log.info(f'Finished detected: {image}')
                 self.log.info(f'Builder({source_url}): {log}')
-            if image is None:
-                raise RuntimeError('Failed to build image')
+        if image is None:
+            raise RuntimeError('Failed to build image')
+        async with docker_call('containers.delete'):
             await container.delete()
         return image
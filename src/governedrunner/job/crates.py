@@ -1,8 +1,36 @@
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+import gzip
+import hashlib
 import json
+import logging
+import re
+from typing import Any, Optional
+import uuid
 
-from ..api.rdm import RDMService
-from .wb import find_file_by_name
+from fastapi import HTTPException
+
+from ..api.cache import token_hash
+from ..api.rdm import RDMService, strip_query
+from ..api.settings import Settings
+from .rocrate import CrateGraph, has_type
+from .wb import create_file, get_folder_index
+
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+
+INDEX_FILENAME = 'index.json'
+# Marks that index.json has been imported into segments
+INDEX_MANIFEST_FILENAME = 'index.manifest.json'
+INDEX_SEGMENT_PREFIX = 'index-'
+INDEX_SEGMENT_SUFFIX = '.jsonl'
+# index-<month>-<stamp>[-<writer>].jsonl; older segments have a sequence number as the stamp
+INDEX_SEGMENT_PATTERN = re.compile(r'^index-(\d{6})-([0-9T]+)(?:-([0-9a-z]+))?\.jsonl$')
+INDEX_READ_ATTEMPTS = 3
+# Stamp of the segments imported from index.json, older than any appended segment
+LEGACY_SEGMENT_STAMP = '0'
 
 
 class RunCrateIndex:
@@ -30,58 +58,66 @@ def _to_job_status(status: str):
         return 'failed'
     raise ValueError(f'Unexpected status: {status}')
 
-def _create_log_entity(id: str, log: str):
+def _create_log_entity(id: str, log: str, content: bytes, file: Any):
     now = datetime.now(timezone.utc)
     return {
-        '@type': 'File',
-        '@id': f"runner-{id}.log",
+        '@id': _log_filename(id),
         '@type': 'File',
         'dateModified': now.isoformat(),
-        'text': log,
         'lineCount': len(log.splitlines()),
-        'contentSize': len(log),
-        'encodingFormat': 'text/plain',
+        'contentSize': len(content),
+        'sha256': hashlib.sha256(content).hexdigest(),
+        'encodingFormat': 'application/gzip',
+        'rdmURL': file['links']['download'],
         'name': 'Runner log',
     }
 
+def _log_filename(id: str):
+    return f'runner-{id}.log.gz'
+
+async def _upload_log(rdm: RDMService, id: str, crate_folder_url: str, log: str):
+    content = gzip.compress(log.encode('utf-8'), mtime=0)
+    file = await create_file(rdm, crate_folder_url, _log_filename(id), content=content)
+    return _create_log_entity(id, log, content, file)
+
 async def modify_crate(rdm: RDMService, id: str, crate_file_url: str, crate_folder_url: str, runner_log: str):
-    crate_content = await rdm.get(crate_file_url)
-    entities = crate_content['@graph']
-    create_action_entities = [entity for entity in entities if entity['@type'] == 'CreateAction']
-    if len(create_action_entities) == 0:
-        raise ValueError(f'No CreateAction entities: {crate_content}')
-    create_action_entity = create_action_entities[0]
+    resp = await rdm.open_stream(crate_file_url)
+    try:
+        graph = await CrateGraph.load(resp.aiter_bytes())
+    finally:
+        await resp.aclose()
+    create_action_entity = graph.first_of_type('CreateAction')
+    if create_action_entity is None:
+        raise ValueError(f'No CreateAction entities: {crate_file_url}')
     result_entities = create_action_entity['result']
     if len(result_entities) == 0:
-        raise ValueError(f'No result entities: {crate_content}')
+        raise ValueError(f'No result entities: {crate_file_url}')
     result_entity = result_entities[0]
     result_name = result_entity['@id']
-    result_file_entities = [entity for entity in entities if entity['@type'] == 'File' and entity['@id'] == result_name]
-    if len(result_file_entities) == 0:
-        raise ValueError(f'No result file entities: {crate_content}')
-    result_file_entity = result_file_entities[0]
-    if '?' in crate_folder_url:
-        crate_folder_url = crate_folder_url[:crate_folder_url.index('?')]
-    result_file_json = json.loads(result_file_entity['text'])
-    result_file_resp = await rdm.put(f'{crate_folder_url}?kind=file&name={result_name}', json=result_file_json)
-    result_file = result_file_resp['data']
-    result_file_entity.update({
+    result_file_entity = graph.get(result_name)
+    if result_file_entity is None or not has_type(result_file_entity, 'File'):
+        raise ValueError(f'No result file entities: {crate_file_url}')
+    # The embedded document is uploaded as is, without decoding it
+    result_file = await create_file(
+        rdm, crate_folder_url, result_name,
+        content=result_file_entity['text'].encode('utf-8'),
+    )
+    properties = {
         'size': result_file['attributes']['size'],
         'rdmURL': result_file['links']['download'],
         'name': result_name,
-    })
+    }
     candidates = ['sha1', 'sha256', 'sha512', 'md5']
     for candidate in candidates:
         if candidate in result_file['attributes']:
-            result_file_entity[candidate] = result_file['attributes'][candidate]
-    entities.append(_create_log_entity(id, runner_log))
-    await rdm.put(crate_file_url, json=crate_content)
+            properties[candidate] = result_file['attributes'][candidate]
+    graph.update(result_file_entity, properties)
+    graph.add(await _upload_log(rdm, id, crate_folder_url, runner_log))
+    await rdm.put(crate_file_url, content=graph.dumps())
     return _to_job_status(create_action_entity['actionStatus'])
 
-async def insert_index(rdm: RDMService, folder_url: str, entry: RunCrateIndex):
-    if '?' in folder_url:
-        folder_url = folder_url[:folder_url.index('?')]
-    jsonentry = dict(
+def _to_index_entry(entry: RunCrateIndex) -> dict[str, Any]:
+    return dict(
         notebook=entry.notebook,
         id=entry.id,
         created_at=entry.created_at,
@@ -90,11 +126,357 @@ async def insert_index(rdm: RDMService, folder_url: str, entry: RunCrateIndex):
         status=entry.status,
         links=entry.links,
     )
-    file = await find_file_by_name(rdm, folder_url, 'index.json')
-    if file is None:
-        await rdm.put(f'{folder_url}?kind=file&name=index.json', json=[jsonentry])
+
+def _current_month() -> str:
+    return datetime.now(timezone.utc).strftime('%Y%m')
+
+def _entry_month(entry: dict[str, Any]) -> str:
+    try:
+        return datetime.fromisoformat(entry['created_at']).strftime('%Y%m')
+    except (KeyError, TypeError, ValueError):
+        return _current_month()
+
+def _encode_entries(entries: list[dict[str, Any]]) -> bytes:
+    return ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+
+def _decode_entries(text: str) -> list[dict[str, Any]]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def _pack_segments(entries: list[dict[str, Any]], month: Optional[str] = None) -> list[tuple[str, list[dict[str, Any]]]]:
+    """
+    Split entries into runs of the same month that fit in a segment.
+    """
+    segments = []
+    size = 0
+    for entry in entries:
+        entry_month = month or _entry_month(entry)
+        entry_size = len(_encode_entries([entry]))
+        if len(segments) == 0 or segments[-1][0] != entry_month or \
+                size + entry_size > settings.crate_index_segment_size:
+            segments.append((entry_month, []))
+            size = 0
+        segments[-1][1].append(entry)
+        size += entry_size
+    return segments
+
+def _new_stamp() -> str:
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+
+def segment_name(month: str, stamp: str, writer: str) -> str:
+    return f'{INDEX_SEGMENT_PREFIX}{month}-{stamp}-{writer}{INDEX_SEGMENT_SUFFIX}'
+
+
+class IndexSegment:
+    name: str
+    month: str
+    stamp: str
+    writer: str
+    size: Optional[int]
+    file: Any
+
+    def __init__(self, name: str, month: str, stamp: str, writer: str, size: Optional[int] = None, file: Any = None):
+        self.name = name
+        self.month = month
+        self.stamp = stamp
+        self.writer = writer
+        self.size = size
+        self.file = file
+
+    @property
+    def sort_key(self) -> tuple[str, str, str]:
+        return (self.month, self.stamp, self.writer)
+
+
+class IndexManifest:
+    """
+    Segments of a run-crate index, oldest first, as found in the folder.
+
+    Segments are created once under unique names and never modified, so
+    appends from several processes cannot overwrite each other. The folder
+    listing is the manifest: there is no shared file to update.
+    """
+    segments: list[IndexSegment]
+    legacy_file: Optional[Any]
+
+    def __init__(self, segments: Optional[list[IndexSegment]] = None, legacy_file: Optional[Any] = None):
+        self.segments = sorted(segments or [], key=lambda segment: segment.sort_key)
+        self.legacy_file = legacy_file
+
+    @classmethod
+    def from_files(cls, files: list[Any]) -> 'IndexManifest':
+        """
+        Find the segments among the files of the folder.
+
+        `index.json` is read as the oldest entries unless it has been imported
+        into segments, which is marked by `index.manifest.json`.
+        """
+        segments = []
+        names = {}
+        for file in files:
+            name = file['attributes']['name']
+            names[name] = file
+            m = INDEX_SEGMENT_PATTERN.match(name)
+            if m is None:
+                continue
+            segments.append(IndexSegment(
+                name, m.group(1), m.group(2), m.group(3) or '',
+                size=file['attributes'].get('size', None),
+                file=file,
+            ))
+        legacy_file = None
+        if INDEX_MANIFEST_FILENAME not in names:
+            legacy_file = names.get(INDEX_FILENAME, None)
+        return cls(segments, legacy_file)
+
+async def _list_manifest(rdm: RDMService, folder_url: str) -> IndexManifest:
+    # Segments created by other processes must be seen
+    rdm.invalidate(folder_url)
+    return IndexManifest.from_files(await get_folder_index(rdm, folder_url).list(rdm))
+
+async def _write_segments(rdm: RDMService, folder_url: str, packed: list[tuple[str, list[dict[str, Any]]]], stamp: Optional[str] = None, writer: Optional[str] = None) -> list[str]:
+    names = []
+    for i, (month, entries) in enumerate(packed):
+        name = segment_name(
+            month,
+            stamp or _new_stamp(),
+            f'{writer}{i:04d}' if writer is not None else uuid.uuid4().hex[:12],
+        )
+        await create_file(rdm, folder_url, name, content=_encode_entries(entries))
+        names.append(name)
+    return names
+
+async def _import_legacy_index(rdm: RDMService, folder_url: str, manifest: IndexManifest) -> bool:
+    """
+    Copy the entries of `index.json` into segments and mark it as imported.
+
+    The segments sort before the appended ones of the same month. An import
+    interrupted, or run by two processes at once, only leaves duplicate
+    entries, which readers and compactions drop.
+    """
+    if manifest.legacy_file is None:
+        return False
+    entries = await rdm.get(manifest.legacy_file['links']['download'])
+    names = await _write_segments(
+        rdm, folder_url, _pack_segments(entries),
+        stamp=LEGACY_SEGMENT_STAMP, writer=f'l{uuid.uuid4().hex[:8]}',
+    )
+    try:
+        await create_file(rdm, folder_url, INDEX_MANIFEST_FILENAME, json={
+            'imported': INDEX_FILENAME,
+            'segments': names,
+        })
+    except HTTPException as e:
+        # Imported by another process as well
+        if e.status_code != 409:
+            raise
+    logger.info(f'Imported {len(entries)} entries of {INDEX_FILENAME} into {len(names)} segments: {folder_url}')
+    return True
+
+async def append_index(rdm: RDMService, folder_url: str, entries: list[RunCrateIndex]):
+    """
+    Append entries to the run-crate index in the folder.
+
+    The entries are written as new segments; existing files are never rewritten.
+    """
+    if len(entries) == 0:
         return
-    index_url = file['links']['upload']
-    index = await rdm.get(index_url)
-    index.append(jsonentry)
-    await rdm.put(index_url, json=index)
+    folder_url = strip_query(folder_url)
+    jsonentries = [_to_index_entry(entry) for entry in entries]
+    await _write_segments(rdm, folder_url, _pack_segments(jsonentries, month=_current_month()))
+
+async def insert_index(rdm: RDMService, folder_url: str, entry: RunCrateIndex):
+    await append_index(rdm, folder_url, [entry])
+
+class IndexWriter:
+    """
+    Batches run-crate index entries per folder and user and appends each batch at once.
+
+    Entries are collected for `delay` seconds after the first one arrives.
+    Each batch holds the entries of one user and is written with that user's
+    RDMService. Appends to the same folder are serialised within the process;
+    across processes, appends never rewrite existing files. Once a month of
+    the folder has `compact_segments` small segments, they are merged.
+    """
+
+    def __init__(self, delay: float, compact_segments: int = 0):
+        self.delay = delay
+        self.compact_segments = compact_segments
+        # (folder URL, token hash) -> queued entries
+        self._pending: dict[tuple[str, str], list[tuple[RDMService, RunCrateIndex, asyncio.Future]]] = {}
+        self._flushers: dict[tuple[str, str], asyncio.Task] = {}
+        # Folder URL -> the lock and the number of flushes using it
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+    async def insert(self, rdm: RDMService, folder_url: str, entry: RunCrateIndex):
+        """
+        Queue the entry and wait until it has been written.
+        """
+        key = (strip_query(folder_url), token_hash(rdm.access_token))
+        done = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((rdm, entry, done))
+        if key not in self._flushers:
+            self._flushers[key] = asyncio.ensure_future(self._flush_later(key))
+        # The entry is written even if the caller is cancelled
+        await asyncio.shield(done)
+
+    async def _flush_later(self, key: tuple[str, str]):
+        await asyncio.sleep(self.delay)
+        self._flushers.pop(key, None)
+        await self._flush(key)
+
+    @asynccontextmanager
+    async def _folder_lock(self, folder_url: str):
+        lock, users = self._locks.get(folder_url, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[folder_url] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[folder_url]
+            if users <= 1:
+                del self._locks[folder_url]
+            else:
+                self._locks[folder_url] = (lock, users - 1)
+
+    async def _flush(self, key: tuple[str, str]):
+        folder_url, _ = key
+        async with self._folder_lock(folder_url):
+            batch = self._pending.pop(key, [])
+            if len(batch) == 0:
+                return
+            # All the entries of the batch belong to the same user
+            rdm, _, _ = batch[0]
+            try:
+                await append_index(rdm, folder_url, [entry for _, entry, _ in batch])
+                logger.debug(f'Appended {len(batch)} entries to the index: {folder_url}')
+            except Exception as e:
+                logger.exception(f'Failed to append {len(batch)} entries to the index: {folder_url}')
+                for _, _, done in batch:
+                    if not done.done():
+                        done.set_exception(e)
+                        # Mark as retrieved even if the caller has gone
+                        done.exception()
+                return
+            for _, _, done in batch:
+                if not done.done():
+                    done.set_result(None)
+            await self._compact(rdm, folder_url)
+
+    async def _compact(self, rdm: RDMService, folder_url: str):
+        if self.compact_segments <= 1:
+            return
+        try:
+            await compact_index(rdm, folder_url, min_segments=self.compact_segments)
+        except Exception:
+            logger.exception(f'Failed to compact the index: {folder_url}')
+
+    async def flush_all(self):
+        """
+        Write all queued entries now.
+        """
+        flushers = list(self._flushers.values())
+        self._flushers.clear()
+        for flusher in flushers:
+            flusher.cancel()
+        await asyncio.gather(*flushers, return_exceptions=True)
+        for key in list(self._pending.keys()):
+            await self._flush(key)
+
+index_writer = IndexWriter(settings.crate_index_flush_delay, settings.crate_index_compact_segments)
+
+async def _read_segment(rdm: RDMService, segment: IndexSegment) -> list[dict[str, Any]]:
+    return _decode_entries(await rdm.get_text(segment.file['links']['download']))
+
+async def read_index(rdm: RDMService, folder_url: str, limit: Optional[int] = None, notebook: Optional[str] = None) -> list[dict[str, Any]]:
+    """
+    Read the run-crate index in the folder, newest entries first.
+
+    Segments are downloaded only until `limit` entries are found. Entries are
+    unique by ID, since a compaction may leave both the merged segment and
+    its sources for a while.
+    """
+    folder_url = strip_query(folder_url)
+    for attempt in range(INDEX_READ_ATTEMPTS):
+        manifest = await _list_manifest(rdm, folder_url)
+        try:
+            return await _read_manifest(rdm, manifest, limit, notebook)
+        except HTTPException as e:
+            # A segment was removed by a compaction after the listing
+            if e.status_code not in (404, 410) or attempt + 1 >= INDEX_READ_ATTEMPTS:
+                raise
+            logger.info(f'Index segment disappeared, reading again: {folder_url}')
+
+async def _read_manifest(rdm: RDMService, manifest: IndexManifest, limit: Optional[int], notebook: Optional[str]) -> list[dict[str, Any]]:
+    result = []
+    seen = set()
+    def add(entries: list[dict[str, Any]]) -> bool:
+        for entry in reversed(entries):
+            if entry.get('id', None) in seen:
+                continue
+            seen.add(entry.get('id', None))
+            if notebook is not None and entry['notebook'] != notebook:
+                continue
+            result.append(entry)
+            if limit is not None and len(result) >= limit:
+                return True
+        return False
+    for segment in reversed(manifest.segments):
+        if add(await _read_segment(rdm, segment)):
+            return result
+    if manifest.legacy_file is not None:
+        add(await rdm.get(manifest.legacy_file['links']['download']))
+    return result
+
+async def compact_index(rdm: RDMService, folder_url: str, min_segments: int = 2) -> int:
+    """
+    Merge the small segments of each month into as few segments as possible.
+
+    `index.json` is imported into segments first, so that it is no longer read.
+    The merged segments are written before their sources are removed, and
+    segments appended meanwhile are not touched, so no entry is lost even if
+    appends or other compactions run at the same time.
+
+    Returns:
+        The number of segments removed
+    """
+    folder_url = strip_query(folder_url)
+    manifest = await _list_manifest(rdm, folder_url)
+    if await _import_legacy_index(rdm, folder_url, manifest):
+        manifest = await _list_manifest(rdm, folder_url)
+    small_size = settings.crate_index_segment_size // 2
+    by_month: dict[str, list[IndexSegment]] = {}
+    for segment in manifest.segments:
+        if segment.size is not None and segment.size >= small_size:
+            continue
+        by_month.setdefault(segment.month, []).append(segment)
+    removed = 0
+    for month, segments in by_month.items():
+        if len(segments) < min_segments:
+            continue
+        entries = []
+        seen = set()
+        for segment in segments:
+            for entry in await _read_segment(rdm, segment):
+                if entry.get('id', None) in seen:
+                    continue
+                seen.add(entry.get('id', None))
+                entries.append(entry)
+        # Keep the position of the newest source in the order of segments
+        await _write_segments(
+            rdm, folder_url, _pack_segments(entries, month=month),
+            stamp=segments[-1].stamp, writer=f'c{uuid.uuid4().hex[:8]}',
+        )
+        for segment in segments:
+            try:
+                await rdm.delete(segment.file['links']['delete'])
+            except HTTPException as e:
+                # Removed by another compaction
+                if e.status_code not in (404, 410):
+                    raise
+        removed += len(segments)
+    rdm.invalidate(folder_url)
+    if removed > 0:
+        logger.info(f'Compacted index: {removed} segments merged in {folder_url}')
+    return removed
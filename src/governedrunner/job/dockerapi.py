@@ -0,0 +1,105 @@
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+import time
+from typing import Any, Optional
+
+from aiodocker import Docker
+
+from ..api.cache import LRUCache
+from ..api.settings import Settings
+
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+_docker: Optional[Docker] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+# Image inspections by image ID, and image IDs by name
+_images_by_id = LRUCache(settings.docker_image_cache_max_entries, float('inf'))
+_image_ids = LRUCache(settings.docker_image_cache_max_entries, settings.docker_image_cache_ttl)
+# Counters of Docker API calls by operation
+docker_stats: dict[str, dict[str, float]] = {}
+
+
+def get_docker() -> Docker:
+    '''
+    Return the process-wide Docker client.
+
+    Use `docker_call` for requests so that they are limited and measured.
+    '''
+    global _docker, _semaphore
+    if _docker is None:
+        _docker = Docker()
+        _semaphore = asyncio.Semaphore(settings.docker_max_concurrency)
+    return _docker
+
+def _record(operation: str, waited: float, elapsed: float, failed: bool):
+    stats = docker_stats.get(operation, None)
+    if stats is None:
+        stats = docker_stats[operation] = {
+            'calls': 0,
+            'errors': 0,
+            'wait_seconds': 0.0,
+            'seconds': 0.0,
+            'max_seconds': 0.0,
+        }
+    stats['calls'] += 1
+    stats['errors'] += 1 if failed else 0
+    stats['wait_seconds'] += waited
+    stats['seconds'] += elapsed
+    stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+@asynccontextmanager
+async def docker_call(operation: str, limited: bool = True):
+    '''
+    Use the shared Docker client for an operation.
+
+    Limited calls wait for a slot so that the daemon is not flooded.
+    Long-running streams should pass `limited=False` not to hold a slot.
+    '''
+    docker = get_docker()
+    requested_at = time.monotonic()
+    if limited:
+        await _semaphore.acquire()
+    started_at = time.monotonic()
+    failed = False
+    try:
+        yield docker
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        if limited:
+            _semaphore.release()
+        elapsed = time.monotonic() - started_at
+        _record(operation, started_at - requested_at, elapsed, failed)
+        logger.debug(f'Docker {operation}: {elapsed:.3f}s (waited {started_at - requested_at:.3f}s)')
+
+async def inspect_image(name: str) -> dict[str, Any]:
+    '''
+    Inspect the image. Results are cached by image ID since images are immutable.
+    '''
+    entry = _image_ids.get(name)
+    if entry is not None and entry.fresh:
+        cached = _images_by_id.get(entry.value)
+        if cached is not None:
+            return cached.value
+    async with docker_call('images.inspect') as docker:
+        image = await docker.images.inspect(name)
+    _images_by_id.set(image['Id'], image)
+    _image_ids.set(name, image['Id'])
+    _image_ids.set(image['Id'], image['Id'])
+    return image
+
+async def close_docker():
+    global _docker, _semaphore
+    if _docker is None:
+        return
+    for operation, stats in sorted(docker_stats.items()):
+        logger.info(f'Docker {operation}: {stats}')
+    docker = _docker
+    _docker = None
+    _semaphore = None
+    _images_by_id.clear()
+    _image_ids.clear()
+    await docker.close()
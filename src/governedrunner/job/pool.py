@@ -0,0 +1,163 @@
+import asyncio
+from collections import deque
+from collections.abc import Awaitable, Callable, Hashable
+import logging
+import time
+from typing import Optional
+
+from aiodocker.exceptions import DockerError
+from jupyterhub.spawner import Spawner
+
+from .dockerapi import docker_call
+
+
+logger = logging.getLogger(__name__)
+
+# Keeps a pooled container alive. Arguments appended by the spawner are ignored.
+IDLE_CMD = ['/bin/sh', '-c', 'while true; do sleep 3600; done', 'idle']
+
+
+class PooledContainer:
+    spawner: Spawner
+    container_id: str
+    idle_since: float
+
+    def __init__(self, spawner: Spawner, container_id: str):
+        self.spawner = spawner
+        self.container_id = container_id
+        self.idle_since = time.monotonic()
+
+    @classmethod
+    async def start(cls, spawner: Spawner) -> 'PooledContainer':
+        await spawner.start()
+        async with docker_call('containers.get') as docker:
+            container = await docker.containers.get(spawner.container_name)
+        return cls(spawner, container.id)
+
+    async def is_running(self) -> bool:
+        try:
+            async with docker_call('containers.get') as docker:
+                container = await docker.containers.get(self.container_id)
+        except DockerError:
+            return False
+        return container._container['State']['Running']
+
+
+class ContainerPool:
+    """
+    Idle containers started in advance, by image.
+
+    Each container is used by one job and removed afterwards. The number of idle
+    containers for an image follows the number of jobs requested for it within
+    `demand_window` seconds, up to `max_size`. Containers idle for longer than
+    `idle_timeout` seconds are removed.
+    """
+
+    def __init__(self):
+        self.max_size = 0
+        self.idle_timeout = 300.0
+        self.demand_window = 600.0
+        self._idle: dict[Hashable, list[PooledContainer]] = {}
+        self._warming: dict[Hashable, int] = {}
+        self._demand: dict[Hashable, deque[float]] = {}
+        self._factories: dict[Hashable, Callable[[], Awaitable[PooledContainer]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._reaper: Optional[asyncio.Task] = None
+
+    def configure(self, max_size: int, idle_timeout: float, demand_window: float):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.demand_window = demand_window
+
+    def _target_size(self, key: Hashable) -> int:
+        demand = self._demand.get(key, deque())
+        since = time.monotonic() - self.demand_window
+        while len(demand) > 0 and demand[0] < since:
+            demand.popleft()
+        return min(self.max_size, len(demand))
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _replenish(self, key: Hashable):
+        factory = self._factories.get(key, None)
+        if factory is None:
+            return
+        missing = self._target_size(key) - len(self._idle.get(key, [])) - self._warming.get(key, 0)
+        for _ in range(missing):
+            self._warming[key] = self._warming.get(key, 0) + 1
+            self._spawn(self._warm(key, factory))
+
+    async def _warm(self, key: Hashable, factory: Callable[[], Awaitable[PooledContainer]]):
+        try:
+            container = await factory()
+        except Exception:
+            logger.exception(f'Failed to start a pooled container: {key}')
+            return
+        finally:
+            self._warming[key] -= 1
+        logger.info(f'Pooled container is ready: {container.container_id} for {key}')
+        self._idle.setdefault(key, []).append(container)
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 30.0))
+            deadline = time.monotonic() - self.idle_timeout
+            for key, containers in list(self._idle.items()):
+                expired = [c for c in containers if c.idle_since < deadline]
+                for container in expired:
+                    containers.remove(container)
+                    logger.info(f'Evicting idle container: {container.container_id}')
+                    await self.release(container)
+                if len(containers) == 0 and self._target_size(key) == 0:
+                    del self._idle[key]
+                    self._factories.pop(key, None)
+
+    async def acquire(self, key: Hashable, factory: Callable[[], Awaitable[PooledContainer]]) -> Optional[PooledContainer]:
+        """
+        Take an idle container for the key, and start more for the following jobs.
+
+        Returns:
+            The container, or None if no container is ready
+        """
+        if self.max_size <= 0:
+            return None
+        if self._reaper is None:
+            self._reaper = asyncio.ensure_future(self._reap())
+        self._demand.setdefault(key, deque()).append(time.monotonic())
+        self._factories[key] = factory
+        idle = self._idle.get(key, [])
+        container = None
+        while len(idle) > 0:
+            candidate = idle.pop()
+            if await candidate.is_running():
+                container = candidate
+                break
+            logger.warning(f'Pooled container is not running: {candidate.container_id}')
+            self._spawn(self.release(candidate))
+        self._replenish(key)
+        return container
+
+    async def release(self, container: PooledContainer):
+        try:
+            await container.spawner.stop()
+        except Exception:
+            logger.exception(f'Failed to stop a pooled container: {container.container_id}')
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        idle = [c for containers in self._idle.values() for c in containers]
+        self._idle.clear()
+        self._factories.clear()
+        await asyncio.gather(*[self.release(c) for c in idle])
+
+
+container_pool = ContainerPool()
@@ -0,0 +1,210 @@
+from collections.abc import AsyncIterator, Callable
+import codecs
+import json
+import re
+from typing import Any, Optional
+
+
+GRAPH_KEY = '@graph'
+
+_WHITESPACE = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+
+
+async def _once(content: bytes):
+    yield content
+
+def get_types(entity: dict[str, Any]) -> list[str]:
+    types = entity.get('@type', [])
+    if isinstance(types, str):
+        return [types]
+    return list(types)
+
+def has_type(entity: dict[str, Any], type: str) -> bool:
+    return type in get_types(entity)
+
+
+class _Reader:
+    """
+    Decodes JSON values one by one from an async iterator of bytes.
+
+    Chunks are pulled only when the buffered text does not hold a complete value.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks.__aiter__()
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    async def _read(self, min_size: int):
+        # Read at least as much as is buffered so that retries stay linear
+        parts = [self.buffer[self.pos:]]
+        size = 0
+        while size < min_size and not self.eof:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self.eof = True
+                parts.append(self._decoder.decode(b'', final=True))
+                break
+            text = self._decoder.decode(chunk)
+            parts.append(text)
+            size += len(text)
+        self.buffer = ''.join(parts)
+        self.pos = 0
+
+    async def peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError('Unexpected end of crate')
+            await self._read(1)
+
+    async def expect(self, char: str):
+        found = await self.peek()
+        if found != char:
+            raise ValueError(f'Unexpected character in crate: {found!r} (expected {char!r})')
+        self.pos += 1
+
+    async def value(self) -> tuple[Any, str]:
+        """
+        Decode the next value.
+
+        Returns:
+            The value and its source text
+        """
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A value ending at the end of the buffer may be truncated
+                if end < len(self.buffer) or self.eof:
+                    raw = self.buffer[self.pos:end]
+                    self.pos = end
+                    return value, raw
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            await self._read(max(len(self.buffer) - self.pos, 1))
+
+    async def members(self) -> AsyncIterator[str]:
+        """
+        Iterate over the keys of an object. The caller must consume each value.
+        """
+        await self.expect('{')
+        if await self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key, _ = await self.value()
+            await self.expect(':')
+            yield key
+            if await self.peek() == '}':
+                self.pos += 1
+                return
+            await self.expect(',')
+
+    async def items(self) -> AsyncIterator[tuple[Any, str]]:
+        await self.expect('[')
+        if await self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield await self.value()
+            if await self.peek() == ']':
+                self.pos += 1
+                return
+            await self.expect(',')
+
+
+async def find_entity(chunks: AsyncIterator[bytes], predicate: Callable[[dict[str, Any]], bool]) -> Optional[dict[str, Any]]:
+    """
+    Return the first entity of the crate which satisfies the predicate.
+
+    The rest of the crate is neither read nor decoded.
+    """
+    reader = _Reader(chunks)
+    async for key in reader.members():
+        if key != GRAPH_KEY:
+            await reader.value()
+            continue
+        async for entity, _ in reader.items():
+            if predicate(entity):
+                return entity
+    return None
+
+
+class CrateGraph:
+    """
+    Entities of an RO-Crate metadata document indexed by `@id` and `@type`.
+
+    Unchanged entities are written back as their original text.
+    """
+
+    def __init__(self):
+        self.members: dict[str, Any] = {}
+        self.entities: list[dict[str, Any]] = []
+        self._raw: list[Optional[str]] = []
+        self._positions: dict[int, int] = {}
+        self._by_id: dict[str, dict[str, Any]] = {}
+        self._by_type: dict[str, list[dict[str, Any]]] = {}
+
+    @classmethod
+    async def load(cls, chunks: AsyncIterator[bytes]) -> 'CrateGraph':
+        graph = cls()
+        reader = _Reader(chunks)
+        async for key in reader.members():
+            if key != GRAPH_KEY:
+                graph.members[key], _ = await reader.value()
+                continue
+            async for entity, raw in reader.items():
+                graph._append(entity, raw)
+        return graph
+
+    @classmethod
+    async def loads(cls, content: bytes) -> 'CrateGraph':
+        return await cls.load(_once(content))
+
+    def _append(self, entity: dict[str, Any], raw: Optional[str]):
+        self._positions[id(entity)] = len(self.entities)
+        self.entities.append(entity)
+        self._raw.append(raw)
+        if '@id' in entity:
+            self._by_id.setdefault(entity['@id'], entity)
+        for type in get_types(entity):
+            self._by_type.setdefault(type, []).append(entity)
+
+    def get(self, id: str) -> Optional[dict[str, Any]]:
+        return self._by_id.get(id, None)
+
+    def of_type(self, type: str) -> list[dict[str, Any]]:
+        return self._by_type.get(type, [])
+
+    def first_of_type(self, type: str) -> Optional[dict[str, Any]]:
+        entities = self.of_type(type)
+        if len(entities) == 0:
+            return None
+        return entities[0]
+
+    def add(self, entity: dict[str, Any]):
+        self._append(entity, None)
+
+    def update(self, entity: dict[str, Any], properties: dict[str, Any]):
+        entity.update(properties)
+        self._raw[self._positions[id(entity)]] = None
+
+    def dumps(self) -> bytes:
+        members = [
+            f'{json.dumps(key)}:{json.dumps(value, ensure_ascii=False)}'
+            for key, value in self.members.items()
+        ]
+        entities = [
+            raw if raw is not None else json.dumps(entity, ensure_ascii=False)
+            for entity, raw in zip(self.entities, self._raw)
+        ]
+        members.append(f'{json.dumps(GRAPH_KEY)}:[{",".join(entities)}]')
+        return ('{' + ','.join(members) + '}').encode('utf-8')
@@ -1,20 +1,28 @@
-from traitlets import Bool, Callable
+from collections import deque
+import uuid
+
+from traitlets import Bool, Callable, Enum, Float, Int
 from traitlets.config import Application
 from jupyterhub.traitlets import EntryPointType
 from jupyterhub.spawner import Spawner
 
 from ..db.models import Job
+from ..api.cache import token_hash
 from ..api.rdm import RDMService
-from .crates import RunCrateIndex, modify_crate, insert_index
+from ..api.settings import Settings
+from .crates import RunCrateIndex, modify_crate, index_writer
 from .wb import (
     get_parent_folder, get_crate_folder, extract_rdm_url,
     extract_rdm_node_id, extract_rdm_storage_provider, extract_repo_info,
     get_target_provider, find_file_by_name, files_url_to_web_url,
+    get_repo_fingerprint,
 )
 from .builders import ImageBuilder, DockerImageBuilder
 from .trackers import JobTracker, DockerTracker
 from .spawners import Repo2DockerSpawner
-from .spawner import configure_spawner
+from .spawner import configure_spawner, PooledJob
+from .pool import IDLE_CMD, PooledContainer, container_pool
+from .stages import StageGraph
 
 
 def new_instance(klass, app):
@@ -30,6 +38,40 @@ class RunnerResult:
         self.result_url = result_url
         self.status = status
 
+settings = Settings()
+LOG_TAIL_MARKER = '[... earlier log dropped ...]\n'
+
+
+class LogTail:
+    '''
+    The last `max_bytes` bytes of a log, kept as the chunks it was written in.
+    '''
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.chunks: deque[str] = deque()
+        self.size = 0
+        self.dropped = False
+
+    def append(self, log: str):
+        self.chunks.append(log)
+        self.size += len(log.encode('utf-8'))
+        if self.max_bytes <= 0:
+            return
+        while self.size > self.max_bytes and len(self.chunks) > 1:
+            self.size -= len(self.chunks.popleft().encode('utf-8'))
+            self.dropped = True
+        if self.size > self.max_bytes:
+            encoded = self.chunks[0].encode('utf-8')[-self.max_bytes:]
+            self.chunks[0] = encoded.decode('utf-8', errors='ignore')
+            self.size = len(self.chunks[0].encode('utf-8'))
+            self.dropped = True
+
+    def text(self) -> str:
+        log = ''.join(self.chunks)
+        return LOG_TAIL_MARKER + log if self.dropped else log
+
+
 class GovernedRunner(Application):
     builder_class = EntryPointType(
         default_value=DockerImageBuilder,
@@ -69,6 +111,53 @@ class GovernedRunner(Application):
         """,
     ).tag(config=True)
 
+    use_build_cache = Bool(
+        True,
+        help="""Whether to reuse an image built from the same repository contents.
+
+        The contents are compared by a digest of the file metadata in the storage.
+        """,
+    ).tag(config=True)
+
+    build_cache_scope = Enum(
+        ['contents', 'user'],
+        'contents',
+        help="""Which jobs may reuse an image built for another job.
+
+        'contents' shares images between all users whose repositories have the
+        same contents; computing the fingerprint requires reading every file,
+        so only users who can read the contents get the image. 'user' reuses
+        images only among the jobs of the same user.
+        """,
+    ).tag(config=True)
+
+    build_cache_max_files = Int(
+        10000,
+        help="""Maximum number of files in a repository to compute the digest for.
+        """,
+    ).tag(config=True)
+
+    container_pool_max_size = Int(
+        0,
+        help="""Maximum number of idle containers started in advance per image and user.
+
+        If positive, jobs run in a pooled container by `exec` when one is ready.
+        The pool is sized by the number of recent jobs for the image.
+        """,
+    ).tag(config=True)
+
+    container_pool_idle_timeout = Float(
+        300.0,
+        help="""Seconds after which an unused pooled container is removed.
+        """,
+    ).tag(config=True)
+
+    container_pool_demand_window = Float(
+        600.0,
+        help="""Seconds of recent jobs to consider when sizing the container pool.
+        """,
+    ).tag(config=True)
+
     status_callback = Callable(
         None,
         help="""Callback function to call when job status is changed.
@@ -89,96 +178,198 @@ class GovernedRunner(Application):
     async def execute(self, job: Job, rdm: RDMService, source_url: str) -> RunnerResult:
         from ..api.settings import CRATE_FOLDER_NAME
         self.log.info(f'Starting... {source_url}')
-        log = ''
+        # The runner is shared by concurrent jobs, so keep the callbacks of this job
+        status_callback = self.status_callback
+        log_stream_callback = self.log_stream_callback
+        use_snapshot = self.use_snapshot
+        # Only the tail is uploaded with the crate, like the job log kept in the log store
+        log_tail = LogTail(settings.job_log_max_bytes)
         def log_stream_callback_impl(status, log_):
-            nonlocal log
-            log += log_
-            if self.log_stream_callback is not None:
-                self.log_stream_callback(status, log_)
-
-        # Build image
-        notebook_filename, repo_url = await extract_repo_info(rdm, source_url)
-        if self.status_callback is not None:
-            self.status_callback(job.id, 'building', notebook_filename)
-        builder = new_instance(self.builder_class, self)
-        optional_labels = {}
-        if get_target_provider(rdm, source_url) == 'rdm':
-            builder.optional_envs = {
-                'RDM_HOSTS_JSON': rdm.repo2docker_hosts_json,
-            }
-        optional_labels.update({
-            'provider': get_target_provider(rdm, source_url),
-            'user.rdm_node_id': extract_rdm_node_id(source_url),
-            'user.rdm_api_url': rdm.api_url,
-        })
-        builder.optional_labels = optional_labels
-        if self.use_snapshot:
-            _, repo_url = await extract_repo_info(rdm, extract_rdm_url(source_url))
-        builder.log_stream_callback = log_stream_callback_impl
-        self.log.info(f'Building image... {repo_url}')
-        image = await builder.build(repo_url)
-        self.log.info(f'Built image: {image}')
+            log_tail.append(log_)
+            if log_stream_callback is not None:
+                log_stream_callback(status, log_)
 
-        # Run container
-        if self.status_callback is not None:
-            self.status_callback(job.id, 'running', notebook_filename)
-        log_stream_callback_impl('running', f'Running {notebook_filename}...\n')
-        spawner = new_instance(self.spawner_class, self)
-        tracker = new_instance(self.tracker_class, self)
-        configure_spawner(job, spawner)
-        spawner.image = image
-        spawner.user_options = {
-            'image': image,
-        }
         result_filename = f'{job.id}.json'
         rdm_url = extract_rdm_url(source_url)
-        parent_folder_url = await get_parent_folder(rdm, rdm_url)
-        self.log.debug(f'Parent folder: {parent_folder_url}')
-        crate_folder_url = await get_crate_folder(rdm, parent_folder_url)
-        rdm_provider = extract_rdm_storage_provider(source_url)
-        self.log.debug(f'RDM storage provider: {rdm_provider}')
-        spawner.cmd = [
-            'env', 'RUN_CRATE_METADATA=~/.run-crate-metadata.json', f'RUN_CRATE_ID={job.id}',
-            'run-crate', notebook_filename, f'/mnt/rdm/{rdm_provider}/{CRATE_FOLDER_NAME}/{result_filename}',
-        ]
-        if get_target_provider(rdm, source_url) == 'rdm':
+        graph = StageGraph()
+
+        async def repo_info():
+            notebook_filename, repo_url = await extract_repo_info(rdm, source_url)
+            if status_callback is not None:
+                status_callback(job.id, 'building', notebook_filename)
+            return notebook_filename, repo_url
+        graph.add('repo_info', repo_info)
+
+        async def snapshot_repo_url():
+            if not use_snapshot:
+                return None
+            _, repo_url = await extract_repo_info(rdm, rdm_url)
+            return repo_url
+        graph.add('snapshot_repo_url', snapshot_repo_url)
+
+        async def fingerprint(repo_info, snapshot_repo_url):
+            if not self.use_build_cache:
+                return None
+            repo_url = snapshot_repo_url or repo_info[1]
             try:
-                spawner.rdmfs_token = rdm.access_token
-            except AttributeError:
-                self.log.warning('Spawner is not supported for RDMFS')
-        host, port = await spawner.start()
-        self.log.info(f'Started container: {host}:{port}')
-        process = await tracker.track_process(spawner, host, port)
-        self.log.debug(f'Waiting for process to finish...')
-        log_stream_callback_impl('running', f'Waiting for {notebook_filename} to finish...\n')
-        exit_code = await process.wait(log_stream_callback_impl)
-        self.log.info(f'Process finished: exit_code={exit_code}')
-        await spawner.stop()
-        log_stream_callback_impl('running', f'Collecting results...\n')
-        if exit_code != 0:
-            raise RuntimeError(f'Process failed: exit_code={exit_code}')
+                return await get_repo_fingerprint(rdm, repo_url, self.build_cache_max_files)
+            except Exception as e:
+                self.log.warning(f'Failed to compute fingerprint of {repo_url}: {e}')
+                return None
+        graph.add('fingerprint', fingerprint, requires=('repo_info', 'snapshot_repo_url'))
+
+        # Build image
+        async def build(repo_info, snapshot_repo_url, fingerprint):
+            _, repo_url = repo_info
+            if snapshot_repo_url is not None:
+                repo_url = snapshot_repo_url
+            builder = new_instance(self.builder_class, self)
+            builder.source_fingerprint = fingerprint
+            if self.build_cache_scope == 'user':
+                builder.cache_scope = job.owner.name
+            optional_labels = {}
+            if get_target_provider(rdm, source_url) == 'rdm':
+                builder.optional_envs = {
+                    'RDM_HOSTS_JSON': rdm.repo2docker_hosts_json,
+                }
+            optional_labels.update({
+                'provider': get_target_provider(rdm, source_url),
+                'user.rdm_node_id': extract_rdm_node_id(source_url),
+                'user.rdm_api_url': rdm.api_url,
+            })
+            builder.optional_labels = optional_labels
+            builder.log_stream_callback = log_stream_callback_impl
+            self.log.info(f'Building image... {repo_url}')
+            image = await builder.build(repo_url)
+            self.log.info(f'Built image: {image}')
+            return image
+        graph.add('build', build, requires=('repo_info', 'snapshot_repo_url', 'fingerprint'))
+
+        # Resolve folders
+        async def parent_folder():
+            parent_folder_url = await get_parent_folder(rdm, rdm_url)
+            self.log.debug(f'Parent folder: {parent_folder_url}')
+            return parent_folder_url
+        graph.add('parent_folder', parent_folder)
+
+        async def crate_folder(parent_folder_url):
+            return await get_crate_folder(rdm, parent_folder_url)
+        graph.add('crate_folder', crate_folder, requires=('parent_folder',))
+
+        # Prepare container
+        async def prepare_spawner(repo_info):
+            notebook_filename, _ = repo_info
+            spawner = new_instance(self.spawner_class, self)
+            configure_spawner(job, spawner)
+            rdm_provider = extract_rdm_storage_provider(source_url)
+            self.log.debug(f'RDM storage provider: {rdm_provider}')
+            spawner.cmd = [
+                'env', 'RUN_CRATE_METADATA=~/.run-crate-metadata.json', f'RUN_CRATE_ID={job.id}',
+                'run-crate', notebook_filename, f'/mnt/rdm/{rdm_provider}/{CRATE_FOLDER_NAME}/{result_filename}',
+            ]
+            if get_target_provider(rdm, source_url) == 'rdm':
+                try:
+                    spawner.rdmfs_token = rdm.access_token
+                except AttributeError:
+                    self.log.warning('Spawner is not supported for RDMFS')
+            return spawner
+        graph.add('prepare_spawner', prepare_spawner, requires=('repo_info',))
+
+        async def acquire_pooled_container(image, spawner):
+            if self.container_pool_max_size <= 0:
+                return None
+            container_pool.configure(
+                self.container_pool_max_size,
+                self.container_pool_idle_timeout,
+                self.container_pool_demand_window,
+            )
+            rdmfs_token = getattr(spawner, 'rdmfs_token', None)
+            # Pooled containers mount the storage with the token of the user
+            key = (image, job.owner.name, token_hash(rdmfs_token) if rdmfs_token else None)
+            owner_name = job.owner.name
+            async def start_container():
+                pooled_spawner = new_instance(self.spawner_class, self)
+                configure_spawner(PooledJob(f'pool-{uuid.uuid4().hex[:12]}', owner_name), pooled_spawner)
+                pooled_spawner.cmd = IDLE_CMD
+                pooled_spawner.image = image
+                pooled_spawner.user_options = {
+                    'image': image,
+                }
+                if rdmfs_token:
+                    pooled_spawner.rdmfs_token = rdmfs_token
+                return await PooledContainer.start(pooled_spawner)
+            return await container_pool.acquire(key, start_container)
+
+        # Run container
+        # The crate folder must exist before run-crate writes the result into it
+        async def run(repo_info, image, spawner, _crate_folder_url):
+            notebook_filename, _ = repo_info
+            if status_callback is not None:
+                status_callback(job.id, 'running', notebook_filename)
+            log_stream_callback_impl('running', f'Running {notebook_filename}...\n')
+            tracker = new_instance(self.tracker_class, self)
+            pooled = await acquire_pooled_container(image, spawner)
+            if pooled is not None:
+                self.log.info(f'Using pooled container: {pooled.container_id}')
+                try:
+                    process = await tracker.track_exec(pooled.container_id, spawner.cmd)
+                    log_stream_callback_impl('running', f'Waiting for {notebook_filename} to finish...\n')
+                    exit_code = await process.wait(log_stream_callback_impl)
+                finally:
+                    await container_pool.release(pooled)
+            else:
+                spawner.image = image
+                spawner.user_options = {
+                    'image': image,
+                }
+                host, port = await spawner.start()
+                # Stopping also releases the RDMFS sidecar shared with other jobs
+                try:
+                    self.log.info(f'Started container: {host}:{port}')
+                    process = await tracker.track_process(spawner, host, port)
+                    self.log.debug(f'Waiting for process to finish...')
+                    log_stream_callback_impl('running', f'Waiting for {notebook_filename} to finish...\n')
+                    exit_code = await process.wait(log_stream_callback_impl)
+                finally:
+                    await spawner.stop()
+            self.log.info(f'Process finished: exit_code={exit_code}')
+            log_stream_callback_impl('running', f'Collecting results...\n')
+            if exit_code != 0:
+                raise RuntimeError(f'Process failed: exit_code={exit_code}')
+        graph.add('run', run, requires=('repo_info', 'build', 'prepare_spawner', 'crate_folder'))
 
         # Get result
-        self.log.info(f'Getting result... {result_filename} from {crate_folder_url}')
-        result = await find_file_by_name(rdm, crate_folder_url, result_filename)
-        if result is None:
-            raise ValueError(f'Cannot find result file: {result_filename} in {CRATE_FOLDER_NAME} folder')
-        url = result['links']['download']
-        self.log.info(f'Modifying crates... {url}')
-        status = await modify_crate(rdm, job.id, url, crate_folder_url, log)
-        self.log.info(f'Inserting index... {crate_folder_url}')
-        await insert_index(rdm, crate_folder_url, RunCrateIndex(
-            notebook=notebook_filename,
-            id=job.id,
-            created_at=job.created_at.isoformat() if job.created_at is not None else '',
-            updated_at=job.updated_at.isoformat() if job.updated_at is not None else '',
-            name=result_filename,
-            status=status,
-            links=[
-                dict(rel='download', href=url[:url.index('?')] if '?' in url else url),
-                dict(rel='web', href=files_url_to_web_url(rdm, url)),
-            ],
+        async def collect(repo_info, crate_folder_url, _run):
+            notebook_filename, _ = repo_info
+            self.log.info(f'Getting result... {result_filename} from {crate_folder_url}')
+            # The result was written through RDMFS, not through the RDMService
+            rdm.invalidate(crate_folder_url)
+            result = await find_file_by_name(rdm, crate_folder_url, result_filename)
+            if result is None:
+                raise ValueError(f'Cannot find result file: {result_filename} in {CRATE_FOLDER_NAME} folder')
+            url = result['links']['download']
+            self.log.info(f'Modifying crates... {url}')
+            status = await modify_crate(rdm, job.id, url, crate_folder_url, log_tail.text())
+            self.log.info(f'Inserting index... {crate_folder_url}')
+            await index_writer.insert(rdm, crate_folder_url, RunCrateIndex(
+                notebook=notebook_filename,
+                id=job.id,
+                created_at=job.created_at.isoformat() if job.created_at is not None else '',
+                updated_at=job.updated_at.isoformat() if job.updated_at is not None else '',
+                name=result_filename,
+                status=status,
+                links=[
+                    dict(rel='download', href=url[:url.index('?')] if '?' in url else url),
+                    dict(rel='web', href=files_url_to_web_url(rdm, url)),
+                ],
+            ))
+            self.log.info(f'WaterButler result URL: {url}')
+            log_stream_callback_impl(status, f'Finished: {CRATE_FOLDER_NAME}/{result_filename}\n')
+            return RunnerResult(notebook=notebook_filename, result_url=url, status=status)
+        graph.add('collect', collect, requires=('repo_info', 'crate_folder', 'run'))
+
+        results = await graph.run()
+        self.log.info('Critical path: ' + ' -> '.join(
+            f'{name}({graph.duration(name):.1f}s)' for name in graph.critical_path()
         ))
-        self.log.info(f'WaterButler result URL: {url}')
-        log_stream_callback_impl(status, f'Finished: {CRATE_FOLDER_NAME}/{result_filename}\n')
-        return RunnerResult(notebook=notebook_filename, result_url=url, status=status)
+        return results['collect']
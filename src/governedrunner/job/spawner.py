@@ -1,3 +1,5 @@
+from types import SimpleNamespace
+
 from jupyterhub.spawner import Spawner
 from ..db.models import Job
 
@@ -37,6 +39,14 @@ class ORMSpawner(ContextBase):
     def name(self):
         return self.job.id
 
+class PooledJob:
+    """Stands in for the job while a pooled container waits for one."""
+    id: str = None
+
+    def __init__(self, id: str, owner_name: str):
+        self.id = id
+        self.owner = SimpleNamespace(name=owner_name)
+
 def configure_spawner(job: Job, spawner: Spawner):
     spawner.user = User(job)
     spawner.hub = Hub(job)
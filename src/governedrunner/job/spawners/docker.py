@@ -2,7 +2,7 @@ import json
 
 from urllib.parse import urlparse, quote_plus
 
-from aiodocker import Docker
+from ..dockerapi import docker_call
 
 
 def get_optional_value(object, key):
@@ -22,7 +22,7 @@ async def list_images():
     """
     Retrieve local images built by repo2docker
     """
-    async with Docker() as docker:
+    async with docker_call('images.list') as docker:
         r2d_images = await docker.images.list(
             filters=json.dumps({"dangling": ["false"], "label": ["repo2docker.ref"]})
         )
@@ -47,7 +47,7 @@ async def list_containers():
     Retrieve the list of local images being built by repo2docker.
     Images are built in a Docker container.
     """
-    async with Docker() as docker:
+    async with docker_call('containers.list') as docker:
         r2d_containers = await docker.containers.list(
             filters=json.dumps({"label": ["repo2docker.ref"]})
         )
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Optional
+import uuid
+
+from aiodocker.exceptions import DockerError
+
+from ..dockerapi import docker_call
+
+
+logger = logging.getLogger(__name__)
+RDMFS_IMAGE = 'gcr.io/nii-ap-ops/rdmfs:20211221'
+OWNER_LABEL = 'governedrunner.rdmfs.owner'
+
+
+class Sidecar:
+    key: tuple[str, str, str]
+    name: str
+    mount_path: str
+    container_id: Optional[str]
+    refcount: int
+
+    def __init__(self, key: tuple[str, str, str], name: str, mount_path: str):
+        self.key = key
+        self.name = name
+        self.mount_path = mount_path
+        self.container_id = None
+        self.refcount = 0
+        self.lock = asyncio.Lock()
+        self.idle_timer: Optional[asyncio.Task] = None
+
+
+async def _get_container(name_or_id: str):
+    try:
+        async with docker_call('containers.get') as docker:
+            container = await docker.containers.get(name_or_id)
+            return await container.show()
+    except DockerError as e:
+        if e.status == 404:
+            return None
+        raise
+
+async def _remove_container(container_id: str):
+    try:
+        async with docker_call('containers.remove') as docker:
+            container = await docker.containers.get(container_id)
+            desc = await container.show()
+            if 'State' in desc and desc['State']['Running']:
+                logger.info(f'Terminating RDMFS... {container_id}')
+                exec = await container.exec(["/bin/sh", "-c", "xattr -w command terminate /mnt/rdm"])
+                result = await exec.start(detach=True)
+                logger.info(f'Terminated: {result}')
+            await container.delete()
+    except DockerError as e:
+        if e.status not in (404, 409):
+            raise
+        logger.debug(f'Already removed: {container_id}')
+
+
+class SidecarRegistry:
+    """
+    RDMFS sidecars shared by the jobs of the same user, node and token.
+
+    A sidecar is removed when no job has used it for the idle timeout.
+    Reference counts are kept in this process, so sidecars are never shared
+    with other processes: their names and mount paths include `owner`,
+    which is unique to the registry.
+    """
+
+    def __init__(self, owner: Optional[str] = None):
+        self.owner = owner or uuid.uuid4().hex[:12]
+        self.sidecars: dict[tuple[str, str, str], Sidecar] = {}
+        self._prepull: Optional[asyncio.Task] = None
+
+    def _get_sidecar(self, key: tuple[str, str, str], base_path: str) -> Sidecar:
+        sidecar = self.sidecars.get(key, None)
+        if sidecar is None:
+            digest = hashlib.sha256('\0'.join(key).encode('utf-8')).hexdigest()[:16]
+            name = f'rdmfs-{self.owner}-{digest}'
+            sidecar = Sidecar(key, name, os.path.join(base_path, name))
+            self.sidecars[key] = sidecar
+        return sidecar
+
+    async def _is_healthy(self, sidecar: Sidecar) -> bool:
+        desc = await _get_container(sidecar.container_id or sidecar.name)
+        if desc is None:
+            return False
+        state = desc.get('State', {})
+        if not state.get('Running', False):
+            return False
+        health = state.get('Health', None)
+        if health is not None and health.get('Status', None) == 'unhealthy':
+            return False
+        sidecar.container_id = desc['Id']
+        return True
+
+    async def _create(self, sidecar: Sidecar, image: str, env: dict[str, str]):
+        if not os.path.exists(sidecar.mount_path):
+            os.makedirs(sidecar.mount_path)
+        # Remove a stopped or unhealthy container with the same name
+        desc = await _get_container(sidecar.name)
+        if desc is not None:
+            await _remove_container(desc['Id'])
+        host_config = dict(
+            Mounts=[
+                {
+                    "Type": "bind",
+                    "Source": sidecar.mount_path,
+                    "Target": "/mnt",
+                    "ReadOnly": False,
+                    "BindOptions": {
+                        "Propagation": "rshared",
+                    },
+                }
+            ],
+            Privileged=True,
+        )
+        create_kwargs = dict(
+            Image=image,
+            Env=[f'{k}={v}' for k, v in env.items()],
+            AutoRemove=True,
+            HostConfig=host_config,
+            Labels={OWNER_LABEL: self.owner},
+        )
+        async with docker_call('containers.create') as docker:
+            container = await docker.containers.create(create_kwargs, name=sidecar.name)
+            await container.start()
+        sidecar.container_id = container.id
+        logger.info(f'Started RDMFS: {sidecar.name}')
+
+    async def acquire(self, key: tuple[str, str, str], base_path: str, image: str, env: dict[str, str]) -> str:
+        """
+        Get a running sidecar for the key, starting it if needed.
+
+        Returns:
+            The host path where the storage is mounted (at `rdm` in it)
+        """
+        sidecar = self._get_sidecar(key, base_path)
+        async with sidecar.lock:
+            if sidecar.idle_timer is not None:
+                sidecar.idle_timer.cancel()
+                sidecar.idle_timer = None
+            if await self._is_healthy(sidecar):
+                logger.info(f'Reusing RDMFS: {sidecar.name} (refcount={sidecar.refcount})')
+            else:
+                await self._create(sidecar, image, env)
+            sidecar.refcount += 1
+        return sidecar.mount_path
+
+    async def release(self, key: tuple[str, str, str], idle_timeout: float):
+        sidecar = self.sidecars.get(key, None)
+        if sidecar is None:
+            return
+        async with sidecar.lock:
+            sidecar.refcount = max(sidecar.refcount - 1, 0)
+            if sidecar.refcount > 0:
+                return
+            if idle_timeout <= 0:
+                await self._remove(sidecar)
+                return
+            sidecar.idle_timer = asyncio.ensure_future(self._remove_after(sidecar, idle_timeout))
+
+    async def _remove_after(self, sidecar: Sidecar, idle_timeout: float):
+        await asyncio.sleep(idle_timeout)
+        async with sidecar.lock:
+            if sidecar.refcount > 0:
+                return
+            sidecar.idle_timer = None
+            await self._remove(sidecar)
+
+    async def _remove(self, sidecar: Sidecar):
+        logger.info(f'Removing RDMFS: {sidecar.name}')
+        container_id = sidecar.container_id or sidecar.name
+        sidecar.container_id = None
+        await _remove_container(container_id)
+
+    def prepull(self, image: str = RDMFS_IMAGE):
+        """
+        Pull the RDMFS image in the background so that the first job does not wait for it.
+        """
+        async def pull():
+            try:
+                async with docker_call('images.pull', limited=False) as docker:
+                    await docker.images.pull(image)
+                logger.info(f'Pulled: {image}')
+            except Exception:
+                logger.exception(f'Failed to pull: {image}')
+        if self._prepull is None or self._prepull.done():
+            self._prepull = asyncio.ensure_future(pull())
+
+    async def close(self):
+        """
+        Remove the sidecars no job is using.
+        """
+        if self._prepull is not None:
+            self._prepull.cancel()
+        for sidecar in list(self.sidecars.values()):
+            if sidecar.idle_timer is not None:
+                sidecar.idle_timer.cancel()
+            if sidecar.refcount == 0 and sidecar.container_id is not None:
+                await self._remove(sidecar)
+
+
+rdmfs_sidecars = SidecarRegistry()
@@ -1,18 +1,16 @@
-import json
-import os
-
-from aiodocker import Docker
-from aiodocker.exceptions import DockerError
 from dockerspawner import DockerSpawner
 from docker.errors import APIError
 from docker.types import Mount
 from jinja2 import Environment, BaseLoader
 from jupyterhub.traitlets import ByteSpecification
-from traitlets import Unicode
+from traitlets import Float, Unicode
 from traitlets.config import Configurable
 from tornado import web
 
+from governedrunner.api.cache import token_hash
+from ..dockerapi import inspect_image
 from .docker import list_images
+from .rdmfs import RDMFS_IMAGE, rdmfs_sidecars
 
 
 # Default CPU period
@@ -111,7 +109,25 @@ class SpawnerMixin(Configurable):
         """,
     )
 
+    rdmfs_image = Unicode(
+        RDMFS_IMAGE,
+        config=True,
+        help="""
+        The image of the RDMFS sidecar.
+        """,
+    )
+
+    rdmfs_idle_timeout = Float(
+        300.0,
+        config=True,
+        help="""
+        Seconds to keep an RDMFS sidecar after the last job using it has stopped.
+        The sidecar is shared by the jobs of the same user, node and token.
+        """,
+    )
+
     extra_mounts = None
+    _rdmfs_key = None
 
     async def list_images(self):
         """
@@ -152,8 +168,7 @@ class SpawnerMixin(Configurable):
         Set the user environment limits if they are defined in the image
         """
         imagename = self.user_options.get("image")
-        async with Docker() as docker:
-            image = await docker.images.inspect(imagename)
+        image = await inspect_image(imagename)
 
         mem_limit = image["ContainerConfig"]["Labels"].get(
             "governedrunner.mem_limit", None
@@ -181,9 +196,8 @@ class SpawnerMixin(Configurable):
         Prepare volume binds for GRDM
         """
         imagename = self.user_options.get("image")
-        async with Docker() as docker:
-            image = await docker.images.inspect(imagename)
-        
+        image = await inspect_image(imagename)
+
         provider_prefix = image["ContainerConfig"]["Labels"].get(
             "governedrunner.opt.provider", None
         )
@@ -192,120 +206,33 @@ class SpawnerMixin(Configurable):
         await self._set_rdm_mounts(image)
 
     async def _set_rdm_mounts(self, image):
-        repo = image["ContainerConfig"]["Labels"].get(
-            "governedrunner.opt.repo", None
-        )
+        labels = image["ContainerConfig"]["Labels"]
+        repo = labels.get("governedrunner.opt.repo", None)
         repo_token = self.rdmfs_token
         if not repo_token:
             raise web.HTTPError(
                 400,
                 "No repo_token for: %s" % (repo),
             )
+        node_id = labels.get("governedrunner.opt.user.rdm_node_id", None)
         self.log.info("Preparing RDMFS... " + 'name=' + repr(self.user.name) + ', repo=' + repr(repo))
-        mount_path = os.path.join(self.rdmfs_base_path, self.container_name)
-        if not os.path.exists(mount_path):
-            os.makedirs(mount_path)
-        self.extra_mounts = [
-            dict(type='bind', source=mount_path, target='/mnt', propagation='rshared'),
-        ]
-        rdmfs_id = await self.get_rdmfs_object()
-        if rdmfs_id is not None:
-            await self.remove_object_by_id(rdmfs_id)
-        rdmfs_id = await self.create_rdmfs_object({
-            'RDM_NODE_ID': image["ContainerConfig"]["Labels"].get(
-                "governedrunner.opt.user.rdm_node_id", None
-            ),
-            'RDM_API_URL': image["ContainerConfig"]["Labels"].get(
-                "governedrunner.opt.user.rdm_api_url", None
-            ),
+        self._rdmfs_key = (self.user.name, node_id or '', token_hash(repo_token))
+        mount_path = await rdmfs_sidecars.acquire(self._rdmfs_key, self.rdmfs_base_path, self.rdmfs_image, {
+            'RDM_NODE_ID': node_id,
+            'RDM_API_URL': labels.get("governedrunner.opt.user.rdm_api_url", None),
             'RDM_TOKEN': repo_token,
             'MOUNT_PATH': '/mnt/rdm',
         })
-        await self.start_object_by_id(rdmfs_id)
-
-    async def get_rdmfs_object(self):
-        object_name = self.object_name + '_rdmfs'
-        self.log.debug("Getting %s '%s'", self.object_type, object_name)
-        try:
-            async with Docker() as docker:
-                obj = await docker.containers.get(object_name)
-            return obj.id
-        except DockerError as e:
-            if e.status == 404:
-                self.log.info(
-                    "%s '%s' is gone", self.object_type.title(), object_name
-                )
-            elif e.status == 500:
-                self.log.info(
-                    "%s '%s' is on unhealthy node",
-                    self.object_type.title(),
-                    object_name,
-                )
-            else:
-                raise
-        return None
-
-    async def create_rdmfs_object(self, env):
-        host_config = dict(
-            Mounts=[
-                {
-                    "Type": "bind",
-                    "Source": m['source'],
-                    "Target": "/mnt",
-                    "ReadOnly": False,
-                    "BindOptions": {
-                        "Propagation": "rshared",
-                    },
-                }
-                for m in (self.extra_mounts or [])
-            ],
-            Privileged=True,
-        )
-        create_kwargs = dict(
-            Image='gcr.io/nii-ap-ops/rdmfs:20211221',
-            Env=[f'{k}={v}' for k, v in env.items()],
-            AutoRemove=True,
-            HostConfig=host_config,
-        )
-        async with Docker() as docker:
-            obj = await docker.containers.create(
-                create_kwargs,
-                name=self.container_name + '_rdmfs',
-            )
-        return obj.id
-
-    async def start_object_by_id(self, object_id):
-        async with Docker() as docker:
-            obj = await docker.containers.get(object_id)
-            await obj.start()
+        self.extra_mounts = [
+            dict(type='bind', source=mount_path, target='/mnt', propagation='rshared'),
+        ]
 
-    async def remove_object_by_id(self, object_id):
-        self.log.info("Removing %s %s", self.object_type, object_id)
-        try:
-            async with Docker() as docker:
-                obj = await docker.containers.get(object_id)
-                desc = await obj.show()
-                if 'State' in desc and desc['State']['Running']:
-                    self.log.info('terminating...')
-                    exec = await obj.exec(["/bin/sh","-c","xattr -w command terminate /mnt/rdm"])
-                    result = await exec.start(detach=True)
-                    self.log.info('terminated: {}'.format(result))
-                    self.log.info('deleting...')
-                    await obj.delete()
-                else:
-                    self.log.info('deleting...')
-                    await obj.delete()
-        except DockerError as e:
-            if e.status == 409:
-                self.log.debug(
-                    "Already removed %s: %s", self.object_type, object_id
-                )
-            elif e.status == 404:
-                self.log.debug(
-                    "Already removed %s: %s", self.object_type, object_id
-                )
-            else:
-                raise
+    async def release_rdmfs(self):
+        if self._rdmfs_key is None:
+            return
+        key = self._rdmfs_key
+        self._rdmfs_key = None
+        await rdmfs_sidecars.release(key, self.rdmfs_idle_timeout)
 
 
 class Repo2DockerSpawner(SpawnerMixin, DockerSpawner):
@@ -323,12 +250,14 @@ class Repo2DockerSpawner(SpawnerMixin, DockerSpawner):
 
     async def start(self, *args, **kwargs):
         await self.set_limits()
-        await self.set_extra_mounts()
-        return await super().start(*args, **kwargs)
+        try:
+            await self.set_extra_mounts()
+            return await super().start(*args, **kwargs)
+        except BaseException:
+            # stop() is not called for a spawner which has failed to start
+            await self.release_rdmfs()
+            raise
 
     async def stop(self, *args, **kwargs):
         await super().stop(*args, **kwargs)
-        rdmfs_id = await self.get_rdmfs_object()
-        if rdmfs_id is None:
-            return
-        await self.remove_object_by_id(rdmfs_id)
+        await self.release_rdmfs()
@@ -0,0 +1,100 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+import time
+from typing import Any
+
+
+class Stage:
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    requires: tuple[str, ...]
+
+    def __init__(self, name: str, func: Callable[..., Awaitable[Any]], requires: tuple[str, ...] = ()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+
+
+class StageGraph:
+    """
+    A DAG of coroutine stages.
+
+    Each stage is called with the results of its required stages, in the order
+    they are listed, and starts as soon as all of them have finished.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, Stage] = {}
+        self.results: dict[str, Any] = {}
+        self.started_at: dict[str, float] = {}
+        self.finished_at: dict[str, float] = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], requires: tuple[str, ...] = ()):
+        if name in self.stages:
+            raise ValueError(f'Duplicate stage: {name}')
+        self.stages[name] = Stage(name, func, requires)
+
+    def _validate(self):
+        visiting = set()
+        visited = set()
+        def visit(name, path):
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage: {name} (required by {path[-1]})')
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Cyclic stages: {" -> ".join(path + [name])}')
+            visiting.add(name)
+            for required in self.stages[name].requires:
+                visit(required, path + [name])
+            visiting.remove(name)
+            visited.add(name)
+        for name in self.stages:
+            visit(name, [])
+
+    async def _run_stage(self, stage: Stage, tasks: dict[str, asyncio.Task]):
+        if stage.requires:
+            await asyncio.gather(*[tasks[name] for name in stage.requires])
+        self.started_at[stage.name] = time.monotonic()
+        result = await stage.func(*[self.results[name] for name in stage.requires])
+        self.finished_at[stage.name] = time.monotonic()
+        self.results[stage.name] = result
+        return result
+
+    async def run(self) -> dict[str, Any]:
+        """
+        Run all stages, overlapping the ones that do not depend on each other.
+
+        If a stage fails, the other stages are cancelled and the error is raised.
+
+        Returns:
+            The results of the stages by name
+        """
+        self._validate()
+        tasks = {}
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.ensure_future(self._run_stage(stage, tasks))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return self.results
+
+    def duration(self, name: str) -> float:
+        return self.finished_at[name] - self.started_at[name]
+
+    def critical_path(self) -> list[str]:
+        """
+        Return the chain of stages that determined the total duration.
+        """
+        if len(self.finished_at) == 0:
+            return []
+        name = max(self.finished_at, key=self.finished_at.get)
+        path = [name]
+        while self.stages[name].requires:
+            name = max(self.stages[name].requires, key=self.finished_at.get)
+            path.append(name)
+        return list(reversed(path))
@@ -30,4 +30,17 @@ class JobTracker(LoggingConfigurable):
         Returns:
             The tracker
         """
-        raise NotImplementedError()
\ No newline at end of file
+        raise NotImplementedError()
+
+    async def track_exec(self, container_id: str, cmd: list[str]) -> ProcessTracker:
+        """
+        Get a tracker for a command executed in a running container.
+
+        Args:
+            container_id: The container ID
+            cmd: The command to execute
+
+        Returns:
+            The tracker
+        """
+        raise NotImplementedError()
@@ -1,14 +1,126 @@
+import asyncio
 from collections.abc import Callable
-from aiodocker import Docker
+import json
+import logging
+from typing import Optional
+
 from jupyterhub.spawner import Spawner
 
+from ..dockerapi import docker_call, get_docker
 from .base import JobTracker, ProcessTracker
 
 
+logger = logging.getLogger(__name__)
+# Seconds to wait for the die event after the log stream has ended
+EXIT_EVENT_TIMEOUT = 10.0
+
+
 def has_name(container, name):
     return name in [name.lstrip('/') for name in container._container['Names']]
 
 
+class ContainerExit:
+    exit_code: int
+    oom_killed: bool
+
+    def __init__(self, exit_code: int, oom_killed: bool):
+        self.exit_code = exit_code
+        self.oom_killed = oom_killed
+
+
+class ContainerEvents:
+    """
+    Routes `die` and `oom` events of the Docker events stream to the waiting trackers.
+
+    One subscription is shared by all trackers of the process.
+    """
+
+    def __init__(self):
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+        self._oom_killed: set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed: Optional[asyncio.Event] = None
+
+    def _dispatch(self, event):
+        actor = event.get('Actor', {})
+        container_id = actor.get('ID', None) or event.get('id', None)
+        if container_id not in self._waiters:
+            return
+        action = event.get('Action', None) or event.get('status', None)
+        if action == 'oom':
+            self._oom_killed.add(container_id)
+            return
+        if action != 'die':
+            return
+        exit_code = int(actor.get('Attributes', {}).get('exitCode', -1))
+        oom_killed = container_id in self._oom_killed
+        for future in self._waiters.get(container_id, []):
+            if not future.done():
+                future.set_result(ContainerExit(exit_code, oom_killed))
+
+    async def _watch(self):
+        filters = json.dumps({'type': ['container'], 'event': ['die', 'oom']})
+        while True:
+            docker = get_docker()
+            subscriber = docker.events.subscribe(create_task=False)
+            stream = asyncio.ensure_future(docker.events.run(filters=filters))
+            # The subscriber is registered, but the stream may not be connected yet;
+            # an exit in between is recovered by the inspect fallback of ContainerTracker.wait
+            self._subscribed.set()
+            try:
+                while True:
+                    event = await subscriber.get()
+                    if event is None:
+                        break
+                    self._dispatch(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to read Docker events')
+            finally:
+                self._subscribed.clear()
+                stream.cancel()
+                await asyncio.gather(stream, return_exceptions=True)
+                docker.events.channel.unsubscribe(subscriber)
+            await asyncio.sleep(1.0)
+
+    async def watch(self, container_id: str) -> asyncio.Future:
+        """
+        Start waiting for the container to exit.
+
+        Returns:
+            A future resolved with the ContainerExit
+        """
+        if self._task is None or self._task.done():
+            self._subscribed = asyncio.Event()
+            self._task = asyncio.ensure_future(self._watch())
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(container_id, []).append(future)
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=EXIT_EVENT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning('Docker events are not subscribed yet')
+        return future
+
+    def unwatch(self, container_id: str, future: asyncio.Future):
+        waiters = self._waiters.get(container_id, [])
+        if future in waiters:
+            waiters.remove(future)
+        if len(waiters) == 0:
+            self._waiters.pop(container_id, None)
+            self._oom_killed.discard(container_id)
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+container_events = ContainerEvents()
+
+
 class ContainerTracker(ProcessTracker):
     container: str
 
@@ -16,21 +128,72 @@ class ContainerTracker(ProcessTracker):
         self.container = container
 
     async def wait(self, log_stream_callback: Callable[[str, str], None]):
-        async with Docker() as docker:
-            container = await docker.containers.get(self.container)
-            async for log in container.log(stdout=True, stderr=True, follow=True):
-                if log_stream_callback is None:
-                    continue
-                log_stream_callback('running', log)
+        # Subscribe before reading the state to catch most exits by the event.
+        # An exit before the events stream has connected may still be missed,
+        # in which case the state is inspected once the log stream has ended.
+        exited = await container_events.watch(self.container)
+        try:
+            async with docker_call('containers.get') as docker:
+                container = await docker.containers.get(self.container)
+            state = container._container['State']
+            if not state['Running'] and not exited.done():
+                exited.set_result(ContainerExit(state['ExitCode'], state.get('OOMKilled', False)))
+            async with docker_call('containers.log', limited=False):
+                async for log in container.log(stdout=True, stderr=True, follow=True):
+                    if log_stream_callback is None:
+                        continue
+                    log_stream_callback('running', log)
+            try:
+                result = await asyncio.wait_for(asyncio.shield(exited), timeout=EXIT_EVENT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f'No die event received, inspecting the state: {self.container}')
+                async with docker_call('containers.get') as docker:
+                    container = await docker.containers.get(self.container)
+                state = container._container['State']
+                result = ContainerExit(state['ExitCode'], state.get('OOMKilled', False))
+        finally:
+            container_events.unwatch(self.container, exited)
+        if result.oom_killed and log_stream_callback is not None:
+            log_stream_callback('running', 'The container was killed because it ran out of memory\n')
+        return result.exit_code
+
+class ExecTracker(ProcessTracker):
+    container: str
+    cmd: list[str]
+
+    def __init__(self, container, cmd):
+        self.container = container
+        self.cmd = cmd
+
+    async def wait(self, log_stream_callback: Callable[[str, str], None]):
+        async with docker_call('containers.exec') as docker:
             container = await docker.containers.get(self.container)
-            return container._container['State']['ExitCode']
+            exec = await container.exec(self.cmd, stdout=True, stderr=True, tty=False)
+        async with docker_call('exec.stream', limited=False):
+            async with exec.start(detach=False) as stream:
+                while True:
+                    message = await stream.read_out()
+                    if message is None:
+                        break
+                    if log_stream_callback is None:
+                        continue
+                    log_stream_callback('running', message.data.decode('utf-8', errors='replace'))
+        async with docker_call('exec.inspect'):
+            result = await exec.inspect()
+        return result['ExitCode']
 
 class DockerTracker(JobTracker):
     async def track_process(self, spawner: Spawner, hostname: str, port: int) -> ProcessTracker:
-        async with Docker() as docker:
-            containers = await docker.containers.list()
-            containers = [c for c in containers if has_name(c, spawner.container_name)]
-            self.log.debug(f'Target: {containers}, {spawner.container_name}')
-            if len(containers) == 0:
-                raise RuntimeError(f'Container not found: {spawner.container_name}')
-            return ContainerTracker(containers[0].id)
+        async with docker_call('containers.list') as docker:
+            containers = await docker.containers.list(
+                filters=json.dumps({'name': [f'^/{spawner.container_name}$']}),
+            )
+        # The name filter matches substrings in some Docker versions
+        containers = [c for c in containers if has_name(c, spawner.container_name)]
+        self.log.debug(f'Target: {containers}, {spawner.container_name}')
+        if len(containers) == 0:
+            raise RuntimeError(f'Container not found: {spawner.container_name}')
+        return ContainerTracker(containers[0].id)
+
+    async def track_exec(self, container_id: str, cmd: list[str]) -> ProcessTracker:
+        return ExecTracker(container_id, cmd)
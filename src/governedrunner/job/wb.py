@@ -1,9 +1,11 @@
-
+import asyncio
+import hashlib
 import logging
 from typing import Any
 from urllib.parse import urlparse
 
-from ..api.rdm import RDMService
+from ..api.rdm import RDMService, strip_query
+from .rocrate import find_entity, has_type
 
 
 logger = logging.getLogger(__name__)
@@ -78,22 +80,73 @@ async def get_parent_folder(rdm: RDMService, source_url: str):
     provider_name = path_parts[0]
     return f'{rdm.files_url}/resources/{node_id}/providers/{provider_name}/'
 
-async def find_file_by_name(rdm: RDMService, folder_url: str, filename: str):
-    resp = await rdm.get(folder_url)
-    files = resp['data']
-    files = [file for file in files if file['attributes']['name'] == filename]
-    if len(files) == 0:
+def _next_page_url(resp: Any):
+    links = resp.get('links', None)
+    if not isinstance(links, dict):
+        return None
+    return links.get('next', None)
+
+class FolderIndex:
+    '''
+    Name to entry index of a folder, filled page by page as lookups need it.
+    '''
+    folder_url: str
+    entries: dict[str, Any]
+
+    def __init__(self, folder_url: str):
+        self.folder_url = folder_url
+        self.entries = {}
+        self._next_url = folder_url
+
+    @property
+    def complete(self) -> bool:
+        return self._next_url is None
+
+    async def find(self, rdm: RDMService, filename: str):
+        if filename in self.entries:
+            return self.entries[filename]
+        while self._next_url is not None:
+            resp = await rdm.get(self._next_url)
+            for file in resp['data']:
+                self.entries.setdefault(file['attributes']['name'], file)
+            self._next_url = _next_page_url(resp)
+            if filename in self.entries:
+                return self.entries[filename]
         return None
-    return files[0]
+
+    async def list(self, rdm: RDMService) -> list[Any]:
+        while self._next_url is not None:
+            resp = await rdm.get(self._next_url)
+            for file in resp['data']:
+                self.entries.setdefault(file['attributes']['name'], file)
+            self._next_url = _next_page_url(resp)
+        return list(self.entries.values())
+
+    def add(self, file: Any):
+        self.entries[file['attributes']['name']] = file
+
+def get_folder_index(rdm: RDMService, folder_url: str) -> FolderIndex:
+    key = strip_query(folder_url)
+    index = rdm.folder_indices.get(key, None)
+    if index is None:
+        index = FolderIndex(folder_url)
+        rdm.folder_indices[key] = index
+    return index
+
+async def find_file_by_name(rdm: RDMService, folder_url: str, filename: str):
+    return await get_folder_index(rdm, folder_url).find(rdm, filename)
+
+async def create_file(rdm: RDMService, folder_url: str, filename: str, json=None, content=None, kind='file'):
+    folder_url = strip_query(folder_url)
+    resp = await rdm.put(f'{folder_url}?kind={kind}&name={filename}', json=json, content=content)
+    get_folder_index(rdm, folder_url).add(resp['data'])
+    return resp['data']
 
 async def get_crate_folder(rdm: RDMService, folder_url: str):
     from ..api.settings import CRATE_FOLDER_NAME
     file = await find_file_by_name(rdm, folder_url, CRATE_FOLDER_NAME)
     if file is None:
-        await rdm.put(f'{folder_url}?kind=folder&name={CRATE_FOLDER_NAME}')
-        file = await find_file_by_name(rdm, folder_url, CRATE_FOLDER_NAME)
-        if file is None:
-            raise ValueError(f'Cannot create folder: {CRATE_FOLDER_NAME}')
+        file = await create_file(rdm, folder_url, CRATE_FOLDER_NAME, kind='folder')
     return file['links']['upload']
 
 def _get_files_url(rdm: RDMService, url: str):
@@ -109,16 +162,67 @@ def _get_files_url(rdm: RDMService, url: str):
     path = '/'.join(url)
     return f'{rdm.files_url}/resources/{node_id}/providers/{provider_name}/{path}'
 
+def _file_version(attributes: Any):
+    hashes = (attributes.get('extra', None) or {}).get('hashes', None) or {}
+    for key in ['sha256', 'md5']:
+        if hashes.get(key, None):
+            return f'{key}:{hashes[key]}'
+    if attributes.get('etag', None):
+        return f'etag:{attributes["etag"]}'
+    return f'modified:{attributes.get("modified_utc", None)}'
+
+async def get_repo_fingerprint(rdm: RDMService, repo_url: str, max_files: int):
+    '''
+    Compute a digest of the paths, sizes and hashes of the files in the repository.
+
+    The crate folder is excluded. Returns None if the repository cannot be
+    fingerprinted, e.g. it has more than `max_files` files.
+    '''
+    from ..api.settings import CRATE_FOLDER_NAME
+    if repo_url.startswith(PREFIX_CRATE) or not repo_url.startswith(rdm.web_url):
+        return None
+    files = []
+    async def walk(folder_url: str, root: bool):
+        # The repository may have been modified outside of this service
+        rdm.invalidate(folder_url)
+        entries = await get_folder_index(rdm, folder_url).list(rdm)
+        subfolders = []
+        for entry in entries:
+            attributes = entry['attributes']
+            if attributes['kind'] == 'folder':
+                if root and attributes['name'] == CRATE_FOLDER_NAME:
+                    continue
+                subfolders.append(entry['links']['upload'])
+                continue
+            files.append(f'{attributes["materialized"]}\t{attributes.get("size", None)}\t{_file_version(attributes)}')
+        if len(files) > max_files:
+            raise OverflowError(f'Too many files: > {max_files}')
+        await asyncio.gather(*[walk(subfolder, False) for subfolder in subfolders])
+    try:
+        await walk(_get_files_url(rdm, repo_url), True)
+    except OverflowError as e:
+        logger.info(f'Skipping fingerprint of {repo_url}: {e}')
+        return None
+    digest = hashlib.sha256()
+    for line in sorted(files):
+        digest.update(line.encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
 async def _extract_notebook_filename_from_crate(rdm: RDMService, url: str):
     files_url = _get_files_url(rdm, url)
-    content = await rdm.get(files_url)
-    entities = content['@graph']
-    create_action_entities = [entity for entity in entities if entity['@type'] == 'CreateAction']
-    if len(create_action_entities) == 0:
-        raise ValueError(f'No CreateAction entities: {content}')
-    object_entities = create_action_entities[0]['object']
+    resp = await rdm.open_stream(files_url)
+    try:
+        create_action_entity = await find_entity(
+            resp.aiter_bytes(),
+            lambda entity: has_type(entity, 'CreateAction'),
+        )
+    finally:
+        await resp.aclose()
+    if create_action_entity is None:
+        raise ValueError(f'No CreateAction entities: {files_url}')
+    object_entities = create_action_entity['object']
     if len(object_entities) == 0:
-        raise ValueError(f'No object entities: {content}')
+        raise ValueError(f'No object entities: {files_url}')
     object_entity = object_entities[0]
     return object_entity['@id']
 
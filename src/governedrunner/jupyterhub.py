@@ -46,7 +46,7 @@ def tljh_extra_hub_pip_packages():
         'fastapi-pagination',
         'starlette',
         'authlib',
-        'httpx',
+        'httpx[http2]',
         'aiohttp-session',
         'itsdangerous',
         'uvicorn[standard]',
@@ -4,6 +4,7 @@ from starlette.applications import Starlette
 from starlette.middleware.sessions import SessionMiddleware
 
 from .config import config
+from .api.lifecycle import startup, shutdown
 from .api.main import app as api_v1_app
 from .ui.main import app as ui_app
 
@@ -15,6 +16,9 @@ if os.environ.get('DEBUG', '') == '1':
 
 app = Starlette()
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
+# Lifespan events are not propagated to mounted apps
+app.add_event_handler('startup', startup)
+app.add_event_handler('shutdown', shutdown)
 
 app.mount(f'{PREFIX}/api/v1', api_v1_app)
 app.mount(PREFIX, ui_app)
@@ -2,12 +2,12 @@ from datetime import datetime, timezone
 import logging
 import time
 
-import httpx
 from starlette.responses import RedirectResponse
 
 from authlib.integrations.starlette_client import OAuth
 from governedrunner.config import config
 from governedrunner.api.demo import USERNAME as DEMO_USERNAME
+from governedrunner.api.identity import resolve_username
 from governedrunner.db.models import User
 
 logger = logging.getLogger(__name__)
@@ -47,18 +47,12 @@ async def is_logged_in(request):
         # expired
         return False
     access_token = token['access_token']
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-    }
-    async with httpx.AsyncClient() as client:
-        user_info = await client.get(USER_PROFILE_URL, headers=headers)
-        logger.debug(f'Userinfo Response: {user_info}')
-        if not user_info.is_success:
-            logger.error('Failed to retrieve user information, token revoked')
-            del request.session['token']
-            return False
-        logger.debug(f'Userinfo Content: {user_info.json()}')
-        request.session['username'] = user_info.json()[USER_PROFILE_PROPNAME]
+    username = await resolve_username(access_token, USER_PROFILE_URL, USER_PROFILE_PROPNAME)
+    if username is None:
+        logger.error('Failed to retrieve user information, token revoked')
+        del request.session['token']
+        return False
+    request.session['username'] = username
     return True
 
 async def get_username(request):
@@ -1,7 +1,9 @@
+import asyncio
 from datetime import datetime, timezone
 import os
 import subprocess
 
+from sqlalchemy import select
 from starlette.applications import Starlette
 from starlette.exceptions import HTTPException
 from starlette.responses import FileResponse, RedirectResponse
@@ -10,13 +12,16 @@ from starlette.staticfiles import StaticFiles
 from starlette.routing import WebSocketRoute
 
 from governedrunner.config import config
-from governedrunner.api.tasks.job import get_job_queue
-from governedrunner.db.database import SessionLocal
-from governedrunner.db.models import RDMToken
+from governedrunner.api.logstore import log_store
+from governedrunner.api.settings import Settings
+from governedrunner.api.tasks.progress import FINISHED_STATES, progress_hub
+from governedrunner.db.database import AsyncSessionLocal, SessionLocal
+from governedrunner.db.models import Job, RDMToken
 from . import auth
 from .routes import routes
 
 FORCE_BUILD_FRONTEND = config('FORCE_BUILD_FRONTEND', cast=bool, default=False)
+settings = Settings()
 
 def _ensure_frontend():
     ui_path, _ = os.path.split(__file__)
@@ -76,16 +81,66 @@ async def homepage(request):
     finally:
         db.close()
 
+async def _get_job_status(job_id: str):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(Job.status).where(Job.id == job_id))
+
 async def websocket_log(websocket):
     job_id = websocket.path_params["job_id"]
-    await websocket.accept()
-    q = get_job_queue(job_id)
-    if q is None:
+    try:
+        offset = max(int(websocket.query_params.get('offset', '0')), 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid offset")
+    if await _get_job_status(job_id) is None:
         raise HTTPException(status_code=404, detail="Job not found")
+    # The job may run in another process; its events come through the job event bus
+    progress = await progress_hub.open(job_id)
+    # Check again after subscribing so that the end of the job is not missed
+    job_status = await _get_job_status(job_id)
+    if job_status in FINISHED_STATES:
+        progress_hub.finish(job_id, job_status, await asyncio.to_thread(log_store.size, job_id))
+    await websocket.accept()
+    status = None
     while True:
-        status, log = await q.get()
-        await websocket.send_json({'status': status, 'log': log})
-        if status == 'completed' or status == 'failed':
+        if offset < progress.start_offset:
+            # The part not in the buffer is read from the log store
+            chunk = await asyncio.to_thread(log_store.read, job_id, offset, min(
+                progress.start_offset - offset, settings.job_progress_frame_bytes,
+            ))
+            if chunk.next_offset <= offset:
+                # The rest is still buffered by the log writer of the job
+                if await _get_job_status(job_id) not in FINISHED_STATES:
+                    await asyncio.sleep(settings.job_log_flush_interval)
+                    continue
+                # The writer flushes before the job finishes; the rest was lost with its worker
+                offset = progress.start_offset
+                continue
+            await websocket.send_json({
+                'status': progress.status,
+                'log': chunk.text,
+                'offset': chunk.offset,
+                'next_offset': chunk.next_offset,
+            })
+            offset = chunk.next_offset
+            continue
+        try:
+            await asyncio.wait_for(progress.wait(offset, status), timeout=settings.job_progress_check_interval)
+        except asyncio.TimeoutError:
+            # Events may have been lost, e.g. while the event bus was reconnecting
+            job_status = await _get_job_status(job_id)
+            if job_status in FINISHED_STATES:
+                progress_hub.finish(job_id, job_status, await asyncio.to_thread(log_store.size, job_id))
+            continue
+        # Let more lines arrive so that they are sent in one frame
+        await asyncio.sleep(settings.job_progress_coalesce_interval)
+        if offset < progress.start_offset:
+            continue
+        frame = progress.read(offset, settings.job_progress_frame_bytes)
+        if len(frame.log) > 0 or frame.status != status:
+            await websocket.send_json(frame.to_json())
+        offset = frame.next_offset
+        status = frame.status
+        if frame.finished:
             break
     await websocket.close()
 
@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+from .api.lifecycle import startup, shutdown
+from .api.logstore import log_store
+from .api.settings import Settings
+from .api.tasks import job_queue
+from .db.database import Base, engine, add_missing_columns
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+
+
+async def _serve():
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    if settings.job_event_bus == 'local':
+        logger.warning('JOB_EVENT_BUS is local: the progress of the jobs does not reach the API processes')
+    await startup()
+    await stopping.wait()
+    logger.info('Stopping... waiting for running jobs to finish')
+    await job_queue.drain()
+    await shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued Governed-Run jobs.')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='The number of jobs to run at once (default: JOB_WORKERS)',
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if os.environ.get('DEBUG', '') == '1' else logging.INFO)
+    if args.workers is not None:
+        job_queue.max_workers = args.workers
+    if job_queue.max_workers <= 0:
+        parser.error('The number of workers must be positive')
+    try:
+        log_store.check_host()
+    except RuntimeError as e:
+        parser.error(str(e))
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    asyncio.run(_serve())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import time
+
+from governedrunner.api.cache import LRUCache, token_hash
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _cache(monkeypatch, maxsize=2, ttl=10.0):
+    clock = FakeClock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    return LRUCache(maxsize, ttl), clock
+
+
+def test_token_hash_hides_token():
+    digest = token_hash('secret-token')
+    assert 'secret-token' not in digest
+    assert digest == token_hash('secret-token')
+    assert digest != token_hash('another-token')
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+    cache.set('a', 1, etag='"v1"')
+    assert cache.get('a').fresh
+    clock.now += 10.0
+    entry = cache.get('a')
+    # Expired entries are kept for revalidation
+    assert entry is not None
+    assert not entry.fresh
+    assert entry.etag == '"v1"'
+
+
+def test_touch_extends_ttl(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+    cache.set('a', 1)
+    clock.now += 9.0
+    cache.touch('a')
+    clock.now += 9.0
+    assert cache.get('a').fresh
+
+
+def test_set_with_custom_ttl(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+    cache.set('a', 1, ttl=1.0)
+    clock.now += 1.0
+    assert not cache.get('a').fresh
+
+
+def test_evicts_least_recently_used(monkeypatch):
+    cache, _ = _cache(monkeypatch, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a').value == 1
+    assert cache.get('c').value == 3
+    assert len(cache) == 2
+
+
+def test_disabled_cache_keeps_nothing(monkeypatch):
+    for maxsize, ttl in [(0, 10.0), (2, 0.0)]:
+        cache, _ = _cache(monkeypatch, maxsize=maxsize, ttl=ttl)
+        assert not cache.enabled
+        assert cache.set('a', 1).value == 1
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+
+def test_pop_and_clear(monkeypatch):
+    cache, _ = _cache(monkeypatch)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.pop('a').value == 1
+    assert cache.pop('a') is None
+    assert [key for key, _ in cache.items()] == ['b']
+    cache.clear()
+    assert len(cache) == 0
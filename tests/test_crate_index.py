@@ -0,0 +1,203 @@
+import asyncio
+import json
+
+from fastapi import HTTPException
+import pytest
+
+from governedrunner.job import crates
+from governedrunner.job.crates import IndexManifest, compact_index, read_index, segment_name
+
+
+FOLDER_URL = 'https://files.example.com/v1/resources/abcde/providers/osfstorage/.crates/'
+
+
+def _file(name, size=None):
+    return {
+        'attributes': {'name': name, 'size': size},
+        'links': {
+            'download': f'https://files.example.com/download/{name}',
+            'delete': f'https://files.example.com/download/{name}',
+        },
+    }
+
+
+def _entry(id, notebook='a.ipynb'):
+    return {'id': id, 'notebook': notebook}
+
+
+class FakeRDM:
+    def __init__(self, contents):
+        self.contents = contents
+        self.downloads = []
+
+    def _content(self, url):
+        self.downloads.append(url)
+        name = url.rsplit('/', 1)[-1]
+        if name not in self.contents:
+            raise HTTPException(status_code=404)
+        return self.contents[name]
+
+    async def get_text(self, url):
+        return ''.join(json.dumps(entry) + '\n' for entry in self._content(url))
+
+    async def get(self, url):
+        return self._content(url)
+
+
+def _use_listings(monkeypatch, *listings):
+    listings = list(listings)
+    async def list_manifest(rdm, folder_url):
+        files = listings.pop(0) if len(listings) > 1 else listings[0]
+        return IndexManifest.from_files(files)
+    monkeypatch.setattr(crates, '_list_manifest', list_manifest)
+
+
+def test_manifest_orders_segments_oldest_first():
+    names = [
+        segment_name('202402', '20240201T000000000000', 'b'),
+        segment_name('202401', '20240131T000000000000', 'a'),
+        segment_name('202402', '20240201T000000000000', 'a'),
+        'index-202312-000001.jsonl',
+        'result.ipynb',
+    ]
+    manifest = IndexManifest.from_files([_file(name, size=10) for name in names])
+    assert [segment.name for segment in manifest.segments] == [
+        'index-202312-000001.jsonl',
+        names[1],
+        names[2],
+        names[0],
+    ]
+    assert manifest.segments[0].writer == ''
+    assert manifest.segments[1].size == 10
+    assert manifest.legacy_file is None
+
+
+def test_manifest_reads_legacy_index_until_imported():
+    manifest = IndexManifest.from_files([_file('index.json')])
+    assert manifest.legacy_file['attributes']['name'] == 'index.json'
+    manifest = IndexManifest.from_files([_file('index.json'), _file('index.manifest.json')])
+    assert manifest.legacy_file is None
+
+
+def test_read_index_returns_newest_first(monkeypatch):
+    old = segment_name('202401', '20240101T000000000000', 'a')
+    new = segment_name('202402', '20240201T000000000000', 'a')
+    rdm = FakeRDM({
+        'index.json': [_entry('0')],
+        old: [_entry('1'), _entry('2')],
+        new: [_entry('3'), _entry('4', notebook='b.ipynb')],
+    })
+    _use_listings(monkeypatch, [_file(name) for name in rdm.contents])
+    entries = asyncio.run(read_index(rdm, FOLDER_URL))
+    assert [entry['id'] for entry in entries] == ['4', '3', '2', '1', '0']
+    entries = asyncio.run(read_index(rdm, FOLDER_URL, notebook='a.ipynb'))
+    assert [entry['id'] for entry in entries] == ['3', '2', '1', '0']
+
+
+def test_read_index_stops_at_limit(monkeypatch):
+    old = segment_name('202401', '20240101T000000000000', 'a')
+    new = segment_name('202402', '20240201T000000000000', 'a')
+    rdm = FakeRDM({old: [_entry('1')], new: [_entry('2'), _entry('3')]})
+    _use_listings(monkeypatch, [_file(name) for name in rdm.contents])
+    entries = asyncio.run(read_index(rdm, FOLDER_URL, limit=2))
+    assert [entry['id'] for entry in entries] == ['3', '2']
+    assert len(rdm.downloads) == 1
+
+
+def test_read_index_drops_entries_left_by_compaction(monkeypatch):
+    source = segment_name('202401', '20240101T000000000000', 'a')
+    merged = segment_name('202401', '20240101T000000000000', 'c0000000a0000')
+    rdm = FakeRDM({
+        source: [_entry('1')],
+        merged: [_entry('1'), _entry('2')],
+    })
+    _use_listings(monkeypatch, [_file(name) for name in rdm.contents])
+    entries = asyncio.run(read_index(rdm, FOLDER_URL))
+    assert [entry['id'] for entry in entries] == ['2', '1']
+
+
+def test_read_index_lists_again_if_segment_disappears(monkeypatch):
+    source = segment_name('202401', '20240101T000000000000', 'a')
+    merged = segment_name('202401', '20240102T000000000000', 'c0000000a0000')
+    rdm = FakeRDM({merged: [_entry('1')]})
+    # The source was removed by a compaction after the first listing
+    _use_listings(monkeypatch, [_file(source)], [_file(merged)])
+    entries = asyncio.run(read_index(rdm, FOLDER_URL))
+    assert [entry['id'] for entry in entries] == ['1']
+
+
+def test_read_index_gives_up_after_attempts(monkeypatch):
+    source = segment_name('202401', '20240101T000000000000', 'a')
+    rdm = FakeRDM({})
+    _use_listings(monkeypatch, [_file(source)])
+    with pytest.raises(HTTPException):
+        asyncio.run(read_index(rdm, FOLDER_URL))
+    assert len(rdm.downloads) == crates.INDEX_READ_ATTEMPTS
+
+
+class FakeFolder(FakeRDM):
+    '''
+    A folder whose files are created and deleted by the index functions.
+    '''
+
+    def files(self):
+        return [_file(name, size=len(json.dumps(content))) for name, content in self.contents.items()]
+
+    async def delete(self, url):
+        self._content(url)
+        del self.contents[url.rsplit('/', 1)[-1]]
+
+    def invalidate(self, url):
+        pass
+
+
+def _use_folder(monkeypatch, folder):
+    async def list_manifest(rdm, folder_url):
+        return IndexManifest.from_files(folder.files())
+    async def create_file(rdm, folder_url, filename, json=None, content=None, kind='file'):
+        if filename in folder.contents:
+            raise HTTPException(status_code=409)
+        folder.contents[filename] = json if content is None else crates._decode_entries(content.decode('utf-8'))
+        return _file(filename)
+    monkeypatch.setattr(crates, '_list_manifest', list_manifest)
+    monkeypatch.setattr(crates, 'create_file', create_file)
+
+
+def test_compaction_imports_legacy_index_once(monkeypatch):
+    legacy = [
+        dict(_entry('1'), created_at='2023-12-01T00:00:00+00:00'),
+        dict(_entry('2'), created_at='2024-01-01T00:00:00+00:00'),
+    ]
+    appended = segment_name('202401', '20240102T000000000000', 'a')
+    folder = FakeFolder({
+        'index.json': legacy,
+        appended: [dict(_entry('3'), created_at='2024-01-02T00:00:00+00:00')],
+    })
+    _use_folder(monkeypatch, folder)
+    asyncio.run(compact_index(folder, FOLDER_URL, min_segments=100))
+    assert folder.contents['index.manifest.json']['imported'] == 'index.json'
+    assert len(folder.contents['index.manifest.json']['segments']) == 2
+    folder.downloads.clear()
+    entries = asyncio.run(read_index(folder, FOLDER_URL))
+    assert [entry['id'] for entry in entries] == ['3', '2', '1']
+    assert not any(url.endswith('/index.json') for url in folder.downloads)
+    # Already imported
+    names = set(folder.contents)
+    asyncio.run(compact_index(folder, FOLDER_URL, min_segments=100))
+    assert set(folder.contents) == names
+
+
+def test_compaction_absorbs_imported_segments(monkeypatch):
+    folder = FakeFolder({
+        'index.json': [dict(_entry('1'), created_at='2024-01-01T00:00:00+00:00')],
+        segment_name('202401', '20240102T000000000000', 'a'): [
+            dict(_entry('2'), created_at='2024-01-02T00:00:00+00:00'),
+        ],
+    })
+    _use_folder(monkeypatch, folder)
+    assert asyncio.run(compact_index(folder, FOLDER_URL, min_segments=2)) == 2
+    segments = IndexManifest.from_files(folder.files()).segments
+    assert len(segments) == 1
+    assert [entry['id'] for entry in folder.contents[segments[0].name]] == ['1', '2']
+    entries = asyncio.run(read_index(folder, FOLDER_URL))
+    assert [entry['id'] for entry in entries] == ['2', '1']
@@ -0,0 +1,50 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from governedrunner.api.auth import get_username
+from governedrunner.api.logstore import JobLogStore
+from governedrunner.api.models import job as job_models
+from governedrunner.api.routers import job
+from governedrunner.db.database import Base, get_async_db
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / 'jobs.db'
+    Base.metadata.create_all(bind=create_engine(f'sqlite:///{path}'))
+    # Each request of the client may run on its own event loop
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}', poolclass=NullPool)
+    sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+    async def get_test_db():
+        async with sessions() as db:
+            yield db
+    monkeypatch.setattr(job_models, 'log_store', JobLogStore(str(tmp_path / 'logs'), 1024))
+    app = FastAPI()
+    app.include_router(job.router)
+    app.dependency_overrides[get_async_db] = get_test_db
+    app.dependency_overrides[get_username] = lambda: 'user'
+    return TestClient(app)
+
+
+def test_create_and_retrieve_job(client):
+    resp = client.post('/jobs/', data={'file_url': 'https://example.com/crate.json'})
+    assert resp.status_code == 200
+    created = resp.json()
+    assert created['status'] == 'queued'
+    assert created['source'] == {'url': 'crate+https://example.com/crate.json'}
+    assert created['progress']['url'].endswith(f'/ws/jobs/{created["id"]}/progress')
+    assert created['notebook'] is None
+    job_models.log_store.append(created['id'], 'log\n')
+    resp = client.get(f'/jobs/{created["id"]}')
+    assert resp.status_code == 200
+    retrieved = resp.json()
+    assert retrieved['id'] == created['id']
+    assert (retrieved['log'], retrieved['log_size']) == ('log\n', 4)
+
+
+def test_retrieve_unknown_job(client):
+    assert client.get('/jobs/unknown').status_code == 404
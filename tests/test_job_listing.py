@@ -0,0 +1,116 @@
+import asyncio
+import base64
+from datetime import datetime, timedelta, timezone
+import json
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from governedrunner.api.logstore import JobLogStore
+from governedrunner.api.models import job as job_models
+from governedrunner.api.routers.job import _decode_cursor, _encode_cursor, retrieve_jobs
+from governedrunner.db.database import Base
+from governedrunner.db.models import Job, User
+
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_cursor_round_trip():
+    job = SimpleNamespace(updated_at=NOW, id='job')
+    assert _decode_cursor(_encode_cursor(job)) == (NOW, 'job')
+
+
+@pytest.mark.parametrize('value', ['[1]', '{"a": 1}', '[1, 2]', '["yesterday", "job"]'])
+def test_invalid_cursor_content(value):
+    cursor = base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+    with pytest.raises(HTTPException) as e:
+        _decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize('cursor', ['!!!', 'カーソル', ''])
+def test_invalid_cursor_encoding(cursor):
+    with pytest.raises(HTTPException) as e:
+        _decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def _list_all(tmp_path, jobs, size, fields=None):
+    async def main():
+        engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "jobs.db"}')
+        sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with sessions() as db:
+                user = User(name='user', created_at=NOW, updated_at=NOW)
+                other = User(name='other', created_at=NOW, updated_at=NOW)
+                db.add_all([user, other])
+                await db.flush()
+                for job_id, minutes, owner, *log in jobs:
+                    db.add(Job(
+                        id=job_id,
+                        owner_id=(user if owner == 'user' else other).id,
+                        status='completed',
+                        created_at=NOW,
+                        updated_at=NOW + timedelta(minutes=minutes),
+                        log=log[0] if log else None,
+                    ))
+                await db.commit()
+                pages = []
+                cursor = None
+                while True:
+                    resp = await retrieve_jobs(
+                        current_user=user, state=None, notebook=None, fields=fields,
+                        cursor=cursor, size=size, db=db,
+                    )
+                    page = json.loads(resp.body)
+                    pages.append(page['items'] if fields is not None else [item['id'] for item in page['items']])
+                    cursor = page['next_cursor']
+                    if cursor is None:
+                        return pages
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+def test_lists_newest_first_across_pages(tmp_path):
+    pages = _list_all(tmp_path, [
+        ('a', 0, 'user'),
+        ('b', 1, 'user'),
+        ('c', 1, 'user'),
+        ('d', 2, 'user'),
+        ('e', 3, 'other'),
+        ('f', 4, 'user'),
+    ], size=2)
+    # Jobs updated at the same time are ordered by ID
+    assert pages == [['f', 'd'], ['c', 'b'], ['a']]
+
+
+def test_lists_single_page(tmp_path):
+    pages = _list_all(tmp_path, [('a', 0, 'user'), ('b', 1, 'user')], size=2)
+    assert pages == [['b', 'a']]
+
+
+def test_lists_log_tails_only_when_requested(tmp_path, monkeypatch):
+    store = JobLogStore(str(tmp_path / 'logs'), 1024)
+    store.append('stored', 'ログ\n')
+    monkeypatch.setattr(job_models, 'log_store', store)
+    jobs = [
+        ('stored', 1, 'user'),
+        ('legacy', 0, 'user', 'legacy log\n'),
+    ]
+    pages = _list_all(tmp_path, jobs, size=10, fields='id,log,log_size')
+    assert pages == [[
+        {'id': 'stored', 'log': 'ログ\n', 'log_size': 7},
+        {'id': 'legacy', 'log': 'legacy log\n', 'log_size': 11},
+    ]]
+    (tmp_path / 'jobs.db').unlink()
+    pages = _list_all(tmp_path, jobs, size=10, fields='id,notebook')
+    assert pages == [[
+        {'id': 'stored', 'notebook': None},
+        {'id': 'legacy', 'notebook': None},
+    ]]
@@ -0,0 +1,60 @@
+import asyncio
+
+from governedrunner.api.tasks import logs
+from governedrunner.api.tasks.logs import JobLogWriter
+from governedrunner.job.runner import LOG_TAIL_MARKER, LogTail
+
+
+def test_log_tail_keeps_last_chunks():
+    tail = LogTail(10)
+    for line in ['line 1\n', 'line 2\n', 'line 3\n']:
+        tail.append(line)
+    assert tail.text() == LOG_TAIL_MARKER + 'line 3\n'
+    assert tail.size == 7
+
+
+def test_log_tail_trims_large_chunk():
+    tail = LogTail(4)
+    tail.append('abcdeあ')
+    assert tail.text() == LOG_TAIL_MARKER + 'eあ'
+    assert tail.size == 4
+    tail = LogTail(3)
+    tail.append('aあb')
+    # The split character is dropped as well
+    assert tail.text() == LOG_TAIL_MARKER + 'b'
+    assert tail.size == 1
+
+
+def test_log_tail_within_limit():
+    tail = LogTail(1024)
+    tail.append('log\n')
+    assert tail.text() == 'log\n'
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def commit(self):
+        pass
+
+
+def test_writer_flushes_by_bytes(monkeypatch):
+    appended = []
+    async def append_log(db, job_id, log):
+        appended.append(log)
+    monkeypatch.setattr(logs, 'append_log', append_log)
+    monkeypatch.setattr(logs, 'AsyncSessionLocal', FakeSession)
+    async def run():
+        writer = JobLogWriter('job', 60.0, 30, 0)
+        # 10 characters, 30 bytes
+        writer.write('あ' * 10)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        flushed = list(appended)
+        await writer.close()
+        return flushed
+    assert asyncio.run(run()) == ['あ' * 10]
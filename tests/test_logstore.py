@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from governedrunner.api import logstore
+from governedrunner.api.logstore import JobLogStore, char_boundaries
+
+
+def test_char_boundaries_of_complete_text():
+    data = 'aあb'.encode('utf-8')
+    assert char_boundaries(data) == (0, len(data))
+    assert char_boundaries(b'') == (0, 0)
+
+
+def test_char_boundaries_drop_split_characters():
+    data = 'あいう'.encode('utf-8')
+    # Starts in the middle of 'あ' and ends in the middle of 'う'
+    start, end = char_boundaries(data[1:-1])
+    assert data[1:-1][start:end].decode('utf-8') == 'い'
+    # A four-byte character cut after its lead byte
+    data = 'a😀'.encode('utf-8')[:2]
+    assert char_boundaries(data) == (0, 1)
+
+
+def test_appends_across_segments(tmp_path):
+    store = JobLogStore(str(tmp_path), segment_size=8)
+    assert not store.exists('job')
+    assert store.size('job') == 0
+    for line in ['line 1\n', 'line 2\n', 'line 3\n']:
+        store.append('job', line)
+    store.append('job', '')
+    assert store.exists('job')
+    assert store.size('job') == 21
+    assert sorted(os.listdir(tmp_path / 'job')) == [
+        f'{start:020d}.log' for start in (0, 7, 14)
+    ]
+    assert store.read_bytes('job', 5, 10) == b'1\nline 2\nl'
+    assert store.tail('job', 7) == 'line 3\n'
+
+
+def test_read_from_offset(tmp_path):
+    store = JobLogStore(str(tmp_path), segment_size=4)
+    store.append('job', 'ログ\n')
+    chunk = store.read('job', 1, 5)
+    # The split characters at both edges are left for the next read
+    assert (chunk.offset, chunk.next_offset, chunk.text) == (3, 6, 'グ')
+    assert chunk.size == 7
+    chunk = store.read('job', 100, 5)
+    assert (chunk.offset, chunk.next_offset, chunk.text) == (7, 7, '')
+
+
+def test_read_tail(tmp_path):
+    store = JobLogStore(str(tmp_path), segment_size=1024)
+    store.append('job', 'abcdef')
+    chunk = store.read('job', None, 4)
+    assert (chunk.offset, chunk.next_offset, chunk.text) == (2, 6, 'cdef')
+    assert store.read('missing', None, 4).text == ''
+
+
+@pytest.mark.parametrize('job_id', ['', '.', '..', '../job', 'a/b'])
+def test_rejects_invalid_job_ids(tmp_path, job_id):
+    store = JobLogStore(str(tmp_path), segment_size=1024)
+    with pytest.raises(ValueError):
+        store.append(job_id, 'log')
+
+
+def test_log_directory_is_claimed_by_one_host(tmp_path, monkeypatch):
+    store = JobLogStore(str(tmp_path / 'logs'), segment_size=1024)
+    monkeypatch.setattr(logstore.socket, 'gethostname', lambda: 'host-a')
+    store.check_host()
+    store.check_host()
+    monkeypatch.setattr(logstore.socket, 'gethostname', lambda: 'host-b')
+    with pytest.raises(RuntimeError, match='host-a'):
+        store.check_host()
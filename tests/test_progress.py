@@ -0,0 +1,125 @@
+import asyncio
+from types import SimpleNamespace
+
+from governedrunner.api.tasks import progress
+from governedrunner.api.tasks.progress import ProgressBroadcaster, ProgressHub
+
+
+def test_read_coalesces_events_from_offset():
+    broadcaster = ProgressBroadcaster('job', 1024)
+    broadcaster.publish('running', 'line 1\n')
+    broadcaster.publish('running', 'line 2\n')
+    frame = broadcaster.read(5, 1024)
+    assert frame.to_json() == {
+        'status': 'running',
+        'log': '1\nline 2\n',
+        'offset': 5,
+        'next_offset': 14,
+    }
+    assert not frame.finished
+
+
+def test_read_does_not_split_characters():
+    broadcaster = ProgressBroadcaster('job', 1024)
+    broadcaster.publish('running', 'あい')
+    frame = broadcaster.read(0, 4)
+    assert (frame.log, frame.next_offset) == ('あ', 3)
+    frame = broadcaster.read(frame.next_offset, 4)
+    assert (frame.log, frame.next_offset) == ('い', 6)
+
+
+def test_finished_once_caught_up():
+    broadcaster = ProgressBroadcaster('job', 1024)
+    broadcaster.publish('running', 'log\n')
+    broadcaster.finish('completed')
+    frame = broadcaster.read(0, 2)
+    assert (frame.status, frame.finished) == ('running', False)
+    frame = broadcaster.read(frame.next_offset, 1024)
+    assert (frame.status, frame.finished) == ('completed', True)
+
+
+def test_old_events_are_evicted():
+    broadcaster = ProgressBroadcaster('job', 10)
+    for i in range(5):
+        broadcaster.publish('running', f'line{i}\n')
+    assert broadcaster.end_offset == 30
+    assert broadcaster.start_offset == 24
+    assert broadcaster.buffered_bytes <= 10
+
+
+def test_events_at_offsets():
+    broadcaster = ProgressBroadcaster('job', 1024)
+    broadcaster.publish('running', 'abc', 0)
+    # Already buffered in part
+    broadcaster.publish('running', 'bcde', 1)
+    assert broadcaster.read(0, 1024).log == 'abcde'
+    # Some events were missed
+    broadcaster.publish('running', 'xyz', 10)
+    assert (broadcaster.start_offset, broadcaster.end_offset) == (10, 13)
+    assert broadcaster.read(10, 1024).log == 'xyz'
+
+
+def test_starts_at_offset():
+    broadcaster = ProgressBroadcaster('job', 1024, 100)
+    assert (broadcaster.start_offset, broadcaster.end_offset) == (100, 100)
+    broadcaster.publish('running', 'log', 100)
+    assert broadcaster.read(100, 1024).to_json()['next_offset'] == 103
+
+
+def test_wait_for_updates():
+    async def run():
+        broadcaster = ProgressBroadcaster('job', 1024)
+        broadcaster.publish('running', 'a')
+        waiter = asyncio.ensure_future(broadcaster.wait(1, 'running'))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        broadcaster.publish('running', 'b')
+        await asyncio.wait_for(waiter, timeout=1.0)
+        # A status change wakes up the subscriber as well
+        waiter = asyncio.ensure_future(broadcaster.wait(2, 'running'))
+        await asyncio.sleep(0)
+        broadcaster.publish('completed', '')
+        await asyncio.wait_for(waiter, timeout=1.0)
+    asyncio.run(run())
+
+
+class FakeEventBus:
+    def __init__(self):
+        self.listeners = {}
+
+    def subscribe(self, job_id, listener):
+        self.listeners.setdefault(job_id, []).append(listener)
+
+    def unsubscribe(self, job_id, listener):
+        self.listeners[job_id].remove(listener)
+
+
+def test_hub_starts_at_end_of_stored_log(monkeypatch):
+    event_bus = FakeEventBus()
+    monkeypatch.setattr(progress, 'event_bus', event_bus)
+    monkeypatch.setattr(progress, 'log_store', SimpleNamespace(size=lambda job_id: 42))
+    hub = ProgressHub(1024, 60.0)
+    async def open_twice():
+        return await asyncio.gather(hub.open('job'), hub.open('job'))
+    broadcaster, again = asyncio.run(open_twice())
+    assert again is broadcaster
+    assert len(event_bus.listeners['job']) == 1
+    # The log before the offset is read from the log store
+    assert (broadcaster.start_offset, broadcaster.end_offset) == (42, 42)
+    event_bus.listeners['job'][0]({'status': 'running', 'log': 'next\n', 'offset': 42})
+    assert broadcaster.read(42, 1024).log == 'next\n'
+
+
+def test_hub_finishes_and_removes_broadcaster(monkeypatch):
+    event_bus = FakeEventBus()
+    monkeypatch.setattr(progress, 'event_bus', event_bus)
+    monkeypatch.setattr(progress, 'log_store', SimpleNamespace(size=lambda job_id: 0))
+    async def run():
+        hub = ProgressHub(1024, 0.01)
+        broadcaster = await hub.open('job')
+        hub.finish('job', 'failed', 0)
+        assert broadcaster.finished
+        await asyncio.sleep(0.05)
+        assert hub.get('job') is None
+        assert event_bus.listeners['job'] == []
+    asyncio.run(run())
@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from governedrunner.api.tasks import job as job_tasks
+from governedrunner.api.tasks import queue
+from governedrunner.api.tasks.job import JobUpdater, LeaseLostError
+from governedrunner.api.tasks.queue import JobQueue
+from governedrunner.db.database import Base
+from governedrunner.db.models import Job
+
+
+NOW = datetime.now(timezone.utc)
+
+
+def _job(id, owner_id, status, minutes=0, lease_owner=None, lease_minutes=None):
+    return Job(
+        id=id,
+        owner_id=owner_id,
+        status=status,
+        created_at=NOW + timedelta(minutes=minutes),
+        updated_at=NOW + timedelta(minutes=minutes),
+        lease_owner=lease_owner,
+        lease_expires_at=None if lease_minutes is None else NOW + timedelta(minutes=lease_minutes),
+    )
+
+
+def _run(tmp_path, monkeypatch, test, jobs):
+    '''
+    Run the test against a new SQLite database holding the jobs.
+    '''
+    async def main():
+        engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "jobs.db"}')
+        sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+        monkeypatch.setattr(queue, 'AsyncSessionLocal', sessions)
+        monkeypatch.setattr(job_tasks, 'AsyncSessionLocal', sessions)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with sessions() as db:
+            db.add_all(jobs)
+            await db.commit()
+        try:
+            return await test(sessions)
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+async def _jobs(sessions):
+    async with sessions() as db:
+        return {job.id: job for job in (await db.scalars(select(Job))).all()}
+
+
+def _queue():
+    return JobQueue(2, 1.0, 60.0)
+
+
+def test_claims_job_of_user_with_fewest_active_jobs(tmp_path, monkeypatch):
+    job_queue = _queue()
+    async def test(sessions):
+        claimed = []
+        async with sessions() as db:
+            for _ in range(3):
+                claimed.append(await job_queue._claim_next(db))
+        return claimed, await _jobs(sessions)
+    claimed, jobs = _run(tmp_path, monkeypatch, test, [
+        _job('active', 1, 'running', lease_owner='other', lease_minutes=1),
+        _job('older', 1, 'queued', minutes=1),
+        _job('newer', 2, 'queued', minutes=2),
+    ])
+    assert claimed == ['newer', 'older', None]
+    for job_id in ['newer', 'older']:
+        assert jobs[job_id].status == 'building'
+        assert jobs[job_id].lease_owner == job_queue.worker_id
+        assert jobs[job_id].lease_expires_at is not None
+
+
+def test_concurrent_queues_claim_each_job_once(tmp_path, monkeypatch):
+    job_queues = [_queue(), _queue()]
+    async def claim_all(sessions, job_queue):
+        claimed = []
+        async with sessions() as db:
+            while True:
+                job_id = await job_queue._claim_next(db)
+                if job_id is None:
+                    return claimed
+                claimed.append(job_id)
+                await asyncio.sleep(0)
+    async def test(sessions):
+        return await asyncio.gather(*[claim_all(sessions, q) for q in job_queues])
+    first, second = _run(tmp_path, monkeypatch, test, [
+        _job(f'job{i}', i % 3, 'queued', minutes=i) for i in range(10)
+    ])
+    assert set(first).isdisjoint(second)
+    assert sorted(first + second) == sorted(f'job{i}' for i in range(10))
+
+
+def test_expires_jobs_without_live_lease(tmp_path, monkeypatch):
+    logs = []
+    published = []
+    async def append_log(db, job_id, log):
+        logs.append((job_id, log))
+    monkeypatch.setattr(queue, 'append_log', append_log)
+    monkeypatch.setattr(queue, 'publish_progress', lambda *args: published.append(args))
+    monkeypatch.setattr(queue, 'log_store', SimpleNamespace(size=lambda job_id: 10))
+    job_queue = _queue()
+    async def test(sessions):
+        async with sessions() as db:
+            await job_queue._expire_leases(db)
+        return await _jobs(sessions)
+    jobs = _run(tmp_path, monkeypatch, test, [
+        _job('expired', 1, 'running', lease_owner='gone', lease_minutes=-1),
+        _job('unleased', 1, 'building'),
+        _job('alive', 1, 'running', lease_owner='other', lease_minutes=1),
+        _job('finished', 1, 'completed', lease_owner='gone', lease_minutes=-1),
+    ])
+    assert jobs['expired'].status == 'failed'
+    assert jobs['unleased'].status == 'failed'
+    assert jobs['alive'].status == 'running'
+    assert jobs['finished'].status == 'completed'
+    assert sorted(job_id for job_id, _ in logs) == ['expired', 'unleased']
+    assert ('expired', 'Lease expired: gone\n') in logs
+    assert sorted((job_id, status, offset) for job_id, status, _, offset in published) == [
+        ('expired', 'failed', 10),
+        ('unleased', 'failed', 10),
+    ]
+
+
+def test_renews_only_own_leases(tmp_path, monkeypatch):
+    job_queue = _queue()
+    job_queue._workers = {'own': None, 'taken': None}
+    async def test(sessions):
+        before = await _jobs(sessions)
+        async with sessions() as db:
+            await job_queue._renew_leases(db)
+        return before, await _jobs(sessions)
+    before, after = _run(tmp_path, monkeypatch, test, [
+        _job('own', 1, 'running', lease_owner=job_queue.worker_id, lease_minutes=0),
+        _job('taken', 1, 'running', lease_owner='other', lease_minutes=0),
+    ])
+    assert after['own'].lease_expires_at > before['own'].lease_expires_at
+    assert after['taken'].lease_expires_at == before['taken'].lease_expires_at
+
+
+def test_updater_stops_writing_after_lease_is_lost(tmp_path, monkeypatch):
+    async def test(sessions):
+        updater = JobUpdater('job', 'worker')
+        await updater.update(status='running')
+        async with sessions() as db:
+            job = await db.get(Job, 'job')
+            job.lease_owner = 'another-worker'
+            await db.commit()
+        with pytest.raises(LeaseLostError):
+            await updater.update(status='completed')
+        return await _jobs(sessions)
+    jobs = _run(tmp_path, monkeypatch, test, [
+        _job('job', 1, 'building', lease_owner='worker', lease_minutes=1),
+    ])
+    assert jobs['job'].status == 'running'
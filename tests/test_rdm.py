@@ -0,0 +1,192 @@
+import asyncio
+import copy
+from types import SimpleNamespace
+
+import pytest
+
+from governedrunner.api import rdm
+from governedrunner.api.cache import LRUCache
+from governedrunner.api.rdm import RDMService
+
+
+FOLDER_URL = 'https://files.example.com/v1/resources/abcde/providers/osfstorage/folder/'
+FILE_URL = 'https://files.example.com/v1/resources/abcde/providers/osfstorage/folder/file.txt'
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=None, etag=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {} if etag is None else {'ETag': etag}
+
+    def json(self):
+        return copy.deepcopy(self.content)
+
+
+class FakeServer:
+    '''
+    Answers the requests of RDMService, optionally holding them until released.
+    '''
+
+    def __init__(self):
+        self.requests = []
+        self.contents = {}
+        self.etags = {}
+        self.gate = None
+
+    async def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url, headers or {}))
+        if self.gate is not None:
+            await self.gate.wait()
+        etag = self.etags.get(url, None)
+        if etag is not None and (headers or {}).get('If-None-Match', None) == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.contents.get(url, {}), etag=etag)
+
+    def gets(self, url):
+        return [r for r in self.requests if r[0] == 'GET' and r[1] == url]
+
+
+def _service(token='token-a'):
+    return RDMService(SimpleNamespace(
+        rdm_token=SimpleNamespace(token=token, service_id=rdm.settings.rdm_service_id),
+    ))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(RDMService, '_request', server.request)
+    monkeypatch.setattr(rdm, 'metadata_cache', LRUCache(16, 30.0))
+    monkeypatch.setattr(rdm, '_invalidated_paths', type(rdm._invalidated_paths)())
+    monkeypatch.setattr(rdm, '_generation', 0)
+    monkeypatch.setattr(rdm, '_forgotten_generation', 0)
+    monkeypatch.setattr(rdm, '_inflight_gets', {})
+    return server
+
+
+def test_folder_listing_is_cached(server):
+    server.contents[FOLDER_URL] = {'data': []}
+    async def run():
+        service = _service()
+        await service.get(FOLDER_URL)
+        return await service.get(FOLDER_URL)
+    assert asyncio.run(run()) == {'data': []}
+    assert len(server.gets(FOLDER_URL)) == 1
+
+
+def test_cache_is_per_token(server):
+    async def run():
+        await _service('token-a').get(FOLDER_URL)
+        await _service('token-b').get(FOLDER_URL)
+    asyncio.run(run())
+    assert len(server.gets(FOLDER_URL)) == 2
+
+
+def test_file_contents_are_not_cached(server):
+    async def run():
+        service = _service()
+        await service.get(FILE_URL)
+        await service.get(FILE_URL)
+    asyncio.run(run())
+    assert len(server.gets(FILE_URL)) == 2
+
+
+def test_expired_listing_is_revalidated(server):
+    server.contents[FOLDER_URL] = {'data': [{'id': 'a'}]}
+    server.etags[FOLDER_URL] = '"v1"'
+    async def run():
+        service = _service()
+        await service.get(FOLDER_URL)
+        for _, entry in rdm.metadata_cache.items():
+            entry.expires_at = 0
+        return await service.get(FOLDER_URL)
+    assert asyncio.run(run()) == {'data': [{'id': 'a'}]}
+    requests = server.gets(FOLDER_URL)
+    assert len(requests) == 2
+    assert requests[1][2]['If-None-Match'] == '"v1"'
+
+
+def test_put_invalidates_parent_listing(server):
+    async def run():
+        service = _service()
+        await service.get(FOLDER_URL)
+        await service.put(FILE_URL, content=b'data')
+        await service.get(FOLDER_URL)
+    asyncio.run(run())
+    assert len(server.gets(FOLDER_URL)) == 2
+
+
+def test_new_file_invalidates_folder_listing(server):
+    server.contents[FOLDER_URL] = {'data': []}
+    async def run():
+        service = _service()
+        await service.get(FOLDER_URL)
+        # The folder listing does not link the new file yet
+        await service.put(f'{FOLDER_URL}?kind=file&name=new.txt', content=b'data')
+        await service.get(FOLDER_URL)
+    asyncio.run(run())
+    assert len(server.gets(FOLDER_URL)) == 2
+
+def test_listing_modified_in_flight_is_not_cached(server):
+    server.contents[FOLDER_URL] = {'data': []}
+    async def run():
+        service = _service()
+        server.gate = asyncio.Event()
+        listing = asyncio.ensure_future(service.get(FOLDER_URL))
+        await asyncio.sleep(0)
+        # The folder is modified while its listing is being retrieved
+        rdm.invalidate_metadata(FILE_URL)
+        server.gate.set()
+        await listing
+        server.gate = None
+        await service.get(FOLDER_URL)
+    asyncio.run(run())
+    assert len(server.gets(FOLDER_URL)) == 2
+
+
+def test_concurrent_gets_share_one_request(server, monkeypatch):
+    monkeypatch.setitem(rdm.singleflight_stats, 'calls', 0)
+    monkeypatch.setitem(rdm.singleflight_stats, 'deduplicated', 0)
+    server.contents[FILE_URL] = {'data': {'id': 'a'}}
+    async def run():
+        server.gate = asyncio.Event()
+        gets = [asyncio.ensure_future(_service().get(FILE_URL)) for _ in range(3)]
+        await asyncio.sleep(0)
+        server.gate.set()
+        return await asyncio.gather(*gets)
+    results = asyncio.run(run())
+    assert len(server.gets(FILE_URL)) == 1
+    assert rdm.singleflight_stats == {'calls': 3, 'deduplicated': 2}
+    # Every caller gets its own copy
+    results[0]['data']['id'] = 'modified'
+    assert results[1] == {'data': {'id': 'a'}}
+
+
+def test_concurrent_gets_with_different_tokens_are_not_shared(server):
+    async def run():
+        server.gate = asyncio.Event()
+        gets = [
+            asyncio.ensure_future(_service('token-a').get(FILE_URL)),
+            asyncio.ensure_future(_service('token-b').get(FILE_URL)),
+        ]
+        await asyncio.sleep(0)
+        server.gate.set()
+        await asyncio.gather(*gets)
+    asyncio.run(run())
+    assert len(server.gets(FILE_URL)) == 2
+
+
+def test_joined_get_retries_when_originator_is_cancelled(server):
+    async def run():
+        server.gate = asyncio.Event()
+        originator = asyncio.ensure_future(_service().get(FILE_URL))
+        await asyncio.sleep(0)
+        joined = asyncio.ensure_future(_service().get(FILE_URL))
+        await asyncio.sleep(0)
+        originator.cancel()
+        await asyncio.sleep(0)
+        server.gate.set()
+        return await joined
+    assert asyncio.run(run()) == {}
+    assert len(server.gets(FILE_URL)) == 2
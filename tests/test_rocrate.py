@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import pytest
+
+from governedrunner.job.rocrate import CrateGraph, find_entity, has_type
+
+
+CRATE = {
+    '@context': 'https://w3id.org/ro/crate/1.1/context',
+    '@graph': [
+        {'@id': 'ro-crate-metadata.json', '@type': 'CreativeWork', 'about': {'@id': './'}},
+        {'@id': './', '@type': 'Dataset', 'name': 'ノートブックの実行'},
+        {'@id': '#action', '@type': 'CreateAction', 'actionStatus': 'CompletedActionStatus'},
+        {'@id': 'result.ipynb', '@type': ['File', 'SoftwareSourceCode']},
+    ],
+}
+
+
+async def _chunks(content: bytes, size: int, pulled=None):
+    for i in range(0, len(content), size):
+        if pulled is not None:
+            pulled.append(i)
+        yield content[i:i + size]
+
+
+def _load(content: bytes, size: int) -> CrateGraph:
+    return asyncio.run(CrateGraph.load(_chunks(content, size)))
+
+
+def test_indexes_entities():
+    graph = asyncio.run(CrateGraph.loads(json.dumps(CRATE).encode('utf-8')))
+    assert graph.members == {'@context': CRATE['@context']}
+    assert graph.get('./')['name'] == 'ノートブックの実行'
+    assert graph.get('missing') is None
+    assert graph.first_of_type('CreateAction')['@id'] == '#action'
+    assert [entity['@id'] for entity in graph.of_type('File')] == ['result.ipynb']
+    assert graph.first_of_type('Person') is None
+    assert has_type(graph.get('result.ipynb'), 'SoftwareSourceCode')
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64])
+def test_chunks_may_split_values_and_characters(size):
+    content = json.dumps(CRATE, ensure_ascii=False, indent=1).encode('utf-8')
+    graph = _load(content, size)
+    assert graph.entities == CRATE['@graph']
+    assert json.loads(graph.dumps()) == CRATE
+
+
+def test_unchanged_entities_keep_their_text():
+    content = (
+        '{"@context": "c", "@graph": [\n'
+        '  {"name": "x",   "@id": "a"},\n'
+        '  {"@id": "b", "@type": "File"}\n'
+        ']}'
+    ).encode('utf-8')
+    graph = _load(content, 5)
+    graph.update(graph.get('b'), {'size': 1})
+    graph.add({'@id': 'c', '@type': 'File'})
+    dumped = graph.dumps().decode('utf-8')
+    assert '{"name": "x",   "@id": "a"}' in dumped
+    assert json.loads(dumped)['@graph'] == [
+        {'name': 'x', '@id': 'a'},
+        {'@id': 'b', '@type': 'File', 'size': 1},
+        {'@id': 'c', '@type': 'File'},
+    ]
+    assert [entity['@id'] for entity in graph.of_type('File')] == ['b', 'c']
+
+
+def test_find_entity_does_not_read_the_rest():
+    entities = [{'@id': '#action', '@type': 'CreateAction'}] + \
+        [{'@id': f'file{i}', '@type': 'File', 'text': 'x' * 100} for i in range(100)]
+    content = json.dumps({'@graph': entities}).encode('utf-8')
+    pulled = []
+    entity = asyncio.run(find_entity(
+        _chunks(content, 64, pulled),
+        lambda entity: has_type(entity, 'CreateAction'),
+    ))
+    assert entity == entities[0]
+    assert len(pulled) < 5
+
+
+def test_find_entity_without_match():
+    content = json.dumps(CRATE).encode('utf-8')
+    entity = asyncio.run(find_entity(_chunks(content, 16), lambda entity: False))
+    assert entity is None
+
+
+def test_truncated_crate():
+    content = json.dumps(CRATE).encode('utf-8')
+    with pytest.raises(ValueError):
+        _load(content[:-10], 16)
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from governedrunner.job.stages import StageGraph
+
+
+def test_stages_receive_required_results():
+    graph = StageGraph()
+    async def a():
+        return 1
+    async def b():
+        return 2
+    async def total(x, y):
+        return x * 10 + y
+    graph.add('total', total, requires=('b', 'a'))
+    graph.add('a', a)
+    graph.add('b', b)
+    results = asyncio.run(graph.run())
+    assert results == {'a': 1, 'b': 2, 'total': 21}
+
+
+def test_independent_stages_overlap():
+    graph = StageGraph()
+    async def main():
+        started = asyncio.Event()
+        async def first():
+            started.set()
+            await asyncio.sleep(0.05)
+        async def second():
+            # Would time out if the stages ran one after the other
+            await asyncio.wait_for(started.wait(), timeout=0.01)
+        graph.add('first', first)
+        graph.add('second', second)
+        await graph.run()
+    asyncio.run(main())
+    assert graph.started_at['second'] < graph.finished_at['first']
+
+
+def test_critical_path_follows_the_slowest_requirement():
+    graph = StageGraph()
+    async def fast():
+        pass
+    async def slow():
+        await asyncio.sleep(0.05)
+    async def last(a, b):
+        pass
+    graph.add('fast', fast)
+    graph.add('slow', slow)
+    graph.add('last', last, requires=('fast', 'slow'))
+    asyncio.run(graph.run())
+    assert graph.critical_path() == ['slow', 'last']
+    assert graph.duration('slow') >= 0.05
+
+
+def test_failure_cancels_other_stages():
+    graph = StageGraph()
+    cancelled = []
+    async def failing():
+        raise RuntimeError('failed')
+    async def waiting():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append('waiting')
+            raise
+    async def dependent(value):
+        pass
+    graph.add('failing', failing)
+    graph.add('waiting', waiting)
+    graph.add('dependent', dependent, requires=('failing',))
+    with pytest.raises(RuntimeError, match='failed'):
+        asyncio.run(graph.run())
+    assert cancelled == ['waiting']
+    assert 'dependent' not in graph.started_at
+
+
+def test_duplicate_stage():
+    graph = StageGraph()
+    async def a():
+        pass
+    graph.add('a', a)
+    with pytest.raises(ValueError, match='Duplicate stage'):
+        graph.add('a', a)
+
+
+def test_unknown_requirement():
+    graph = StageGraph()
+    async def a(value):
+        pass
+    graph.add('a', a, requires=('missing',))
+    with pytest.raises(ValueError, match='Unknown stage: missing'):
+        asyncio.run(graph.run())
+
+
+def test_cyclic_stages():
+    graph = StageGraph()
+    async def stage(value):
+        pass
+    graph.add('a', stage, requires=('b',))
+    graph.add('b', stage, requires=('a',))
+    with pytest.raises(ValueError, match='Cyclic stages'):
+        asyncio.run(graph.run())